@@ -0,0 +1,261 @@
+"""Course attendance analytics on columnar NumPy arrays.
+
+A course's records are loaded once into a CourseFrame: three parallel
+arrays holding the student's position in the roster, the date as a day
+ordinal and the status as an int8 code. Rates, rolling trends, weekday
+heatmaps, at-risk lists and cohort comparisons are then computed with
+bincount/cumsum over those arrays instead of per-row Python or SQL.
+
+Frames are cached per course. Routes that write attendance must call
+invalidate_frames() for the courses they touched; enrollment changes are
+picked up because a frame is only reused while the cached roster it was
+built from is still current (see lookups.course_roster).
+
+invalidate_frames() only reaches this process. Frames also expire after
+ANALYTICS_FRAME_TTL seconds (init_app), so with several worker processes
+attendance marked through another worker shows up within that time, as
+with page_cache.py.
+
+NumPy is optional; without it `np` is None and the analytics routes answer
+501.
+"""
+import datetime
+import threading
+from itertools import chain
+
+from cache import TTLCache
+from lookups import course_roster
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency, only needed for analytics
+    np = None
+
+# int8 status codes; 0 is any other (unrated) value.
+PRESENT, ABSENT, EXCUSED = 1, 2, 3
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+TREND_WINDOWS = (7, 30)
+
+# SQLite's julianday() of date d is d.toordinal() + this.
+_JULIAN_OFFSET = 1721424.5
+
+# A 500-student, 2-year course is ~250k records, about 2.3 MB of arrays.
+frames_cache = TTLCache(maxsize=32, ttl=60)
+_generation = 0
+_generation_lock = threading.Lock()
+
+
+class CourseFrame:
+    """One course's attendance records as parallel arrays.
+
+    student_ids/names describe the roster, sorted by id; `student` indexes
+    into them. `roster` is the cached roster the frame was built from.
+    Records of students no longer enrolled are left out, as in
+    attendance_summary.
+    """
+
+    def __init__(self, course_id, roster, student_ids, names, student, day, status):
+        self.course_id = course_id
+        self.roster = roster
+        self.student_ids = student_ids
+        self.names = names
+        self.student = student
+        self.day = day
+        self.status = status
+
+    def __len__(self):
+        return len(self.day)
+
+
+def load_frame(conn, course_id, roster):
+    """Read a course's records into a CourseFrame in one query."""
+    students = sorted(roster, key=lambda r: r["id"])
+    student_ids = np.array([r["id"] for r in students], dtype=np.int64)
+
+    cur = conn.cursor()
+    cur.row_factory = None  # plain tuples for np.fromiter
+    cur.execute(f"""
+        SELECT student_id, CAST(julianday(date) - {_JULIAN_OFFSET} AS INTEGER),
+               CASE status WHEN 'Present' THEN {PRESENT} WHEN 'Absent' THEN {ABSENT}
+                           WHEN 'Excused' THEN {EXCUSED} ELSE 0 END
+        FROM attendance
+        WHERE course_id=? AND julianday(date) IS NOT NULL
+    """, (course_id,))
+    rows = np.fromiter(chain.from_iterable(cur), dtype=np.int64).reshape(-1, 3)
+
+    position = np.searchsorted(student_ids, rows[:, 0])
+    enrolled = position < len(student_ids)
+    enrolled[enrolled] = student_ids[position[enrolled]] == rows[enrolled, 0]
+    return CourseFrame(course_id, roster, student_ids, [r["name"] for r in students],
+                       position[enrolled].astype(np.int32), rows[enrolled, 1].astype(np.int32),
+                       rows[enrolled, 2].astype(np.int8))
+
+
+def course_frame(conn, course_id):
+    """The cached CourseFrame for a course, loading it on a miss."""
+    roster = course_roster(conn, course_id)
+    frame = frames_cache.get(course_id)
+    if frame is not None and frame.roster is roster:
+        return frame
+    generation = _generation
+    frame = load_frame(conn, course_id, roster)
+    with _generation_lock:
+        # A write that landed while loading may not be in `frame`; don't cache it.
+        if generation == _generation:
+            frames_cache.set(course_id, frame)
+    return frame
+
+
+def invalidate_frames(course_ids):
+    """Call after attendance in these courses changes."""
+    global _generation
+    with _generation_lock:
+        _generation += 1
+        frames_cache.invalidate(*{int(cid) for cid in course_ids})
+
+
+# ------------ Aggregations ------------
+def _rate(count, marked):
+    """100 * count / marked where anything was marked, NaN elsewhere."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(marked > 0, 100.0 * count / marked, np.nan)
+
+
+def _value(x):
+    """A rounded float, or None for NaN (JSON and templates both want None)."""
+    return None if np.isnan(x) else round(float(x), 1)
+
+
+def _values(a):
+    """_value over an array, as a list."""
+    return [None if x != x else x for x in np.round(a, 1).tolist()]
+
+
+def status_counts(frame, since=None):
+    """(students, 4) array of unrated/present/absent/excused counts per student."""
+    student, status = frame.student, frame.status
+    if since is not None:
+        recent = frame.day >= since
+        student, status = student[recent], status[recent]
+    n = len(frame.student_ids)
+    return np.bincount(student * 4 + status, minlength=n * 4).reshape(n, 4)
+
+
+def student_rates(frame, recent_days=30):
+    """Per-student counts, overall rate and rate over the last `recent_days` days."""
+    counts = status_counts(frame)
+    rates = _rate(counts[:, PRESENT], counts[:, 1:].sum(axis=1))
+    last = int(frame.day.max()) if len(frame) else 0
+    recent = status_counts(frame, since=last - recent_days + 1)
+    recent_rates = _rate(recent[:, PRESENT], recent[:, 1:].sum(axis=1))
+    return [{"student_id": sid, "name": name, "present": c[PRESENT], "absent": c[ABSENT], "excused": c[EXCUSED],
+             "rate": rate, "recent_rate": recent_rate}
+            for sid, name, c, rate, recent_rate in zip(frame.student_ids.tolist(), frame.names, counts.tolist(),
+                                                       _values(rates), _values(recent_rates))]
+
+
+def trend(frame, windows=TREND_WINDOWS):
+    """Course rate per marked day plus trailing rates over `windows` calendar days."""
+    if not len(frame):
+        return []
+    first = int(frame.day.min())
+    span = int(frame.day.max()) - first + 1
+    offset = frame.day - first
+    marked = np.bincount(offset[frame.status > 0], minlength=span)
+    present = np.bincount(offset[frame.status == PRESENT], minlength=span)
+    marked_sum = np.concatenate(([0], np.cumsum(marked)))
+    present_sum = np.concatenate(([0], np.cumsum(present)))
+    end = np.arange(1, span + 1)
+    rolling = {}
+    for window in windows:
+        start = np.maximum(end - window, 0)
+        rolling[window] = _rate(present_sum[end] - present_sum[start], marked_sum[end] - marked_sum[start])
+    days = np.flatnonzero(marked)
+    columns = {"rate": _values(_rate(present, marked)[days]),
+               **{f"rolling_{w}": _values(rolling[w][days]) for w in windows}}
+    dates = [datetime.date.fromordinal(first + i).isoformat() for i in days.tolist()]
+    return [dict(zip(("date", *columns), row)) for row in zip(dates, *columns.values())]
+
+
+def weekday_heatmap(frame):
+    """Absence rate by weekday, for the course and for each student.
+
+    Returns (weekdays, course_row, student_rows); weekdays without any marks
+    (usually the weekend) are left out.
+    """
+    n = len(frame.student_ids)
+    weekday = (frame.day - 1) % 7  # ordinal 1 (0001-01-01) was a Monday
+    cells = frame.student * 7 + weekday
+    rated = frame.status > 0
+    marked = np.bincount(cells[rated], minlength=n * 7).reshape(n, 7)
+    absent = np.bincount(cells[frame.status == ABSENT], minlength=n * 7).reshape(n, 7)
+    days = np.flatnonzero(marked.sum(axis=0))
+    course = _rate(absent.sum(axis=0), marked.sum(axis=0))[days]
+    students = _rate(absent[:, days], marked[:, days])
+    return ([WEEKDAYS[d] for d in days], _values(course),
+            [{"student_id": sid, "name": name, "rates": [None if x != x else x for x in row]}
+             for sid, name, row in zip(frame.student_ids.tolist(), frame.names, np.round(students, 1).tolist())])
+
+
+def at_risk(rates, threshold):
+    """Students whose overall rate is below `threshold` percent, lowest first."""
+    return sorted((r for r in rates if r["rate"] is not None and r["rate"] < threshold), key=lambda r: r["rate"])
+
+
+def cohort(frame, threshold):
+    """Distribution of per-student rates in a course, for side-by-side comparison."""
+    counts = status_counts(frame)
+    marked = counts[:, 1:].sum(axis=1)
+    rates = _rate(counts[:, PRESENT], marked)[marked > 0]
+    if not len(rates):
+        return {"course_id": frame.course_id, "students": len(frame.student_ids), "rated": 0, "records": len(frame),
+                "rate": None, "mean": None, "p25": None, "median": None, "p75": None, "at_risk": 0}
+    p25, median, p75 = np.percentile(rates, [25, 50, 75])
+    return {"course_id": frame.course_id, "students": len(frame.student_ids), "rated": len(rates),
+            "records": len(frame), "rate": _value(_rate(counts[:, PRESENT].sum(), marked.sum())),
+            "mean": _value(rates.mean()), "p25": _value(p25), "median": _value(median), "p75": _value(p75),
+            "at_risk": int((rates < threshold).sum())}
+
+
+def chart_points(values, width=600, height=160, low=0.0, high=100.0):
+    """SVG polyline points for a series of percentages; None values are skipped."""
+    y = np.array([np.nan if v is None else v for v in values], dtype=float)
+    x = np.linspace(0, width, len(y)) if len(y) > 1 else np.zeros(len(y))
+    y = height - (np.clip(y, low, high) - low) / (high - low) * height
+    keep = ~np.isnan(y)
+    return " ".join(f"{a:.1f},{b:.1f}" for a, b in zip(x[keep], y[keep]))
+
+
+def course_report(conn, course_id, compare_ids=(), threshold=75.0, connect=None):
+    """Everything the analytics page and endpoint show for one course.
+
+    `compare_ids` are the other courses (e.g. the teacher's) to put next to
+    this one in the cohort comparison. `connect(course_id)` returns the
+    connection to load another course from when courses live in different
+    database files; by default they are all read from `conn`.
+    """
+    frame = course_frame(conn, course_id)
+    rates = student_rates(frame)
+    weekdays, course_weekdays, student_weekdays = weekday_heatmap(frame)
+    return {
+        "course_id": course_id,
+        "records": len(frame),
+        "threshold": threshold,
+        "students": rates,
+        "at_risk": at_risk(rates, threshold),
+        "trend": trend(frame),
+        "weekdays": weekdays,
+        "weekday_rates": course_weekdays,
+        "student_weekday_rates": student_weekdays,
+        "cohorts": [cohort(f, threshold) for f in
+                    [frame] + [course_frame(connect(cid) if connect else conn, cid)
+                               for cid in compare_ids if cid != course_id]],
+    }
+
+
+def frame_stats():
+    return frames_cache.stats()
+
+
+def init_app(app):
+    frames_cache.ttl = app.config["ANALYTICS_FRAME_TTL"]
@@ -0,0 +1,472 @@
+"""JSON API (/api/v1) mirroring the HTML routes for kiosk and mobile clients.
+
+Endpoints reuse the same queries as the pages. List endpoints stream their
+JSON so large rosters and histories are never built up in memory, and the
+roster endpoint supports ETag / If-None-Match revalidation.
+
+Clients log in with POST /api/v1/session and then send the session cookie;
+/teachers/<id>/... and /students/<id>/... only answer for that user's own id.
+"""
+import datetime
+import hmac
+import json
+import uuid
+
+from flask import Blueprint, Response, current_app, jsonify, request, session
+
+from analytics import course_report, invalidate_frames, np
+from archive import is_archived
+from attendance import (SUMMARY_COLUMNS, EditConflict, attendance_dates, attendance_for_date, attendance_grid,
+                        attendance_history, attendance_rate, save_grid, save_marks, update_attendance_statuses)
+from auth import TABLES, authenticate, has_course, is_logged_in, login_user, logout_user
+from change_log import LogTruncated, changes, entry, last_seq
+from db import (fan_out, get_db_connection, get_read_connection, get_shard_connection, group_by_shard, run_write,
+                run_write_by_shard, shard_of, stream_with_connection)
+from enrollment import enroll_cohort, enroll_pairs, existing_ids, move_students, unenroll_pairs
+from lookups import course_roster, invalidate_rosters, teacher_courses
+from page_cache import bump, courses as course_scopes
+from pagination import clamp_page_size
+from search import search_students
+from shards import MAIN
+
+api_v1 = Blueprint("api_v1", __name__, url_prefix="/api/v1")
+
+
+# ------------ Helpers ------------
+def error(message, status):
+    return jsonify(error=message), status
+
+
+def stream_items(rows, to_item, tail=None):
+    """Stream {"items": [...], **tail()} one row at a time.
+
+    `tail` is called after the last row, so it can report values (like a
+    next-page cursor) that are only known once the rows are consumed.
+    """
+    def generate():
+        yield '{"items":['
+        for i, row in enumerate(rows):
+            yield ("," if i else "") + json.dumps(to_item(row))
+        yield "]"
+        for key, value in (tail() if tail else {}).items():
+            yield f",{json.dumps(key)}:{json.dumps(value)}"
+        yield "}"
+    return Response(stream_with_connection(generate()), mimetype="application/json")
+
+
+@api_v1.before_request
+def require_login():
+    args = request.view_args or {}
+    for role, key in (("teacher", "teacher_id"), ("student", "student_id")):
+        if key in args and not is_logged_in(role, args[key]):
+            return error("log in as this user first (POST /api/v1/session)", 401)
+
+
+def valid_date(value):
+    try:
+        return datetime.date.fromisoformat(value).isoformat()
+    except (TypeError, ValueError):
+        return None
+
+
+def count_arg(name, default):
+    """Query argument `name` as an int >= 0, `default` when it is absent, None when malformed or negative."""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        return None
+    return number if number >= 0 else None
+
+
+# ------------ Session ------------
+@api_v1.route("/session", methods=["POST"])
+def create_session():
+    """Log in. Body: {"role": "teacher"|"student", "email": ..., "password": ...}."""
+    payload = request.get_json(silent=True) or {}
+    if payload.get("role") not in TABLES:
+        return error("role must be teacher or student", 400)
+    conn = get_db_connection()
+    user = authenticate(conn, payload["role"], payload.get("email"), payload.get("password"))
+    if not user:
+        return error("invalid credentials", 401)
+    login_user(conn, payload["role"], user)
+    return jsonify(role=session["role"], id=session["id"], name=session["name"], course_ids=session["course_ids"])
+
+
+@api_v1.route("/session", methods=["DELETE"])
+def delete_session():
+    logout_user()
+    return "", 204
+
+
+# ------------ Teacher endpoints ------------
+@api_v1.route("/teachers/<int:teacher_id>/courses")
+def teacher_course_list(teacher_id):
+    """Courses the teacher is assigned to."""
+    courses = teacher_courses(get_db_connection(), teacher_id)
+    return jsonify(items=[dict(c) for c in courses])
+
+
+@api_v1.route("/teachers/<int:teacher_id>/courses/<int:course_id>/students")
+def course_students(teacher_id, course_id):
+    """Course roster; answers 304 when the client's ETag still matches."""
+    conn = get_db_connection(course_id)
+    if not has_course(conn, course_id):
+        return error("You are not assigned to this course", 403)
+
+    response = jsonify(items=[dict(s) for s in course_roster(conn, course_id)])
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+@api_v1.route("/teachers/<int:teacher_id>/students")
+def search_course_students(teacher_id):
+    """Students in the teacher's courses, a page at a time in name order.
+
+    ?q= keeps students whose name or email has words starting with each
+    word of q; ?course_id= narrows to one course. Pass the returned "next"
+    as ?after= for the next page.
+    """
+    conn = get_db_connection()
+    course_id = request.args.get("course_id", type=int)
+    if course_id is not None and not has_course(conn, course_id):
+        return error("You are not assigned to this course", 403)
+    course_ids = [course_id] if course_id is not None else [c["id"] for c in teacher_courses(conn, teacher_id)]
+
+    page_size = clamp_page_size(request.args.get("page_size", type=int),
+                                current_app.config["ATTENDANCE_PAGE_SIZE"],
+                                current_app.config["ATTENDANCE_MAX_PAGE_SIZE"])
+    try:
+        page = search_students(fan_out, request.args.get("q"), course_ids, page_size, request.args.get("after"))
+    except ValueError:
+        return error("invalid page cursor", 400)
+    return jsonify(items=[dict(r) for r in page], next=page.next_cursor)
+
+
+@api_v1.route("/teachers/<int:teacher_id>/courses/<int:course_id>/summary")
+def course_summary(teacher_id, course_id):
+    """Present/absent/excused counts and attendance rate per enrolled student."""
+    conn = get_db_connection(course_id)
+    if not has_course(conn, course_id):
+        return error("You are not assigned to this course", 403)
+
+    rows = conn.execute("""
+        SELECT student_id, present, absent, excused, last_date
+        FROM attendance_summary WHERE course_id=?
+    """, (course_id,))
+    return stream_items(rows, lambda r: {**dict(r), "rate": attendance_rate(r)})
+
+
+@api_v1.route("/teachers/<int:teacher_id>/courses/<int:course_id>/attendance/dates")
+def course_attendance_dates(teacher_id, course_id):
+    """Dates with attendance for the course and the number of records on each."""
+    conn = get_db_connection(course_id)
+    if not has_course(conn, course_id):
+        return error("You are not assigned to this course", 403)
+
+    return stream_items(attendance_dates(conn.cursor(), course_id), dict)
+
+
+@api_v1.route("/teachers/<int:teacher_id>/courses/<int:course_id>/attendance")
+def course_attendance_for_date(teacher_id, course_id):
+    """Records for one date (?date=YYYY-MM-DD).
+
+    Marks still in this process's write queue are listed under "pending"
+    as {"<student_id>": status}.
+    """
+    conn = get_db_connection(course_id)
+    if not has_course(conn, course_id):
+        return error("You are not assigned to this course", 403)
+    date = valid_date(request.args.get("date"))
+    if not date:
+        return error("date must be YYYY-MM-DD", 400)
+
+    queue = current_app.extensions.get("write_queue")
+    tail = (lambda: {"pending": queue.pending(course_id, date).get(date, {})}) if queue else None
+    return stream_items(attendance_for_date(conn.cursor(), course_id, date), dict, tail)
+
+
+@api_v1.route("/teachers/<int:teacher_id>/attendance", methods=["POST"])
+def mark_attendance(teacher_id):
+    """Mark attendance for several courses and dates in one transaction per database.
+
+    Body: {"marks": [{"course_id": 1, "date": "2025-01-31",
+                      "statuses": {"<student_id>": "Present", ...}}, ...]}
+    Students not enrolled in the course are reported under "skipped".
+
+    With the write queue on, the marks are queued and the answer is 202
+    {"status": "queued"}. Send an Idempotency-Key header to make retries
+    safe: a key that was already committed gets the original results back,
+    one still in the queue gets 202 {"status": "pending"}. Marks for courses
+    in different shards are queued (and committed) separately.
+    """
+    payload = request.get_json(silent=True) or {}
+    batches = payload.get("marks")
+    if not isinstance(batches, list) or not batches:
+        return error("marks must be a non-empty list", 400)
+
+    conn = get_db_connection()
+    for batch in batches:
+        if (not isinstance(batch, dict) or not isinstance(batch.get("course_id"), int)
+                or not isinstance(batch.get("statuses"), dict)):
+            return error("each entry needs course_id, date and a statuses object", 400)
+        if not valid_date(batch.get("date")):
+            return error("date must be YYYY-MM-DD", 400)
+        if not has_course(conn, batch.get("course_id")):
+            return error(f"You are not assigned to course {batch.get('course_id')}", 403)
+        if any(status not in SUMMARY_COLUMNS for status in batch["statuses"].values()):
+            return error(f"status must be one of {', '.join(SUMMARY_COLUMNS)}", 400)
+        if is_archived(get_db_connection(batch["course_id"]).cursor(), valid_date(batch["date"])):
+            return error(f"the term of {batch['date']} is archived and read-only", 400)
+
+    batches = [{"course_id": b["course_id"], "date": valid_date(b["date"]), "statuses": b["statuses"]}
+               for b in batches]
+    queue = current_app.extensions.get("write_queue")
+    if queue is not None:
+        key = f"teacher-{teacher_id}:api:{request.headers.get('Idempotency-Key') or uuid.uuid4().hex}"
+        shards = group_by_shard(b["course_id"] for b in batches)
+        outcomes = [queue.submit(get_db_connection(ids[0]), key if len(shards) == 1 else f"{key}:{name}",
+                                 [b for b in batches if b["course_id"] in ids], shard=name)
+                    for name, ids in shards.items()]
+        if all(state == "committed" for state, _ in outcomes):
+            return jsonify(results=[r for _, results in outcomes for r in results])
+        bump(*course_scopes(b["course_id"] for b in batches))
+        return jsonify(status="queued" if any(state == "queued" for state, _ in outcomes) else "pending"), 202
+
+    by_shard = run_write_by_shard(lambda cur, ids: save_marks(cur, [b for b in batches if b["course_id"] in ids]),
+                                  [b["course_id"] for b in batches])
+    results = [r for shard_results in by_shard.values() for r in shard_results]
+    invalidate_frames([r["course_id"] for r in results])
+    bump(*course_scopes(r["course_id"] for r in results))
+    return jsonify(results=results)
+
+
+@api_v1.route("/teachers/<int:teacher_id>/courses/<int:course_id>/attendance", methods=["PATCH"])
+def edit_course_attendance(teacher_id, course_id):
+    """Change existing records. Body: {"statuses": {"<attendance_id>": "Absent", ...}}."""
+    conn = get_db_connection(course_id)
+    if not has_course(conn, course_id):
+        return error("You are not assigned to this course", 403)
+
+    statuses = (request.get_json(silent=True) or {}).get("statuses")
+    if not isinstance(statuses, dict) or not all(str(k).isdigit() for k in statuses):
+        return error("statuses must map attendance ids to statuses", 400)
+    if any(status not in SUMMARY_COLUMNS for status in statuses.values()):
+        return error(f"status must be one of {', '.join(SUMMARY_COLUMNS)}", 400)
+
+    updated = run_write(update_attendance_statuses, course_id, {int(k): v for k, v in statuses.items()},
+                        shard=shard_of(course_id))
+    invalidate_frames([course_id])
+    bump(("course", course_id))
+    return jsonify(updated=updated)
+
+
+@api_v1.route("/teachers/<int:teacher_id>/courses/<int:course_id>/attendance/grid")
+def course_attendance_grid(teacher_id, course_id):
+    """Students by the dates in ?start=&end= that have attendance: {"dates": [...], "students": [...]}."""
+    conn = get_db_connection(course_id)
+    if not has_course(conn, course_id):
+        return error("You are not assigned to this course", 403)
+    start, end = valid_date(request.args.get("start")), valid_date(request.args.get("end"))
+    if not start or not end or start > end:
+        return error("start and end must be YYYY-MM-DD, start first", 400)
+    if (datetime.date.fromisoformat(end) - datetime.date.fromisoformat(start)).days \
+            >= current_app.config["ATTENDANCE_GRID_MAX_DAYS"]:
+        return error(f"the range is limited to {current_app.config['ATTENDANCE_GRID_MAX_DAYS']} days", 400)
+    dates, students = attendance_grid(conn.cursor(), course_id, start, end)
+    return jsonify(dates=dates, students=students)
+
+
+@api_v1.route("/teachers/<int:teacher_id>/courses/<int:course_id>/attendance/grid", methods=["PUT"])
+def save_course_attendance_grid(teacher_id, course_id):
+    """Save changed grid cells, all or none.
+
+    Body: {"cells": [{"student_id": 4, "date": "2025-03-03", "was": "Present", "status": "Absent"}, ...]}
+    where "was" is the status the client last read (null for no record).
+    When any cell changed since, nothing is saved and the answer is 409
+    with the cells' current statuses under "conflicts".
+    """
+    conn = get_db_connection(course_id)
+    if not has_course(conn, course_id):
+        return error("You are not assigned to this course", 403)
+    cells = (request.get_json(silent=True) or {}).get("cells")
+    if not isinstance(cells, list) or not all(
+            isinstance(c, dict) and isinstance(c.get("student_id"), int) and valid_date(c.get("date"))
+            and c.get("status") in SUMMARY_COLUMNS and c.get("was") in (None, *SUMMARY_COLUMNS) for c in cells):
+        return error("cells must be a list of {student_id, date, was, status}", 400)
+    cells = [(c["student_id"], valid_date(c["date"]), c["was"], c["status"]) for c in cells]
+    if any(is_archived(conn.cursor(), date) for date in {c[1] for c in cells}):
+        return error("some dates are in an archived, read-only term", 400)
+
+    try:
+        inserted, updated = run_write(save_grid, course_id, cells, shard=shard_of(course_id))
+    except EditConflict as e:
+        return jsonify(error=str(e), conflicts=e.conflicts), 409
+    invalidate_frames([course_id])
+    bump(("course", course_id))
+    return jsonify(inserted=inserted, updated=updated)
+
+
+@api_v1.route("/teachers/<int:teacher_id>/courses/<int:course_id>/analytics")
+def course_analytics(teacher_id, course_id):
+    """Rates, trends, weekday heatmap, at-risk students and a comparison with the teacher's other courses."""
+    conn = get_read_connection(course_id)
+    if not has_course(conn, course_id):
+        return error("You are not assigned to this course", 403)
+    if np is None:
+        return error("analytics needs numpy on the server", 501)
+    try:
+        threshold = float(request.args.get("threshold") or 75)
+    except ValueError:
+        return error("threshold must be a number", 400)
+
+    compare = [c["id"] for c in teacher_courses(conn, teacher_id)]
+    return jsonify(course_report(conn, course_id, compare, threshold, connect=get_read_connection))
+
+
+def int_list(value):
+    return isinstance(value, list) and all(isinstance(v, int) for v in value)
+
+
+@api_v1.route("/teachers/<int:teacher_id>/enrollments", methods=["POST"])
+def enroll_students(teacher_id):
+    """Enroll a cohort in several courses at once.
+
+    Body: {"student_ids": [1, 2, ...], "course_ids": [3, 4]}. Returns the
+    (student_id, course_id) pairs that were added; existing ones are skipped.
+    """
+    payload = request.get_json(silent=True) or {}
+    student_ids, course_ids = payload.get("student_ids"), payload.get("course_ids")
+    if not int_list(student_ids) or not int_list(course_ids) or not student_ids or not course_ids:
+        return error("student_ids and course_ids must be non-empty lists of ids", 400)
+    conn = get_db_connection()
+    for course_id in course_ids:
+        if not has_course(conn, course_id):
+            return error(f"You are not assigned to course {course_id}", 403)
+
+    # Unknown ids are skipped. The check runs here since shard writers only see their own tables.
+    cur = conn.cursor()
+    student_ids, course_ids = existing_ids(cur, "students", student_ids), existing_ids(cur, "courses", course_ids)
+    added = [pair for pairs in run_write_by_shard(enroll_cohort, course_ids, student_ids).values() for pair in pairs]
+    changed = {cid for _, cid in added}
+    invalidate_rosters(changed)
+    bump(*course_scopes(changed), *(("student", sid) for sid in {sid for sid, _ in added}))
+    return jsonify(added=[{"student_id": sid, "course_id": cid} for sid, cid in added])
+
+
+@api_v1.route("/teachers/<int:teacher_id>/enrollments/move", methods=["POST"])
+def move_enrollments(teacher_id):
+    """Move a section to another course.
+
+    Body: {"from_course_id": 1, "to_course_id": 2, "student_ids": [...]};
+    without student_ids the whole roster moves. Attendance already recorded
+    in the old course is kept.
+    """
+    payload = request.get_json(silent=True) or {}
+    from_course, to_course = payload.get("from_course_id"), payload.get("to_course_id")
+    student_ids = payload.get("student_ids")
+    if not isinstance(from_course, int) or not isinstance(to_course, int) or from_course == to_course:
+        return error("from_course_id and to_course_id must be two different course ids", 400)
+    if student_ids is not None and not int_list(student_ids):
+        return error("student_ids must be a list of ids", 400)
+    conn = get_db_connection()
+    for course_id in (from_course, to_course):
+        if not has_course(conn, course_id):
+            return error(f"You are not assigned to course {course_id}", 403)
+
+    source, target = shard_of(from_course), shard_of(to_course)
+    if source == target:
+        moved = run_write(move_students, from_course, to_course, student_ids, shard=source)
+    else:
+        # Across shards: enroll in the new course first, so a failure in between
+        # leaves students in both courses rather than in neither.
+        roster = {s["id"] for s in course_roster(get_db_connection(from_course), from_course)}
+        moved = sorted(roster if student_ids is None else roster & set(student_ids))
+        run_write(enroll_pairs, [(sid, to_course) for sid in moved], shard=target)
+        run_write(unenroll_pairs, [(sid, from_course) for sid in moved], shard=source)
+    invalidate_rosters([from_course, to_course])
+    bump(*course_scopes([from_course, to_course]), *(("student", sid) for sid in moved))
+    return jsonify(moved=moved)
+
+
+# ------------ Change feed ------------
+@api_v1.route("/changes")
+def change_feed():
+    """Attendance and enrollment changes after ?since=<seq>, oldest first, at most ?limit= of them.
+
+    Authenticated with "Authorization: Bearer <CHANGE_FEED_TOKEN>". Pass the
+    returned "next" as since to continue; "last_seq" is the newest entry at
+    the time of the request. With a shard map each database has its own
+    sequence, chosen with ?shard= (default main). 410 means the entries
+    after since were purged and the consumer must resync from a full dump.
+    """
+    token = current_app.config["CHANGE_FEED_TOKEN"]
+    if not token:
+        return error("the change feed is off (set ATTENDANCE_CHANGE_FEED_TOKEN)", 404)
+    if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return error("send the change feed token as a Bearer token", 401)
+    # A malformed since must not read as 0 (a full replay) or a negative one as purged.
+    since = count_arg("since", 0)
+    if since is None:
+        return error("since must be a seq (0 or more)", 400)
+    limit = count_arg("limit", current_app.config["CHANGE_FEED_BATCH"])
+    if not limit:
+        return error("limit must be a positive integer", 400)
+    limit = min(limit, current_app.config["CHANGE_FEED_MAX_BATCH"])
+    try:
+        conn = get_shard_connection(request.args.get("shard") or MAIN)
+    except KeyError:
+        return error("unknown shard", 404)
+
+    cur = conn.cursor()
+    latest = last_seq(cur)
+    try:
+        rows = changes(cur, since, limit)
+    except LogTruncated as e:
+        return jsonify(error=str(e), purged_through=e.purged_through), 410
+    last = [since]
+
+    def to_item(row):
+        last[0] = row[0]
+        return entry(row)
+    return stream_items(rows, to_item, tail=lambda: {"next": last[0], "last_seq": latest})
+
+
+# ------------ Student endpoints ------------
+@api_v1.route("/students/<int:student_id>/courses")
+def student_course_list(student_id):
+    """Enrolled courses with the student's attendance counts."""
+    def query(conn, _):
+        return conn.execute("""
+            SELECT c.id, c.name, COALESCE(sm.present, 0) AS present,
+                   COALESCE(sm.absent, 0) AS absent, COALESCE(sm.excused, 0) AS excused
+            FROM courses c
+            JOIN student_courses sc ON c.id = sc.course_id
+            LEFT JOIN attendance_summary sm ON sm.student_id = sc.student_id AND sm.course_id = sc.course_id
+            WHERE sc.student_id = ?
+        """, (student_id,)).fetchall()
+    rows = [row for rows in fan_out(query, replica=True) for row in rows]
+    return jsonify(items=[{**dict(r), "rate": attendance_rate(r)} for r in rows])
+
+
+@api_v1.route("/students/<int:student_id>/courses/<int:course_id>/attendance")
+def student_attendance(student_id, course_id):
+    """A page of the student's history; pass the returned "next" as ?after= for the next page."""
+    conn = get_read_connection(course_id)
+    cur = conn.cursor()
+    if not has_course(conn, course_id):
+        return error("You are not enrolled in this course", 403)
+
+    page_size = clamp_page_size(request.args.get("page_size", type=int),
+                                current_app.config["ATTENDANCE_PAGE_SIZE"],
+                                current_app.config["ATTENDANCE_MAX_PAGE_SIZE"])
+    try:
+        page = attendance_history(cur, student_id, course_id, page_size, request.args.get("after"),
+                                  current_app.config["ARCHIVE_DIR"])
+    except ValueError:
+        return error("invalid page cursor", 400)
+    return stream_items(page, lambda r: {"date": r["date"], "status": r["status"]},
+                        tail=lambda: {"next": page.next_cursor})
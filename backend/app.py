@@ -1,20 +1,122 @@
-from flask import Flask, request, render_template, redirect, url_for, flash
+from flask import (Flask, request, render_template, redirect, url_for, flash, jsonify, session,
+                   stream_template, send_file)
 import sqlite3
 import os
 import datetime
+import tempfile
+import uuid
+
+from attendance import (SUMMARY_COLUMNS, EditConflict, save_attendance, save_grid, update_attendance_statuses,
+                        attendance_rate, attendance_dates, attendance_for_date, attendance_grid, attendance_history)
+from analytics import chart_points, course_report, frame_stats, init_app as init_analytics, invalidate_frames, np
+from archive import is_archived
+from api import api_v1
+from auth import (authenticate, course_ids as user_course_ids, has_course, login_required, login_user,
+                  logout_user, student_required, teacher_required, update_session)
+from enrollment import enroll_pairs, sync_student_courses, sync_teacher_courses
+from db import (DB_PATH, database_stats, fan_out, get_db_connection, get_read_connection, group_by_shard,
+                init_app as init_db, run_write, run_write_by_shard, shard_of, stream_with_connection)
+from db_pool import DEFAULT_PRAGMAS, parse_pragmas
+from export import iter_csv, iter_matrix, write_xlsx, xlsxwriter
+from instrumentation import init_app as init_instrumentation
+from jobs import init_app as init_jobs, init_workers as init_job_workers, job_stats
+from page_cache import bump, cached_page, courses as course_scopes, init_app as init_page_cache, page_cache_stats
+from roster_import import detect_format, file_digest, import_roster, iter_records, text_stream
+from passwords import DEFAULT_METHOD, PasswordHasher
+from pagination import clamp_page_size
+from search import search_students
+from sessions import init_app as init_sessions
+from shards import MAIN
+from write_queue import init_app as init_write_queue, write_queue_stats
+from lookups import (course_name, course_roster, teacher_courses,
+                     invalidate_rosters, invalidate_teacher_courses, cache_stats)
 
 app = Flask(__name__, template_folder='../frontend/templates', static_folder='../frontend/static')
 
 
-# ------------ Paths ------------
-DB_PATH = os.path.join(os.path.dirname(__file__), "..", "database", "attendance.db")
+# ------------ Config ------------
+# Extra pragmas can be given as "name=value,..." in ATTENDANCE_DB_PRAGMAS.
+app.config.update(
+    DB_PATH=DB_PATH,
+    DB_POOL_SIZE=int(os.environ.get("ATTENDANCE_DB_POOL_SIZE", 16)),
+    DB_PRAGMAS={**DEFAULT_PRAGMAS, **parse_pragmas(os.environ.get("ATTENDANCE_DB_PRAGMAS"))},
+    ATTENDANCE_PAGE_SIZE=50,
+    ATTENDANCE_MAX_PAGE_SIZE=500,
+    # Widest date range the grid editor shows at once.
+    ATTENDANCE_GRID_MAX_DAYS=31,
+    # werkzeug hash method, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000".
+    PASSWORD_METHOD=os.environ.get("ATTENDANCE_PASSWORD_METHOD", DEFAULT_METHOD),
+    PASSWORD_WORKERS=int(os.environ.get("ATTENDANCE_PASSWORD_WORKERS", 0)) or None,
+    # Without ATTENDANCE_SECRET_KEY sessions do not survive a restart or span workers.
+    SECRET_KEY=os.environ.get("ATTENDANCE_SECRET_KEY") or os.urandom(32).hex(),
+    SESSION_STORE=os.environ.get("ATTENDANCE_SESSION_STORE", "cookie"),  # cookie | memory | sqlite
+    SESSION_COOKIE_SAMESITE="Lax",
+    PERMANENT_SESSION_LIFETIME=datetime.timedelta(hours=12),
+    # SQL/template timing and /metrics; profile this fraction of requests, keeping the slowest.
+    INSTRUMENTATION=os.environ.get("ATTENDANCE_INSTRUMENT", "") not in ("", "0"),
+    PROFILE_SAMPLE_RATE=float(os.environ.get("ATTENDANCE_PROFILE_SAMPLE_RATE", 0)),
+    PROFILE_KEEP=int(os.environ.get("ATTENDANCE_PROFILE_KEEP", 20)),
+    # Bearer token for /metrics and /metrics/profiles; they are off without one.
+    METRICS_TOKEN=os.environ.get("ATTENDANCE_METRICS_TOKEN"),
+    # Send attendance writes through one writer thread per process (see db_writer.py).
+    DB_SINGLE_WRITER=os.environ.get("ATTENDANCE_DB_SINGLE_WRITER", "1") not in ("", "0"),
+    # Cache rendered dashboards/rosters (see page_cache.py); TTL bounds staleness across workers.
+    RESPONSE_CACHE=os.environ.get("ATTENDANCE_RESPONSE_CACHE", "1") not in ("", "0"),
+    RESPONSE_CACHE_SIZE=int(os.environ.get("ATTENDANCE_RESPONSE_CACHE_SIZE", 1024)),
+    RESPONSE_CACHE_TTL=float(os.environ.get("ATTENDANCE_RESPONSE_CACHE_TTL", 60)),
+    # Seconds an analytics frame is reused (see analytics.py); bounds staleness across workers.
+    ANALYTICS_FRAME_TTL=float(os.environ.get("ATTENDANCE_ANALYTICS_FRAME_TTL", 60)),
+    # Acknowledge attendance marking once it is journaled and commit in the background (see write_queue.py).
+    WRITE_QUEUE=os.environ.get("ATTENDANCE_WRITE_QUEUE", "") not in ("", "0"),
+    WRITE_QUEUE_DIR=os.environ.get("ATTENDANCE_WRITE_QUEUE_DIR")
+    or os.path.join(os.path.dirname(DB_PATH), "write-queue"),
+    WRITE_QUEUE_FSYNC=os.environ.get("ATTENDANCE_WRITE_QUEUE_FSYNC", "1") not in ("", "0"),
+    # JSON file placing courses in separate database files (see shards.py).
+    SHARD_MAP=os.environ.get("ATTENDANCE_SHARD_MAP"),
+    # Serve read-only pages from local copies refreshed every REPLICA_INTERVAL seconds (see replicas.py).
+    DB_REPLICAS=os.environ.get("ATTENDANCE_DB_REPLICAS", "") not in ("", "0"),
+    REPLICA_DIR=os.environ.get("ATTENDANCE_REPLICA_DIR") or os.path.join(os.path.dirname(DB_PATH), "replicas"),
+    REPLICA_INTERVAL=float(os.environ.get("ATTENDANCE_REPLICA_INTERVAL", 30)),
+    # Bearer token for GET /api/v1/changes (see change_log.py); the feed is off without one.
+    CHANGE_FEED_TOKEN=os.environ.get("ATTENDANCE_CHANGE_FEED_TOKEN"),
+    CHANGE_FEED_BATCH=1000,
+    CHANGE_FEED_MAX_BATCH=10000,
+    # Closed terms' attendance files written by archive.py; history and export attach them.
+    ARCHIVE_DIR=os.environ.get("ATTENDANCE_ARCHIVE_DIR") or os.path.join(os.path.dirname(DB_PATH), "archive"),
+    # Nightly reports, low-attendance alerts and maintenance in worker processes (see jobs.py).
+    JOBS=os.environ.get("ATTENDANCE_JOBS", "") not in ("", "0"),
+    JOB_WORKERS=int(os.environ.get("ATTENDANCE_JOB_WORKERS", 2)),
+    JOB_POLL_SECONDS=float(os.environ.get("ATTENDANCE_JOB_POLL_SECONDS", 30)),
+    JOB_TIMEOUT=float(os.environ.get("ATTENDANCE_JOB_TIMEOUT", 3600)),
+    REPORT_DIR=os.environ.get("ATTENDANCE_REPORT_DIR") or os.path.join(os.path.dirname(DB_PATH), "reports"),
+    # smtp://, smtps://, file:///outbox or module:factory (see mailer.py); email is off without one.
+    MAIL_URL=os.environ.get("ATTENDANCE_MAIL_URL"),
+    MAIL_FROM=os.environ.get("ATTENDANCE_MAIL_FROM") or "attendance@localhost",
+)
 
 # ------------ DB helper ------------
-def get_db_connection():
-    """Open a sqlite3 connection and set row_factory for dict-like access."""
-    conn = sqlite3.connect(DB_PATH, timeout=5)
-    conn.row_factory = sqlite3.Row
-    return conn
+init_job_workers(app)  # forks, so before anything below starts a thread
+if app.config["INSTRUMENTATION"]:
+    init_instrumentation(app)
+pool = init_db(app)
+passwords = PasswordHasher(app.config["PASSWORD_METHOD"], app.config["PASSWORD_WORKERS"])
+app.extensions["passwords"] = passwords
+init_sessions(app, pool)
+init_page_cache(app)
+init_analytics(app)
+init_write_queue(app)
+init_jobs(app)
+
+app.register_blueprint(api_v1)
+
+@app.route("/health")
+def health():
+    """Liveness check with connection pool and cache counters."""
+    writer = app.extensions.get("db_writer")
+    return jsonify(db_pool=pool.stats(), db_writer=writer.stats() if writer else None,
+                   cache={**cache_stats(), "course_frames": frame_stats(), "pages": page_cache_stats()},
+                   passwords=passwords.stats(), write_queue=write_queue_stats(), databases=database_stats(),
+                   jobs=job_stats())
 
 # ------------ Home & Login ----
 @app.route("/")
@@ -25,6 +127,7 @@ def home():
 @app.route("/logout")
 def logout():
     """Logout and return to login page."""
+    logout_user()
     return redirect(url_for("home"))
 
 # ================== TEACHER FLOWS ==================
@@ -38,7 +141,6 @@ def teacher_signup():
     if request.method == "GET":
         cur.execute("SELECT id, name FROM courses")
         courses = cur.fetchall()
-        conn.close()
         return render_template("teacher_signup.html", courses=courses)
 
     # POST - create teacher
@@ -48,7 +150,6 @@ def teacher_signup():
     course_ids = request.form.getlist("course_ids")
 
     if not course_ids:
-        conn.close()
         return render_template("message.html", 
                              title="Error", 
                              message="Please select at least one course.",
@@ -56,7 +157,7 @@ def teacher_signup():
                              link_url=url_for("teacher_signup"))
 
     try:
-        cur.execute("INSERT INTO teachers (name,email,password) VALUES (?,?,?)", (name, email, password))
+        cur.execute("INSERT INTO teachers (name,email,password) VALUES (?,?,?)", (name, email, passwords.hash(password)))
         teacher_id = cur.lastrowid
         for cid in course_ids:
             try:
@@ -64,6 +165,7 @@ def teacher_signup():
             except sqlite3.IntegrityError:
                 pass
         conn.commit()
+        invalidate_teacher_courses(teacher_id)
         return render_template("message.html",
                              title="Success",
                              message="Teacher account created successfully! You can now login.",
@@ -76,8 +178,6 @@ def teacher_signup():
                              message="A teacher with this email already exists.",
                              link_text="Try Again",
                              link_url=url_for("teacher_signup"))
-    finally:
-        conn.close()
 
 @app.route("/teacher/login", methods=["POST"])
 def teacher_login():
@@ -85,10 +185,7 @@ def teacher_login():
     email = request.form.get("email")
     password = request.form.get("password")
     conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, name FROM teachers WHERE email=? AND password=?", (email, password))
-    teacher = cur.fetchone()
-    conn.close()
+    teacher = authenticate(conn, "teacher", email, password)
 
     if not teacher:
         return render_template("message.html",
@@ -97,79 +194,78 @@ def teacher_login():
                              link_text="Back to Login",
                              link_url=url_for("home"))
 
+    login_user(conn, "teacher", teacher)
     return redirect(url_for("teacher_dashboard", teacher_id=teacher["id"]))
 
 @app.route("/teacher/dashboard/<int:teacher_id>")
+@teacher_required
+@cached_page(lambda teacher_id: [("teacher", teacher_id)])
 def teacher_dashboard(teacher_id):
     """Teacher dashboard showing profile and courses."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    cur.execute("SELECT name, email FROM teachers WHERE id=?", (teacher_id,))
-    teacher = cur.fetchone()
-    if not teacher:
-        conn.close()
-        return render_template("error.html", message="Teacher not found"), 404
-
-    cur.execute("""
-        SELECT c.id, c.name
-        FROM courses c
-        JOIN teacher_courses tc ON c.id = tc.course_id
-        WHERE tc.teacher_id = ?
-    """, (teacher_id,))
-    courses = cur.fetchall()
-    conn.close()
+    courses = teacher_courses(get_db_connection(), teacher_id)
 
     return render_template("teacher_dashboard.html",
                          teacher_id=teacher_id,
-                         teacher_name=teacher['name'],
-                         teacher_email=teacher['email'],
+                         teacher_name=session['name'],
+                         teacher_email=session['email'],
                          courses=courses)
 
 @app.route("/teacher/<int:teacher_id>/courses/<int:course_id>/students")
+@teacher_required
+@cached_page(lambda teacher_id, course_id: [("course", course_id)])
 def teacher_course_students(teacher_id, course_id):
     """Show students in a course."""
-    conn = get_db_connection()
+    conn = get_db_connection(course_id)
     cur = conn.cursor()
 
-    cur.execute("SELECT 1 FROM teacher_courses WHERE teacher_id=? AND course_id=?", (teacher_id, course_id))
-    if not cur.fetchone():
-        conn.close()
+    if not has_course(conn, course_id):
         return render_template("error.html", message="You are not assigned to this course"), 403
 
-    cur.execute("""
-        SELECT s.id, s.name, s.email
-        FROM students s
-        JOIN student_courses sc ON s.id = sc.student_id
-        WHERE sc.course_id = ?
-    """, (course_id,))
-    students = cur.fetchall()
-
-    cur.execute("SELECT name FROM courses WHERE id=?", (course_id,))
-    course = cur.fetchone()
-    conn.close()
+    # ?q= filters the roster through the search index, a page at a time.
+    query = (request.args.get("q") or "").strip()
+    page = None
+    if query:
+        page_size = clamp_page_size(request.args.get("page_size", type=int), app.config["ATTENDANCE_PAGE_SIZE"],
+                                    app.config["ATTENDANCE_MAX_PAGE_SIZE"])
+        try:
+            page = search_students(fan_out, query, [course_id], page_size, request.args.get("after"))
+        except ValueError:
+            return render_template("error.html", message="Invalid page link"), 400
+        roster = list(page)
+    else:
+        roster = course_roster(conn, course_id)
+
+    # The roster is cached; counts change with every marking so are read fresh.
+    cur.execute("SELECT student_id, present, absent, excused FROM attendance_summary WHERE course_id=?",
+                (course_id,))
+    counts = {r["student_id"]: r for r in cur.fetchall()}
+    students = []
+    for s in roster:
+        c = counts.get(s["id"])
+        students.append({**dict(s),
+                         "present": c["present"] if c else 0,
+                         "absent": c["absent"] if c else 0,
+                         "excused": c["excused"] if c else 0,
+                         "rate": attendance_rate(c)})
 
     return render_template("teacher_students.html",
                          teacher_id=teacher_id,
                          course_id=course_id,
-                         course_name=course['name'],
-                         students=students)
+                         course_name=course_name(conn, course_id),
+                         students=students,
+                         query=query,
+                         next_cursor=page.next_cursor if page else None,
+                         is_first_page=not request.args.get("after"))
 
 @app.route("/teacher/add_student/<int:teacher_id>", methods=["GET", "POST"])
+@teacher_required
 def teacher_add_student(teacher_id):
     """Add a new student and enroll in courses."""
     conn = get_db_connection()
     cur = conn.cursor()
 
     if request.method == "GET":
-        cur.execute("""
-            SELECT c.id, c.name
-            FROM courses c
-            JOIN teacher_courses tc ON c.id = tc.course_id
-            WHERE tc.teacher_id = ?
-        """, (teacher_id,))
-        courses = cur.fetchall()
-        conn.close()
+        courses = teacher_courses(conn, teacher_id)
         return render_template("teacher_add_student.html", teacher_id=teacher_id, courses=courses)
 
     # POST
@@ -179,14 +275,12 @@ def teacher_add_student(teacher_id):
     course_ids = request.form.getlist("course_ids")
 
     try:
-        cur.execute("INSERT INTO students (name,email,password) VALUES (?,?,?)", (name, email, password))
+        cur.execute("INSERT INTO students (name,email,password) VALUES (?,?,?)", (name, email, passwords.hash(password)))
         student_id = cur.lastrowid
-        for cid in course_ids:
-            try:
-                cur.execute("INSERT INTO student_courses (student_id, course_id) VALUES (?, ?)", (student_id, cid))
-            except sqlite3.IntegrityError:
-                pass
+        sync_enrollments(cur, student_id, course_ids, course_ids)
         conn.commit()
+        invalidate_rosters(course_ids)
+        bump(*course_scopes(course_ids))
         return render_template("message.html",
                              title="Success",
                              message="Student added and enrolled successfully.",
@@ -199,10 +293,74 @@ def teacher_add_student(teacher_id):
                              message="A student with this email already exists.",
                              link_text="Try Again",
                              link_url=url_for("teacher_add_student", teacher_id=teacher_id))
-    finally:
-        conn.close()
+
+def sync_enrollments(cur, student_id, selected, scope):
+    """sync_student_courses across database files, returning (added, removed, before).
+
+    Courses in the main file are changed on `cur`, inside the caller's
+    transaction; each shard holding some of `scope` commits its part itself.
+    """
+    selected = set(map(int, selected))
+    added, removed, before = set(), set(), set()
+    for shard, ids in group_by_shard(scope).items():
+        if shard == MAIN:
+            a, r, b = sync_student_courses(cur, student_id, selected, scope=ids)
+        else:
+            a, r, b = run_write(sync_student_courses, student_id, selected, ids, shard=shard)
+        added |= a
+        removed |= r
+        before |= b
+    return added, removed, before
+
+def in_shard(course_id):
+    """Roster import hook: the course's enrollments live in a shard file."""
+    return shard_of(course_id) != MAIN
+
+def enroll_in_shards(pairs):
+    """Roster import hook: enroll (student_id, course_id) pairs in their shard files; return how many were added."""
+    added = run_write_by_shard(lambda cur, ids: enroll_pairs(cur, [p for p in pairs if p[1] in ids]),
+                               {cid for _, cid in pairs})
+    return sum(len(a) for a in added.values())
+
+def rosters_changed(course_ids):
+    """Roster import callback: each committed batch changes these courses' rosters."""
+    invalidate_rosters(course_ids)
+    bump(*course_scopes(course_ids))
+
+@app.route("/teacher/import_students/<int:teacher_id>", methods=["GET", "POST"])
+@teacher_required
+def teacher_import_students(teacher_id):
+    """Bulk-add students from an uploaded CSV/JSON roster into the teacher's courses."""
+    conn = get_db_connection()
+    courses = teacher_courses(conn, teacher_id)
+
+    if request.method == "GET":
+        return render_template("teacher_import_students.html", teacher_id=teacher_id, courses=courses)
+
+    upload = request.files.get("file")
+    if not upload or not upload.filename:
+        return render_template("message.html",
+                             title="Error",
+                             message="Choose a roster file to upload.",
+                             link_text="Try Again",
+                             link_url=url_for("teacher_import_students", teacher_id=teacher_id))
+
+    # Uploading the same file again after an interrupted import resumes after its last committed batch.
+    job = f"teacher-{teacher_id}:{file_digest(upload.stream)}"
+    report = import_roster(conn, iter_records(text_stream(upload.stream), detect_format(upload.filename)),
+                           job=job, source=upload.filename,
+                           allowed_course_ids={c["id"] for c in courses},
+                           resume=not request.form.get("restart"), hash_passwords=passwords.hash_many,
+                           on_batch=rosters_changed, elsewhere=in_shard, enroll_elsewhere=enroll_in_shards)
+    return render_template("teacher_import_students.html", teacher_id=teacher_id, courses=courses,
+                           report=report)
+
+def teaches_student(conn, teacher_id, student_id):
+    """True when the student is enrolled in at least one of the teacher's courses."""
+    return bool(user_course_ids(conn, "student", student_id) & {c["id"] for c in teacher_courses(conn, teacher_id)})
 
 @app.route("/teacher/edit_student/<int:student_id>/<int:teacher_id>", methods=["GET", "POST"])
+@teacher_required
 def edit_student_form(student_id, teacher_id):
     """Edit student form with course enrollment management."""
     conn = get_db_connection()
@@ -211,167 +369,284 @@ def edit_student_form(student_id, teacher_id):
     cur.execute("SELECT id, name, email FROM students WHERE id=?", (student_id,))
     student = cur.fetchone()
     if not student:
-        conn.close()
         return render_template("error.html", message="Student not found"), 404
+    if not teaches_student(conn, teacher_id, student_id):
+        return render_template("error.html", message="This student is not in any of your courses"), 403
 
-    cur.execute("""
-        SELECT c.id, c.name
-        FROM courses c
-        JOIN teacher_courses tc ON c.id = tc.course_id
-        WHERE tc.teacher_id = ?
-    """, (teacher_id,))
-    teacher_courses = cur.fetchall()
-
-    cur.execute("SELECT course_id FROM student_courses WHERE student_id=?", (student_id,))
-    enrolled = {row["course_id"] for row in cur.fetchall()}
-    conn.close()
+    enrolled = user_course_ids(conn, "student", student_id)
 
     return render_template("teacher_edit_student.html",
                          student_id=student_id,
                          teacher_id=teacher_id,
                          student_name=student['name'],
                          student_email=student['email'],
-                         courses=teacher_courses,
+                         courses=teacher_courses(conn, teacher_id),
                          enrolled=enrolled)
 
 @app.route("/teacher/update_student", methods=["POST"])
+@login_required("teacher")
 def update_student():
     """Update student profile and course enrollment."""
-    student_id = int(request.form.get("student_id"))
-    teacher_id = int(request.form.get("teacher_id"))
+    student_id = request.form.get("student_id", type=int)
+    teacher_id = session["id"]
     name = request.form.get("name")
     email = request.form.get("email")
     selected_course_ids = set(map(int, request.form.getlist("course_ids")))
 
     conn = get_db_connection()
     cur = conn.cursor()
+    if student_id is None or not teaches_student(conn, teacher_id, student_id):
+        return render_template("error.html", message="This student is not in any of your courses"), 403
 
-    cur.execute("UPDATE students SET name=?, email=? WHERE id=?", (name, email, student_id))
-
-    cur.execute("SELECT course_id FROM teacher_courses WHERE teacher_id = ?", (teacher_id,))
-    teacher_course_ids = {r["course_id"] for r in cur.fetchall()}
-
-    cur.execute("SELECT course_id FROM student_courses WHERE student_id=?", (student_id,))
-    existing = {r["course_id"] for r in cur.fetchall()}
-
-    for cid in (selected_course_ids & teacher_course_ids) - existing:
-        try:
-            cur.execute("INSERT INTO student_courses (student_id, course_id) VALUES (?, ?)", (student_id, cid))
-        except sqlite3.IntegrityError:
-            pass
+    try:
+        cur.execute("UPDATE students SET name=?, email=? WHERE id=?", (name, email, student_id))
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return render_template("message.html",
+                             title="Error",
+                             message="A student with this email already exists.",
+                             link_text="Try Again",
+                             link_url=url_for("edit_student_form", student_id=student_id, teacher_id=teacher_id))
 
-    for cid in (existing & teacher_course_ids) - selected_course_ids:
-        cur.execute("DELETE FROM student_courses WHERE student_id=? AND course_id=?", (student_id, cid))
+    # A teacher only changes enrollments in their own courses.
+    teacher_course_ids = {c["id"] for c in teacher_courses(conn, teacher_id)}
+    added, removed, existing = sync_enrollments(cur, student_id, selected_course_ids, teacher_course_ids)
 
     conn.commit()
-    conn.close()
+    # Name/email appear in every roster the student is on.
+    invalidate_rosters(existing | added)
+    bump(("student", student_id), *course_scopes(existing | added))
     return redirect(url_for("teacher_dashboard", teacher_id=teacher_id))
 
 @app.route("/teacher/<int:teacher_id>/courses/<int:course_id>/attendance", methods=["GET", "POST"])
+@teacher_required
+@cached_page(lambda teacher_id, course_id: [("course", course_id)])
 def teacher_attendance(teacher_id, course_id):
     """Mark and view attendance."""
-    conn = get_db_connection()
+    conn = get_db_connection(course_id)
     cur = conn.cursor()
 
-    cur.execute("SELECT 1 FROM teacher_courses WHERE teacher_id=? AND course_id=?", (teacher_id, course_id))
-    if not cur.fetchone():
-        conn.close()
+    if not has_course(conn, course_id):
         return render_template("error.html", message="You are not assigned to this course"), 403
 
+    queue = app.extensions.get("write_queue")
     if request.method == "GET":
-        cur.execute("""
-            SELECT s.id, s.name
-            FROM students s
-            JOIN student_courses sc ON s.id = sc.student_id
-            WHERE sc.course_id = ?
-        """, (course_id,))
-        students = cur.fetchall()
+        students = course_roster(conn, course_id)
 
-        cur.execute("""
-            SELECT date, COUNT(*) as total
-            FROM attendance
-            WHERE course_id = ?
-            GROUP BY date
-            ORDER BY date DESC
-        """, (course_id,))
-        attendance_dates = cur.fetchall()
-
-        cur.execute("SELECT name FROM courses WHERE id=?", (course_id,))
-        course = cur.fetchone()
-        conn.close()
+        dates = attendance_dates(cur, course_id).fetchall()
+        pending = queue.pending(course_id) if queue else {}
 
         return render_template("teacher_attendance.html",
                              teacher_id=teacher_id,
                              course_id=course_id,
-                             course_name=course['name'],
+                             course_name=course_name(conn, course_id),
                              students=students,
-                             attendance_dates=attendance_dates)
+                             attendance_dates=dates,
+                             pending_dates=sorted(((d, len(m)) for d, m in pending.items()), reverse=True),
+                             failed_dates=queue.failed(course_id) if queue else [])
 
     # POST - save attendance
     date = request.form.get("date") or datetime.date.today().isoformat()
-    
+    if is_archived(cur, date):
+        return render_template("error.html", message=f"The term of {date} is archived and read-only"), 400
+
     cur.execute("SELECT student_id FROM student_courses WHERE course_id=?", (course_id,))
-    students = cur.fetchall()
-    for s in students:
-        sid = s["student_id"]
-        status = request.form.get(f"status_{sid}")
+    marks = {}
+    for s in cur.fetchall():
+        status = request.form.get(f"status_{s['student_id']}")
         if status:
-            cur.execute("""
-                SELECT id FROM attendance WHERE student_id=? AND course_id=? AND date=?
-            """, (sid, course_id, date))
-            existing = cur.fetchone()
-            if existing:
-                cur.execute("UPDATE attendance SET status=? WHERE id=?", (status, existing["id"]))
-            else:
-                cur.execute("INSERT INTO attendance (student_id, course_id, date, status) VALUES (?,?,?,?)",
-                            (sid, course_id, date, status))
-
-    conn.commit()
-    conn.close()
+            marks[s["student_id"]] = status
+    if queue is not None:
+        # The form's submission_id makes a double-click or a resent form a no-op.
+        key = f"teacher-{teacher_id}:{request.form.get('submission_id') or uuid.uuid4().hex}"
+        state, results = queue.submit(conn, key, [{"course_id": course_id, "date": date, "statuses": marks}],
+                                      shard=shard_of(course_id))
+        bump(("course", course_id))
+        if state == "committed":
+            message = (f"Attendance for {date} was already saved: "
+                       f"{results[0]['inserted']} added, {results[0]['updated']} updated.")
+        elif state == "pending":
+            message = f"Attendance for {date} was already received and is being saved."
+        else:
+            message = f"Attendance for {date} received ({len(marks)} marks) and is being saved."
+        return render_template("message.html",
+                             title="Success",
+                             message=message,
+                             link_text="Back",
+                             link_url=url_for("teacher_attendance", teacher_id=teacher_id, course_id=course_id))
+    inserted, updated = run_write(save_attendance, course_id, date, marks, shard=shard_of(course_id))
+    invalidate_frames([course_id])
+    bump(("course", course_id))
     return render_template("message.html",
                          title="Success",
-                         message=f"Attendance saved for {date}",
+                         message=f"Attendance saved for {date}: {inserted} added, {updated} updated.",
                          link_text="Back",
                          link_url=url_for("teacher_attendance", teacher_id=teacher_id, course_id=course_id))
 
 @app.route("/teacher/<int:teacher_id>/courses/<int:course_id>/attendance/edit", methods=["GET", "POST"])
+@teacher_required
 def edit_attendance(teacher_id, course_id):
     """Edit attendance records for a specific date."""
     date = request.args.get("date") if request.method == "GET" else request.form.get("date")
-    conn = get_db_connection()
+    conn = get_db_connection(course_id)
     cur = conn.cursor()
 
-    cur.execute("SELECT 1 FROM teacher_courses WHERE teacher_id=? AND course_id=?", (teacher_id, course_id))
-    if not cur.fetchone():
-        conn.close()
+    if not has_course(conn, course_id):
         return render_template("error.html", message="You are not assigned to this course"), 403
 
     if request.method == "GET":
-        cur.execute("""
-            SELECT a.id, a.student_id, s.name, a.status
-            FROM attendance a
-            JOIN students s ON a.student_id = s.id
-            WHERE a.course_id=? AND a.date=?
-        """, (course_id, date))
-        rows = cur.fetchall()
-        conn.close()
+        rows = attendance_for_date(cur, course_id, date).fetchall()
+        queue = app.extensions.get("write_queue")
+        pending = queue.pending(course_id, date).get(date, {}) if queue else {}
+        if pending:
+            # Show marks still in the write queue over the committed ones.
+            rows = [{**dict(r), "status": pending.get(r["student_id"], r["status"]),
+                     "pending": r["student_id"] in pending} for r in rows]
         return render_template("teacher_edit_attendance.html",
                              teacher_id=teacher_id,
                              course_id=course_id,
                              date=date,
-                             attendance_records=rows)
+                             attendance_records=rows,
+                             pending_new=len(pending.keys() - {r["student_id"] for r in rows}))
 
     # POST - save edits
-    keys = [k for k in request.form.keys() if k.startswith("att_")]
-    for key in keys:
-        att_id = int(key.split("_", 1)[1])
-        status = request.form.get(key)
-        cur.execute("UPDATE attendance SET status=? WHERE id=?", (status, att_id))
-    conn.commit()
-    conn.close()
+    statuses = {int(k.split("_", 1)[1]): v for k, v in request.form.items() if k.startswith("att_")}
+    run_write(update_attendance_statuses, course_id, statuses, shard=shard_of(course_id))
+    invalidate_frames([course_id])
+    bump(("course", course_id))
     return redirect(url_for("teacher_attendance", teacher_id=teacher_id, course_id=course_id))
 
+def grid_range(cur, course_id, start, end):
+    """(start, end) of the grid editor; by default the week up to the course's latest record."""
+    if not end:
+        cur.execute("SELECT MAX(date) FROM attendance WHERE course_id=?", (course_id,))
+        end = cur.fetchone()[0] or datetime.date.today().isoformat()
+    end = datetime.date.fromisoformat(end)
+    start = datetime.date.fromisoformat(start) if start else end - datetime.timedelta(days=6)
+    if start > end or (end - start).days >= app.config["ATTENDANCE_GRID_MAX_DAYS"]:
+        raise ValueError(f"the range must be 1 to {app.config['ATTENDANCE_GRID_MAX_DAYS']} days")
+    return start.isoformat(), end.isoformat()
+
+@app.route("/teacher/<int:teacher_id>/courses/<int:course_id>/attendance/grid", methods=["GET", "POST"])
+@teacher_required
+def attendance_grid_editor(teacher_id, course_id):
+    """Edit a students-by-dates grid (?start=&end=) and save the changed cells at once."""
+    conn = get_db_connection(course_id)
+    cur = conn.cursor()
+    if not has_course(conn, course_id):
+        return render_template("error.html", message="You are not assigned to this course"), 403
+
+    form = request.args if request.method == "GET" else request.form
+    try:
+        start, end = grid_range(cur, course_id, form.get("start"), form.get("end"))
+    except ValueError as e:
+        return render_template("error.html", message=f"Invalid date range: {e}"), 400
+
+    edits, conflicts = {}, []
+    if request.method == "POST":
+        # Each cell posts its status and the status it showed (was_); the page's
+        # script leaves unchanged cells out, and any that come anyway are skipped.
+        cells = []
+        try:
+            for key, status in request.form.items():
+                if key.startswith("cell_") and status:
+                    sid, date = key[len("cell_"):].split("_", 1)
+                    in_range = datetime.date.fromisoformat(date).isoformat() == date and start <= date <= end
+                    if not in_range or status not in SUMMARY_COLUMNS:
+                        raise ValueError(key)
+                    cells.append((int(sid), date, request.form.get(f"was_{sid}_{date}") or None, status))
+        except ValueError:
+            return render_template("error.html", message="Invalid grid cell"), 400
+        cells = [c for c in cells if c[3] != c[2]]
+        if any(is_archived(cur, date) for date in {c[1] for c in cells}):
+            return render_template("error.html", message="Some of these dates are in an archived, read-only term"), 400
+        try:
+            inserted, updated = run_write(save_grid, course_id, cells, shard=shard_of(course_id))
+        except EditConflict as e:
+            # Show what is saved now, with this teacher's edits kept on top for a second try.
+            edits = {(sid, date): status for sid, date, _, status in cells}
+            conflicts = e.conflicts
+        else:
+            invalidate_frames([course_id])
+            bump(("course", course_id))
+            flash(f"Saved {inserted} new and {updated} changed marks.", "success")
+            return redirect(url_for("attendance_grid_editor", teacher_id=teacher_id, course_id=course_id,
+                                    start=start, end=end))
+
+    dates, students = attendance_grid(cur, course_id, start, end)
+    names = {s["id"]: s["name"] for s in students}
+    return render_template("teacher_attendance_grid.html",
+                           teacher_id=teacher_id,
+                           course_id=course_id,
+                           course_name=course_name(conn, course_id),
+                           start=start,
+                           end=end,
+                           dates=dates,
+                           students=students,
+                           edits=edits,
+                           conflicts=[{**c, "name": names.get(c["student_id"], c["student_id"])} for c in conflicts],
+                           conflict_cells={(c["student_id"], c["date"]) for c in conflicts}), 409 if conflicts else 200
+
+@app.route("/teacher/<int:teacher_id>/courses/<int:course_id>/attendance/export")
+@teacher_required
+def export_attendance(teacher_id, course_id):
+    """Download a student-by-date matrix (?start=&end=&format=csv|xlsx)."""
+    conn = get_read_connection(course_id)
+    if not has_course(conn, course_id):
+        return render_template("error.html", message="You are not assigned to this course"), 403
+
+    try:
+        start = datetime.date.fromisoformat(request.args.get("start") or "0001-01-01").isoformat()
+        end = datetime.date.fromisoformat(request.args.get("end") or "9999-12-31").isoformat()
+    except ValueError:
+        return render_template("error.html", message="Dates must be YYYY-MM-DD"), 400
+    filename = f"attendance_course{course_id}_{request.args.get('start') or 'all'}_{request.args.get('end') or 'all'}"
+
+    if request.args.get("format") == "xlsx":
+        if xlsxwriter is None:
+            return render_template("error.html", message="Excel export is not installed on this server"), 501
+        # xlsx is a zip archive, so it is written to a temp file (constant
+        # memory) and streamed from disk rather than generated on the fly.
+        fd, path = tempfile.mkstemp(suffix=".xlsx")
+        os.close(fd)
+        write_xlsx(iter_matrix(conn, course_id, start, end, app.config["ARCHIVE_DIR"]), path)
+        response = send_file(path, as_attachment=True, download_name=filename + ".xlsx")
+        response.call_on_close(lambda: os.remove(path))
+        return response
+
+    return app.response_class(stream_with_connection(iter_csv(iter_matrix(conn, course_id, start, end,
+                                                                                app.config["ARCHIVE_DIR"]))),
+                              mimetype="text/csv",
+                              headers={"Content-Disposition": f"attachment; filename={filename}.csv"})
+
+@app.route("/teacher/<int:teacher_id>/courses/<int:course_id>/analytics")
+@teacher_required
+def teacher_analytics(teacher_id, course_id):
+    """Attendance rates, trends, weekday heatmap and at-risk students (?threshold=75)."""
+    conn = get_read_connection(course_id)
+    if not has_course(conn, course_id):
+        return render_template("error.html", message="You are not assigned to this course"), 403
+    if np is None:
+        return render_template("error.html", message="Attendance analytics is not installed on this server"), 501
+    try:
+        threshold = float(request.args.get("threshold") or 75)
+    except ValueError:
+        return render_template("error.html", message="threshold must be a number"), 400
+
+    courses = teacher_courses(conn, teacher_id)
+    report = course_report(conn, course_id, [c["id"] for c in courses], threshold, connect=get_read_connection)
+    trend = report["trend"]
+    return render_template("teacher_analytics.html",
+                           teacher_id=teacher_id,
+                           course_id=course_id,
+                           course_name=course_name(conn, course_id),
+                           course_names={c["id"]: c["name"] for c in courses},
+                           report=report,
+                           students=zip(report["students"], report["student_weekday_rates"]),
+                           trend_points={w: chart_points([t[f"rolling_{w}"] for t in trend]) for w in (7, 30)})
+
 @app.route("/teacher/edit_profile/<int:teacher_id>", methods=["GET", "POST"])
+@teacher_required
 def edit_teacher_profile(teacher_id):
     """Edit teacher profile and course assignments."""
     conn = get_db_connection()
@@ -388,7 +663,6 @@ def edit_teacher_profile(teacher_id):
             ) tc ON c.id = tc.course_id
         """, (teacher_id,))
         courses = cur.fetchall()
-        conn.close()
         return render_template("teacher_profile.html",
                              teacher_id=teacher_id,
                              teacher_name=t['name'],
@@ -401,25 +675,26 @@ def edit_teacher_profile(teacher_id):
     password = request.form.get("password")
     selected = set(map(int, request.form.getlist("course_ids")))
 
-    if password:
-        cur.execute("UPDATE teachers SET name=?, email=?, password=? WHERE id=?", (name, email, password, teacher_id))
-    else:
-        cur.execute("UPDATE teachers SET name=?, email=? WHERE id=?", (name, email, teacher_id))
-
-    cur.execute("SELECT course_id FROM teacher_courses WHERE teacher_id=?", (teacher_id,))
-    existing = {r["course_id"] for r in cur.fetchall()}
-
-    for cid in selected - existing:
-        try:
-            cur.execute("INSERT INTO teacher_courses (teacher_id, course_id) VALUES (?, ?)", (teacher_id, cid))
-        except sqlite3.IntegrityError:
-            pass
+    try:
+        if password:
+            cur.execute("UPDATE teachers SET name=?, email=?, password=? WHERE id=?", (name, email, passwords.hash(password), teacher_id))
+        else:
+            cur.execute("UPDATE teachers SET name=?, email=? WHERE id=?", (name, email, teacher_id))
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return render_template("message.html",
+                             title="Error",
+                             message="A teacher with this email already exists.",
+                             link_text="Try Again",
+                             link_url=url_for("edit_teacher_profile", teacher_id=teacher_id))
 
-    for cid in existing - selected:
-        cur.execute("DELETE FROM teacher_courses WHERE teacher_id=? AND course_id=?", (teacher_id, cid))
+    added, removed = sync_teacher_courses(cur, teacher_id, selected)
 
     conn.commit()
-    conn.close()
+    invalidate_teacher_courses(teacher_id)
+    update_session(name=name, email=email, course_ids=selected)
+    # Cached course pages skip the view's has_course() check, so a dropped course's must go too.
+    bump(("teacher", teacher_id), *course_scopes(added | removed))
     return redirect(url_for("teacher_dashboard", teacher_id=teacher_id))
 
 # ================== STUDENT FLOWS ==================
@@ -433,7 +708,6 @@ def student_signup():
     if request.method == "GET":
         cur.execute("SELECT id, name FROM courses")
         courses = cur.fetchall()
-        conn.close()
         return render_template("student_signup.html", courses=courses)
 
     name = request.form.get("name")
@@ -442,14 +716,12 @@ def student_signup():
     course_ids = request.form.getlist("course_ids")
 
     try:
-        cur.execute("INSERT INTO students (name, email, password) VALUES (?,?,?)", (name, email, password))
+        cur.execute("INSERT INTO students (name, email, password) VALUES (?,?,?)", (name, email, passwords.hash(password)))
         student_id = cur.lastrowid
-        for cid in course_ids:
-            try:
-                cur.execute("INSERT INTO student_courses (student_id, course_id) VALUES (?, ?)", (student_id, cid))
-            except sqlite3.IntegrityError:
-                pass
+        sync_enrollments(cur, student_id, course_ids, course_ids)
         conn.commit()
+        invalidate_rosters(course_ids)
+        bump(*course_scopes(course_ids))
         return render_template("message.html",
                              title="Success",
                              message="Student account created successfully! You can now login.",
@@ -462,8 +734,6 @@ def student_signup():
                              message="A student with this email already exists.",
                              link_text="Try Again",
                              link_url=url_for("student_signup"))
-    finally:
-        conn.close()
 
 @app.route("/student/login", methods=["POST"])
 def student_login():
@@ -471,74 +741,76 @@ def student_login():
     email = request.form.get("email")
     password = request.form.get("password")
     conn = get_db_connection()
-    cur = conn.cursor()
-
-    cur.execute("SELECT id, name FROM students WHERE email=? AND password=?", (email, password))
-    student = cur.fetchone()
+    student = authenticate(conn, "student", email, password)
     if not student:
-        conn.close()
         return render_template("message.html",
                              title="Login Failed",
                              message="Invalid student credentials. Please try again.",
                              link_text="Back to Login",
                              link_url=url_for("home"))
 
+    login_user(conn, "student", student)
     student_id = student["id"]
-    conn.close()
     return redirect(url_for("student_dashboard", student_id=student_id))
 
 @app.route("/student/dashboard/<int:student_id>")
+@student_required
+@cached_page(lambda student_id: [("student", student_id), *course_scopes(session.get("course_ids", []))])
 def student_dashboard(student_id):
     """Student dashboard showing profile and courses."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    cur.execute("SELECT id, name FROM students WHERE id=?", (student_id,))
-    student = cur.fetchone()
-    if not student:
-        conn.close()
-        return render_template("error.html", message="Student not found"), 404
+    def query(conn, _):
+        return conn.execute("""
+            SELECT c.id, c.name, sm.present, sm.absent, sm.excused,
+                   ROUND(100.0 * sm.present / NULLIF(sm.present + sm.absent + sm.excused, 0), 1) AS rate
+            FROM courses c
+            JOIN student_courses sc ON c.id = sc.course_id
+            LEFT JOIN attendance_summary sm ON sm.student_id = sc.student_id AND sm.course_id = sc.course_id
+            WHERE sc.student_id = ?
+        """, (student_id,)).fetchall()
 
-    cur.execute("""
-        SELECT c.id, c.name
-        FROM courses c
-        JOIN student_courses sc ON c.id = sc.course_id
-        WHERE sc.student_id = ?
-    """, (student_id,))
-    courses = cur.fetchall()
-    conn.close()
+    # Every database file may hold some of the student's courses.
+    courses = [row for rows in fan_out(query, replica=True) for row in rows]
 
     return render_template("student_dashboard.html",
                          student_id=student_id,
-                         student_name=student['name'],
+                         student_name=session['name'],
                          courses=courses)
 
 @app.route("/student/<int:student_id>/courses/<int:course_id>/attendance")
+@student_required
 def student_view_attendance(student_id, course_id):
     """Student view attendance records."""
-    conn = get_db_connection()
+    conn = get_read_connection(course_id)
     cur = conn.cursor()
     
-    cur.execute("SELECT 1 FROM student_courses WHERE student_id=? AND course_id=?", (student_id, course_id))
-    if not cur.fetchone():
-        conn.close()
+    if not has_course(conn, course_id):
         return render_template("error.html", message="You are not enrolled in this course"), 403
 
-    cur.execute("SELECT date, status FROM attendance WHERE student_id=? AND course_id=? ORDER BY date DESC", 
+    page_size = clamp_page_size(request.args.get("page_size", type=int), app.config["ATTENDANCE_PAGE_SIZE"],
+                                app.config["ATTENDANCE_MAX_PAGE_SIZE"])
+    after = request.args.get("after")
+
+    cur.execute("SELECT present, absent, excused FROM attendance_summary WHERE student_id=? AND course_id=?",
                 (student_id, course_id))
-    records = cur.fetchall()
-    
-    cur.execute("SELECT name FROM courses WHERE id=?", (course_id,))
-    course = cur.fetchone()
-    conn.close()
+    summary = cur.fetchone() or {"present": 0, "absent": 0, "excused": 0}
 
-    return render_template("student_attendance.html",
-                         student_id=student_id,
-                         course_id=course_id,
-                         course_name=course['name'],
-                         records=records)
+    try:
+        records = attendance_history(cur, student_id, course_id, page_size, after, app.config["ARCHIVE_DIR"])
+    except ValueError:
+        return render_template("error.html", message="Invalid page link"), 400
+
+    page = stream_template("student_attendance.html",
+                           student_id=student_id,
+                           course_id=course_id,
+                           course_name=course_name(conn, course_id),
+                           records=records,
+                           page_size=page_size,
+                           is_first_page=not after,
+                           summary=summary)
+    return app.response_class(stream_with_connection(page))
 
 @app.route("/student/edit_profile/<int:student_id>", methods=["GET", "POST"])
+@student_required
 def edit_student_profile(student_id):
     """Edit student profile and course enrollment."""
     conn = get_db_connection()
@@ -549,9 +821,7 @@ def edit_student_profile(student_id):
         s = cur.fetchone()
         cur.execute("SELECT id, name FROM courses")
         courses = cur.fetchall()
-        cur.execute("SELECT course_id FROM student_courses WHERE student_id=?", (student_id,))
-        enrolled = {r["course_id"] for r in cur.fetchall()}
-        conn.close()
+        enrolled = user_course_ids(conn, "student", student_id)
         return render_template("student_profile.html",
                              student_id=student_id,
                              student_name=s['name'],
@@ -565,25 +835,26 @@ def edit_student_profile(student_id):
     password = request.form.get("password")
     selected = set(map(int, request.form.getlist("course_ids")))
 
-    if password:
-        cur.execute("UPDATE students SET name=?, email=?, password=? WHERE id=?", (name, email, password, student_id))
-    else:
-        cur.execute("UPDATE students SET name=?, email=? WHERE id=?", (name, email, student_id))
-
-    cur.execute("SELECT course_id FROM student_courses WHERE student_id=?", (student_id,))
-    existing = {r["course_id"] for r in cur.fetchall()}
-
-    for cid in selected - existing:
-        try:
-            cur.execute("INSERT INTO student_courses (student_id, course_id) VALUES (?, ?)", (student_id, cid))
-        except sqlite3.IntegrityError:
-            pass
+    try:
+        if password:
+            cur.execute("UPDATE students SET name=?, email=?, password=? WHERE id=?", (name, email, passwords.hash(password), student_id))
+        else:
+            cur.execute("UPDATE students SET name=?, email=? WHERE id=?", (name, email, student_id))
+    except sqlite3.IntegrityError:
+        conn.rollback()
+        return render_template("message.html",
+                             title="Error",
+                             message="A student with this email already exists.",
+                             link_text="Try Again",
+                             link_url=url_for("edit_student_profile", student_id=student_id))
 
-    for cid in existing - selected:
-        cur.execute("DELETE FROM student_courses WHERE student_id=? AND course_id=?", (student_id, cid))
+    all_course_ids = [r["id"] for r in cur.execute("SELECT id FROM courses")]
+    _, _, existing = sync_enrollments(cur, student_id, selected, all_course_ids)
 
     conn.commit()
-    conn.close()
+    invalidate_rosters(existing | selected)
+    update_session(name=name, email=email, course_ids=selected)
+    bump(("student", student_id), *course_scopes(existing | selected))
     return render_template("message.html",
                          title="Success",
                          message="Profile and enrollments updated successfully!",
@@ -0,0 +1,244 @@
+"""Archiving closed terms' attendance into per-term SQLite files.
+
+Almost every request touches the current term, but `attendance` and its
+indexes keep every term ever recorded. `archive` moves the rows of closed
+terms (the half-years of bitmaps.term_of) out of the database into one
+file per term in the archive directory, <database>-<term>.db, and records
+the file in attendance_archives. Per student and course, each moved row's
+counts are added to attendance_term_summary so attendance_summary can still
+be recomputed (attendance.py folds them in).
+
+Rows are moved a batch at a time, course by course, in two short
+transactions per batch: copy into the archive, then delete from the
+database. A crash in between leaves the batch in both files, and running
+the command again finishes it. The change log does not record the deletes:
+the rows still exist, only somewhere else.
+
+Reads reach into an archive only when they need to: a student's history
+ATTACHes older terms' files once the live rows run out before the page is
+full, and the export attaches the terms its date range covers. Marking
+attendance on a date in an archived term is refused; the term is read-only.
+
+    python backend/archive.py archive                     # every term before the current one
+    python backend/archive.py archive --before 2025-01-01 --batch 5000
+    python backend/archive.py list
+
+With a shard map, run it against each shard file (--db); each file keeps
+its own archives. Archive before splitting: split does not move archived
+rows.
+"""
+import argparse
+import contextlib
+import datetime
+import os
+import sqlite3
+import time
+
+from bitmaps import bitmaps_enabled, term_of
+
+BATCH = 5000
+# Seconds to sleep between batches, so app writers get the lock in between.
+PAUSE = 0.01
+
+
+def term_range(term):
+    """(first day, last day) of the term starting on `term` (YYYY-MM-DD)."""
+    start = datetime.date.fromisoformat(term)
+    end = datetime.date(start.year, 7, 1) if start.month == 1 else datetime.date(start.year + 1, 1, 1)
+    return start.isoformat(), (end - datetime.timedelta(days=1)).isoformat()
+
+
+def archive_file(db_path, term):
+    return f"{os.path.splitext(os.path.basename(db_path))[0]}-{term}.db"
+
+
+# ------------ Reading ------------
+def archived_terms(cur, start=None, end=None):
+    """Registered archives overlapping [start, end] (either may be None), newest first."""
+    try:
+        cur.execute("""
+            SELECT term, file, start_date, end_date FROM attendance_archives
+            WHERE start_date <= COALESCE(?, start_date) AND end_date >= COALESCE(?, end_date)
+            ORDER BY term DESC
+        """, (end, start))
+    except sqlite3.OperationalError:
+        return []  # a database from before migration 11
+    return cur.fetchall()
+
+
+def is_archived(cur, date):
+    """True when `date` falls in an archived term, whose attendance is read-only."""
+    return bool(archived_terms(cur, date, date))
+
+
+@contextlib.contextmanager
+def attached(conn, archive_dir, terms):
+    """ATTACH the archive files of `terms` (rows of archived_terms) for the block.
+
+    Yields the schema names, in the order of `terms`. Files that are missing
+    are skipped rather than created empty.
+    """
+    schemas = []
+    try:
+        for term in terms:
+            path = os.path.join(archive_dir, term[1])
+            if os.path.exists(path):
+                schema = f"archive_{term[0].replace('-', '')}"
+                conn.execute("ATTACH DATABASE ? AS " + schema, (path,))
+                schemas.append(schema)
+        yield schemas
+    finally:
+        for schema in schemas:
+            conn.execute("DETACH DATABASE " + schema)
+
+
+# ------------ Archiving ------------
+def _create_archive(conn, path):
+    """Create the archive file with the attendance table and its indexes (no triggers)."""
+    rows = conn.execute("""
+        SELECT sql FROM main.sqlite_master
+        WHERE tbl_name = 'attendance' AND type IN ('table', 'index') AND sql IS NOT NULL
+        ORDER BY type != 'table'
+    """).fetchall()
+    archive = sqlite3.connect(path)
+    try:
+        if archive.execute("SELECT 1 FROM sqlite_master WHERE name='attendance'").fetchone() is None:
+            for (sql,) in rows:
+                archive.execute(sql)
+            archive.commit()
+    finally:
+        archive.close()
+
+
+def _move_batch(conn, term, course_id, start, end, batch):
+    """Move up to `batch` of a course's rows in [start, end]; returns the number moved."""
+    ids = [r[0] for r in conn.execute("""
+        SELECT id FROM main.attendance WHERE course_id=? AND date BETWEEN ? AND ? LIMIT ?
+    """, (course_id, start, end, batch))]
+    if not ids:
+        return 0
+    marks = ",".join("?" * len(ids))
+
+    # 1. Copy. Only the archive is written, so the database stays unlocked.
+    conn.execute("BEGIN")
+    conn.execute(f"""
+        INSERT INTO archive.attendance (id, student_id, course_id, date, status)
+        SELECT id, student_id, course_id, date, status FROM main.attendance WHERE id IN ({marks})
+        ON CONFLICT (student_id, course_id, date) DO UPDATE SET status = excluded.status
+    """, ids)
+    conn.execute("COMMIT")
+
+    # 2. Count and delete, with the change log paused for this transaction only.
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute("UPDATE main.change_log_pause SET paused = 1 WHERE id = 1")
+    conn.execute(f"""
+        INSERT INTO main.attendance_term_summary (student_id, course_id, term, present, absent, excused, last_date)
+        SELECT student_id, course_id, ?, SUM(status = 'Present'), SUM(status = 'Absent'), SUM(status = 'Excused'),
+               MAX(date)
+        FROM main.attendance WHERE id IN ({marks})
+        GROUP BY student_id, course_id
+        ON CONFLICT (student_id, course_id, term) DO UPDATE SET
+            present = present + excluded.present,
+            absent = absent + excluded.absent,
+            excused = excused + excluded.excused,
+            last_date = MAX(last_date, excluded.last_date)
+    """, (term, *ids))
+    conn.execute(f"DELETE FROM main.attendance WHERE id IN ({marks})", ids)
+    conn.execute("UPDATE main.change_log_pause SET paused = 0 WHERE id = 1")
+    conn.execute("COMMIT")
+    return len(ids)
+
+
+def archive_term(db_path, archive_dir, term, batch=BATCH, pause=PAUSE, log=print):
+    """Move every row of one term into its archive file; returns the rows moved."""
+    start, end = term_range(term)
+    file = archive_file(db_path, term)
+    path = os.path.join(archive_dir, file)
+    os.makedirs(archive_dir, exist_ok=True)
+
+    conn = sqlite3.connect(db_path, isolation_level=None, timeout=30)
+    moved = 0
+    try:
+        _create_archive(conn, path)
+        # Registered first, so reads look in the archive as soon as any row is there.
+        conn.execute("INSERT OR IGNORE INTO attendance_archives (term, file, start_date, end_date) VALUES (?,?,?,?)",
+                     (term, file, start, end))
+        conn.execute("ATTACH DATABASE ? AS archive", (path,))
+        courses = [r[0] for r in conn.execute("SELECT DISTINCT course_id FROM attendance")]
+        for course_id in courses:
+            while True:
+                try:
+                    n = _move_batch(conn, term, course_id, start, end, batch)
+                finally:
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                if not n:
+                    break
+                moved += n
+                log(f"\r  {term}: {moved:,} rows", end="")
+                time.sleep(pause)
+            if bitmaps_enabled(conn):
+                # The bitmaps mirror the live rows only.
+                conn.execute("DELETE FROM attendance_bitmaps WHERE course_id=? AND term=?", (course_id, term))
+        total = conn.execute("SELECT COUNT(*) FROM archive.attendance").fetchone()[0]
+        conn.execute("UPDATE attendance_archives SET rows=?, archived_at=? WHERE term=?",
+                     (total, datetime.datetime.now().isoformat(timespec="seconds"), term))
+        conn.execute("DETACH DATABASE archive")
+    finally:
+        conn.close()
+    log(f"\r  {term}: {moved:,} rows moved to {file}")
+    return moved
+
+
+def closed_terms(db_path, before):
+    """Terms that end before `before` and still have rows in the database, oldest first."""
+    conn = sqlite3.connect(db_path)
+    try:
+        # Per course, so each lookup is one index probe rather than a table scan.
+        courses = [r[0] for r in conn.execute("SELECT DISTINCT course_id FROM attendance").fetchall()]
+        firsts = [conn.execute("SELECT MIN(date) FROM attendance WHERE course_id=?", (cid,)).fetchone()[0]
+                  for cid in courses]
+        terms, term = [], term_of(min(firsts))[0] if firsts else before
+        while term < before and term_range(term)[1] < before:
+            start, end = term_range(term)
+            if any(conn.execute("SELECT 1 FROM attendance WHERE course_id=? AND date BETWEEN ? AND ? LIMIT 1",
+                                (cid, start, end)).fetchone() for cid in courses):
+                terms.append(term)
+            term = term_of((datetime.date.fromisoformat(end) + datetime.timedelta(days=1)).isoformat())[0]
+    finally:
+        conn.close()
+    return terms
+
+
+def main(argv=None):
+    from db_setup import DB_PATH  # not at the top: db_setup imports attendance, which imports this module
+
+    parser = argparse.ArgumentParser(description="Move closed terms' attendance into per-term archive files.")
+    parser.add_argument("action", choices=("archive", "list"))
+    parser.add_argument("--before", default=term_of(datetime.date.today().isoformat())[0],
+                        help="archive terms ending before this date (default: the current term's start)")
+    parser.add_argument("--batch", type=int, default=BATCH, help="rows moved per transaction")
+    parser.add_argument("--pause", type=float, default=PAUSE, help="seconds between batches")
+    parser.add_argument("--db", default=DB_PATH, help="database file (default: ATTENDANCE_DB_PATH)")
+    parser.add_argument("--archive-dir", default=os.environ.get("ATTENDANCE_ARCHIVE_DIR"),
+                        help="where archive files go (default: archive/ next to the database)")
+    args = parser.parse_args(argv)
+    args.archive_dir = args.archive_dir or os.path.join(os.path.dirname(os.path.abspath(args.db)), "archive")
+
+    if args.action == "archive":
+        terms = closed_terms(args.db, args.before)
+        for term in terms:
+            archive_term(args.db, args.archive_dir, term, args.batch, args.pause)
+        print(f"✅ {len(terms)} term(s) archived" if terms else "✅ nothing to archive")
+    else:
+        conn = sqlite3.connect(args.db)
+        try:
+            for term, file, rows, archived_at in conn.execute(
+                    "SELECT term, file, rows, archived_at FROM attendance_archives ORDER BY term"):
+                print(f"{term}  {file}  {rows:,} rows  archived {archived_at or '(in progress)'}")
+        finally:
+            conn.close()
+
+
+if __name__ == "__main__":
+    main()
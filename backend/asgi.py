@@ -0,0 +1,16 @@
+"""ASGI entry point for production serving.
+
+    uvicorn asgi:application --app-dir backend --workers 4
+
+The Flask routes are synchronous, so a2wsgi runs each request on a bounded
+thread pool (ATTENDANCE_ASGI_THREADS, default 16). The event loop keeps
+accepting and buffering connections while those threads wait on SQLite or
+the password KDF. backend/serve.py sets workers and threads together.
+"""
+import os
+
+from a2wsgi import WSGIMiddleware
+
+from app import app
+
+application = WSGIMiddleware(app, workers=int(os.environ.get("ATTENDANCE_ASGI_THREADS", 16)))
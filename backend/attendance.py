@@ -0,0 +1,350 @@
+"""Attendance queries and write helpers shared by the HTML routes and the API.
+
+Every write to `attendance` goes through this module so the per-student
+`attendance_summary` counts, and the optional bitmaps (see bitmaps.py), stay
+in step with the raw rows. The summary holds one row per enrolled
+(student, course) pair that has at least one mark.
+"""
+
+import sqlite3
+from itertools import groupby
+
+from archive import archived_terms, attached
+from bitmaps import apply_bitmap_changes
+from pagination import KeysetPage, decode_cursor
+
+# Status value -> attendance_summary column
+SUMMARY_COLUMNS = {"Present": "present", "Absent": "absent", "Excused": "excused"}
+
+# Recompute expression shared by rebuild, refresh and the consistency check
+_SUMMARY_SELECT = """
+    SELECT a.student_id, a.course_id,
+           SUM(a.status = 'Present'), SUM(a.status = 'Absent'), SUM(a.status = 'Excused'),
+           MAX(a.date)
+    FROM attendance a
+    JOIN student_courses sc ON sc.student_id = a.student_id AND sc.course_id = a.course_id
+"""
+# The same with the counts of archived terms (see archive.py) added in.
+_ARCHIVED_SUMMARY_SELECT = """
+    SELECT a.student_id, a.course_id, SUM(a.present), SUM(a.absent), SUM(a.excused), MAX(a.date)
+    FROM (
+        SELECT student_id, course_id, status = 'Present' AS present, status = 'Absent' AS absent,
+               status = 'Excused' AS excused, date
+        FROM attendance
+        UNION ALL
+        SELECT student_id, course_id, present, absent, excused, last_date FROM attendance_term_summary
+    ) a
+    JOIN student_courses sc ON sc.student_id = a.student_id AND sc.course_id = a.course_id
+"""
+
+
+def _summary_select(cur):
+    try:
+        cur.execute("SELECT 1 FROM attendance_term_summary LIMIT 0")
+    except sqlite3.OperationalError:
+        return _SUMMARY_SELECT  # before migration 11 (it runs rebuild_summary from migration 5)
+    return _ARCHIVED_SUMMARY_SELECT
+
+
+def attendance_rate(counts):
+    """Percentage of marked days present, from a row with present/absent/excused.
+
+    Returns None when there is nothing to rate yet.
+    """
+    if not counts:
+        return None
+    total = counts["present"] + counts["absent"] + counts["excused"]
+    return round(100.0 * counts["present"] / total, 1) if total else None
+
+
+def attendance_dates(cur, course_id):
+    """Execute the per-date record counts query for a course, newest first."""
+    return cur.execute("""
+        SELECT date, COUNT(*) as total
+        FROM attendance
+        WHERE course_id = ?
+        GROUP BY date
+        ORDER BY date DESC
+    """, (course_id,))
+
+
+def attendance_for_date(cur, course_id, date):
+    """Execute the query for a course's records on one date, with student names."""
+    return cur.execute("""
+        SELECT a.id, a.student_id, s.name, a.status
+        FROM attendance a
+        JOIN students s ON a.student_id = s.id
+        WHERE a.course_id=? AND a.date=?
+    """, (course_id, date))
+
+
+def attendance_grid(cur, course_id, start, end):
+    """The roster against the dates in [start, end] that have any attendance.
+
+    One range query, pivoted here. Returns (dates, students) with dates
+    oldest first and students as {"id", "name", "statuses": {date: status}}
+    in name order.
+    """
+    # INDEXED BY as in export.iter_matrix: one (student, course, date) range per student.
+    cur.execute("""
+        SELECT s.id, s.name, a.date, a.status
+        FROM student_courses sc
+        JOIN students s ON s.id = sc.student_id
+        LEFT JOIN attendance a INDEXED BY ux_attendance_student_course_date
+               ON a.student_id = sc.student_id AND a.course_id = sc.course_id
+              AND a.date BETWEEN ? AND ?
+        WHERE sc.course_id = ?
+        ORDER BY s.name, s.id
+    """, (start, end, course_id))
+    students = [{"id": sid, "name": name, "statuses": {r[2]: r[3] for r in rows if r[2] is not None}}
+                for (sid, name), rows in groupby(cur.fetchall(), key=lambda r: (r[0], r[1]))]
+    dates = sorted({d for student in students for d in student["statuses"]})
+    return dates, students
+
+
+def _history_rows(cur, schema, student_id, course_id, limit, after):
+    if after:
+        after_date, after_id = after
+        cur.execute(f"""
+            SELECT id, date, status FROM {schema}.attendance
+            WHERE student_id=? AND course_id=? AND date <= ? AND (date < ? OR id < ?)
+            ORDER BY date DESC, id DESC LIMIT ?
+        """, (student_id, course_id, after_date, after_date, after_id, limit))
+    else:
+        cur.execute(f"""
+            SELECT id, date, status FROM {schema}.attendance
+            WHERE student_id=? AND course_id=?
+            ORDER BY date DESC, id DESC LIMIT ?
+        """, (student_id, course_id, limit))
+    return cur.fetchall()
+
+
+def attendance_history(cur, student_id, course_id, page_size, after=None, archive_dir=None):
+    """One page of a student's history, newest first, as a KeysetPage.
+
+    `after` is the next_cursor token of the previous page; a malformed token
+    raises ValueError. id breaks ties so (date, id) is a strict order.
+
+    With `archive_dir`, a page the live rows cannot fill continues into the
+    archived terms (archive.py), attaching one term's file at a time. Terms
+    do not overlap and archived ones take no new marks, so the live rows
+    come first and each term's rows follow the next newer one's.
+    """
+    after = decode_cursor(after, 2) if after else None
+    rows = _history_rows(cur, "main", student_id, course_id, page_size + 1, after)
+    if archive_dir is not None and len(rows) <= page_size:
+        for term in archived_terms(cur, end=after[0] if after else None):
+            with attached(cur.connection, archive_dir, [term]) as schemas:
+                for schema in schemas:
+                    rows += _history_rows(cur, schema, student_id, course_id, page_size + 1 - len(rows), after)
+            if len(rows) > page_size:
+                break
+    return KeysetPage.from_rows(rows, page_size, key=lambda r: (r["date"], r["id"]))
+
+
+def save_attendance(cur, course_id, date, marks):
+    """Save a roster's marks for one date in a constant number of statements.
+
+    `marks` maps student_id -> status. Rows whose status is unchanged are
+    skipped. Returns an (inserted, updated) tuple.
+    """
+    if not marks:
+        return 0, 0
+
+    cur.execute("SELECT student_id, status FROM attendance WHERE course_id=? AND date=?", (course_id, date))
+    existing = {r[0]: r[1] for r in cur.fetchall()}
+
+    changed = [(sid, status) for sid, status in marks.items() if existing.get(sid) != status]
+    cur.executemany("""
+        INSERT INTO attendance (student_id, course_id, date, status) VALUES (?,?,?,?)
+        ON CONFLICT (student_id, course_id, date) DO UPDATE SET status=excluded.status
+    """, [(sid, course_id, date, status) for sid, status in changed])
+    apply_summary_changes(cur, course_id,
+                          [(sid, date, existing.get(sid), status) for sid, status in changed])
+    apply_bitmap_changes(cur, course_id, [(sid, date, status) for sid, status in changed])
+
+    updated = sum(1 for sid, _ in changed if sid in existing)
+    return len(changed) - updated, updated
+
+
+def save_marks(cur, batches):
+    """Save several rosters' marks in one go, ignoring students not enrolled.
+
+    `batches` is a list of {"course_id", "date", "statuses"} where statuses
+    maps student_id (int or digit string) -> status. Returns one
+    {"course_id", "date", "inserted", "updated", "skipped"} per batch.
+    """
+    results = []
+    for batch in batches:
+        course_id, date = batch["course_id"], batch["date"]
+        cur.execute("SELECT student_id FROM student_courses WHERE course_id=?", (course_id,))
+        enrolled = {r[0] for r in cur.fetchall()}
+        marks, skipped = {}, []
+        for sid, status in batch["statuses"].items():
+            if str(sid).isdigit() and int(sid) in enrolled:
+                marks[int(sid)] = status
+            else:
+                skipped.append(sid)
+        inserted, updated = save_attendance(cur, course_id, date, marks)
+        results.append({"course_id": course_id, "date": date,
+                        "inserted": inserted, "updated": updated, "skipped": skipped})
+    return results
+
+
+def update_attendance_statuses(cur, course_id, statuses):
+    """Set new statuses on existing rows of one course.
+
+    `statuses` maps attendance id -> status; ids belonging to other courses
+    are ignored. Returns the number of rows that changed.
+    """
+    if not statuses:
+        return 0
+
+    # Rows of students who have since left the course stay editable but are
+    # not part of the summary.
+    cur.execute(f"""
+        SELECT a.id, a.student_id, a.date, a.status, sc.student_id IS NOT NULL
+        FROM attendance a
+        LEFT JOIN student_courses sc ON sc.student_id = a.student_id AND sc.course_id = a.course_id
+        WHERE a.course_id=? AND a.id IN ({",".join("?" * len(statuses))})
+    """, (course_id, *statuses))
+    changes = [tuple(r) for r in cur.fetchall() if statuses[r[0]] != r[3]]
+
+    cur.executemany("UPDATE attendance SET status=? WHERE id=?", [(statuses[c[0]], c[0]) for c in changes])
+    apply_summary_changes(cur, course_id, [(sid, date, old, statuses[att_id])
+                                           for att_id, sid, date, old, enrolled in changes if enrolled])
+    apply_bitmap_changes(cur, course_id, [(sid, date, statuses[att_id]) for att_id, sid, date, _, _ in changes])
+    return len(changes)
+
+
+class EditConflict(Exception):
+    """Cells someone else changed after the editor loaded them; nothing was saved."""
+
+    def __init__(self, conflicts):
+        super().__init__(f"{len(conflicts)} cell(s) were changed by someone else")
+        self.conflicts = conflicts
+
+
+def _current_statuses(cur, course_id, cells):
+    """{(student_id, date): status} of the cells' rows that exist, in one range query."""
+    students = sorted({c[0] for c in cells})
+    dates = [c[1] for c in cells]
+    cur.execute(f"""
+        SELECT student_id, date, status FROM attendance
+        WHERE course_id=? AND date BETWEEN ? AND ? AND student_id IN ({",".join("?" * len(students))})
+    """, (course_id, min(dates), max(dates), *students))
+    return {(r[0], r[1]): r[2] for r in cur.fetchall()}
+
+
+def _conflicts(cells, current):
+    return [{"student_id": sid, "date": date, "was": was, "now": current.get((sid, date)), "status": status}
+            for sid, date, was, status in cells if current.get((sid, date)) != was]
+
+
+def save_grid(cur, course_id, cells):
+    """Apply a grid editor's changed cells as one upsert, or none of them.
+
+    `cells` is a list of (student_id, date, was, status), `was` being the
+    status the editor showed (None for an empty cell). This is the
+    optimistic check: when any cell no longer holds its `was`, nothing is
+    written and EditConflict lists those cells. Students not enrolled are
+    ignored. Returns an (inserted, updated) tuple.
+    """
+    cells = [c for c in cells if c[3] != c[2]]
+    if not cells:
+        return 0, 0
+    students = sorted({c[0] for c in cells})
+    cur.execute(f"""
+        SELECT student_id FROM student_courses WHERE course_id=? AND student_id IN ({",".join("?" * len(students))})
+    """, (course_id, *students))
+    enrolled = {r[0] for r in cur.fetchall()}
+    cells = [c for c in cells if c[0] in enrolled]
+    if not cells:
+        return 0, 0
+
+    conflicts = _conflicts(cells, _current_statuses(cur, course_id, cells))
+    if conflicts:
+        raise EditConflict(conflicts)
+    # The WHERE repeats the check in the statement itself, for a caller whose
+    # transaction did not take the write lock before the read above.
+    cur.executemany("""
+        INSERT INTO attendance (student_id, course_id, date, status) VALUES (?,?,?,?)
+        ON CONFLICT (student_id, course_id, date) DO UPDATE SET status=excluded.status
+        WHERE attendance.status IS ?
+    """, [(sid, course_id, date, status, was) for sid, date, was, status in cells])
+    if cur.rowcount != len(cells):
+        # Cells the upsert did write now hold their new status; the rest are the conflicts.
+        raise EditConflict([c for c in _conflicts(cells, _current_statuses(cur, course_id, cells))
+                            if c["now"] != c["status"]])
+
+    apply_summary_changes(cur, course_id, [(sid, date, was, status) for sid, date, was, status in cells])
+    apply_bitmap_changes(cur, course_id, [(sid, date, status) for sid, date, _, status in cells])
+    updated = sum(1 for c in cells if c[2] is not None)
+    return len(cells) - updated, updated
+
+
+def apply_summary_changes(cur, course_id, changes):
+    """Fold status changes into attendance_summary.
+
+    `changes` is a list of (student_id, date, old_status, new_status); an old
+    status of None means the row is new. Deltas are collapsed per student and
+    written with one executemany upsert.
+    """
+    deltas = {}
+    for sid, date, old, new in changes:
+        d = deltas.setdefault(sid, {"present": 0, "absent": 0, "excused": 0, "last_date": date})
+        if old in SUMMARY_COLUMNS:
+            d[SUMMARY_COLUMNS[old]] -= 1
+        if new in SUMMARY_COLUMNS:
+            d[SUMMARY_COLUMNS[new]] += 1
+        d["last_date"] = max(d["last_date"], date)
+
+    cur.executemany("""
+        INSERT INTO attendance_summary (student_id, course_id, present, absent, excused, last_date)
+        VALUES (?,?,?,?,?,?)
+        ON CONFLICT (student_id, course_id) DO UPDATE SET
+            present = present + excluded.present,
+            absent = absent + excluded.absent,
+            excused = excused + excluded.excused,
+            last_date = MAX(last_date, excluded.last_date)
+    """, [(sid, course_id, d["present"], d["absent"], d["excused"], d["last_date"])
+          for sid, d in deltas.items()])
+
+
+def refresh_summary_pairs(cur, pairs):
+    """Recompute summary rows for (student_id, course_id) pairs."""
+    pairs = list(pairs)
+    cur.executemany("DELETE FROM attendance_summary WHERE student_id=? AND course_id=?", pairs)
+    cur.executemany(f"""
+        INSERT INTO attendance_summary (student_id, course_id, present, absent, excused, last_date)
+        {_summary_select(cur)}
+        WHERE a.student_id=? AND a.course_id=?
+        GROUP BY a.student_id, a.course_id
+    """, pairs)
+
+
+def rebuild_summary(cur):
+    """Recompute the whole summary table from raw attendance rows."""
+    cur.execute("DELETE FROM attendance_summary")
+    cur.execute(f"""
+        INSERT INTO attendance_summary (student_id, course_id, present, absent, excused, last_date)
+        {_summary_select(cur)}
+        GROUP BY a.student_id, a.course_id
+    """)
+
+
+def check_summary(cur):
+    """Compare attendance_summary with a full recompute.
+
+    Returns a list of (student_id, course_id, stored, expected) for every pair
+    that differs, where stored/expected are (present, absent, excused,
+    last_date) tuples or None when the row is missing.
+    """
+    cur.execute(f"{_summary_select(cur)} GROUP BY a.student_id, a.course_id")
+    expected = {(r[0], r[1]): tuple(r[2:]) for r in cur.fetchall()}
+    cur.execute("SELECT student_id, course_id, present, absent, excused, last_date FROM attendance_summary")
+    stored = {(r[0], r[1]): tuple(r[2:]) for r in cur.fetchall()}
+
+    return [(sid, cid, stored.get((sid, cid)), expected.get((sid, cid)))
+            for sid, cid in sorted(expected.keys() | stored.keys())
+            if stored.get((sid, cid)) != expected.get((sid, cid))]
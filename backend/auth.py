@@ -0,0 +1,98 @@
+"""Login state for teachers and students.
+
+After login the session holds the principal's role, id, name, email and
+course ids, so routes can check identity without a database query. Course
+access is checked against the cached lookups instead (see has_course). URLs
+keep their teacher_id/student_id segments, but a page is only served when
+that id is the logged-in user's own.
+"""
+from functools import wraps
+
+from flask import current_app, render_template, session, url_for
+
+from db import fan_out, get_db_connection
+from lookups import course_roster, is_teacher_assigned, teacher_courses
+
+TABLES = {"teacher": "teachers", "student": "students"}
+
+
+def authenticate(conn, role, email, password):
+    """Return the user's row if the password matches, upgrading its hash if needed."""
+    hasher = current_app.extensions["passwords"]
+    table = TABLES[role]
+    user = conn.execute(f"SELECT id, name, email, password FROM {table} WHERE email=?", (email,)).fetchone()
+    if not hasher.verify(user["password"] if user else None, password):
+        return None
+    # Upgrade plaintext or old-cost hashes now that we know the password.
+    if hasher.needs_rehash(user["password"]):
+        conn.execute(f"UPDATE {table} SET password=? WHERE id=?", (hasher.hash(password), user["id"]))
+        conn.commit()
+    return user
+
+
+def course_ids(conn, role, user_id):
+    """Ids of the courses a teacher teaches or a student is enrolled in."""
+    if role == "teacher":
+        return {c["id"] for c in teacher_courses(conn, user_id)}
+    # Enrollments may be spread over several database files (see shards.py).
+    return set().union(*fan_out(lambda c, _: {r[0] for r in c.execute(
+        "SELECT course_id FROM student_courses WHERE student_id=?", (user_id,))}))
+
+
+def login_user(conn, role, user):
+    session.clear()
+    if hasattr(session, "rotate"):
+        session.rotate()
+    session.permanent = True
+    session.update(role=role, id=user["id"], name=user["name"], email=user["email"],
+                   course_ids=sorted(course_ids(conn, role, user["id"])))
+
+
+def logout_user():
+    session.clear()
+
+
+def update_session(**values):
+    """Refresh cached profile fields after the user edits them."""
+    if "course_ids" in values:
+        values["course_ids"] = sorted(values["course_ids"])
+    session.update(values)
+
+
+def is_logged_in(role, user_id=None):
+    return session.get("role") == role and (user_id is None or session.get("id") == user_id)
+
+
+def has_course(conn, course_id):
+    """True if the logged-in user teaches / is enrolled in the course.
+
+    Checked against the teacher-course and roster lookups, which the routes
+    that change assignments invalidate, rather than the ids saved in the
+    session at login: a teacher removed from a course would otherwise keep
+    access to it until logging out.
+    """
+    if not isinstance(course_id, int):
+        return False
+    if session["role"] == "teacher":
+        return is_teacher_assigned(conn, session["id"], course_id)
+    return any(s["id"] == session["id"] for s in course_roster(get_db_connection(course_id), course_id))
+
+
+def login_required(role, id_arg=None):
+    """Serve the view only to a logged-in `role` whose id matches the `id_arg` URL segment."""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if not is_logged_in(role, kwargs.get(id_arg)):
+                return render_template("message.html",
+                                       title="Please Log In",
+                                       message=f"Log in as this {role} to view this page.",
+                                       link_text="Go to Login",
+                                       link_url=url_for("home")), 401
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
+
+
+teacher_required = login_required("teacher", "teacher_id")
+student_required = login_required("student", "student_id")
@@ -0,0 +1,229 @@
+"""Optional compact copy of attendance as 2-bit-per-day bitmaps.
+
+One row of `attendance_bitmaps` holds a student's marks in one course for
+one term (January-June or July-December): day N of the term is bits
+2N..2N+1 of the blob, four days per byte, with 0 = no mark, 1 = Present,
+2 = Absent, 3 = Excused. A full term is at most 46 bytes, compared with
+one ~40-byte row plus two index entries per marked day in `attendance`.
+
+The table is created and filled by `db_setup.py --build-bitmaps`. While it
+exists, the write helpers in attendance.py keep it in step with the rows,
+the same way they maintain attendance_summary. The `attendance` table stays
+the source of truth; a status outside the three codes, or a date that is not
+YYYY-MM-DD, is not represented here (its day reads as unmarked).
+"""
+import datetime
+from functools import lru_cache
+from itertools import groupby
+
+CODES = {"Present": 1, "Absent": 2, "Excused": 3}
+STATUSES = {code: status for status, code in CODES.items()}
+
+# Rows per executemany when building the table.
+BUILD_BATCH = 5000
+# Longest term (July-December) in days.
+TERM_DAYS = 184
+
+# (day within the byte, code) of the marked days in each possible byte.
+_BYTE_DAYS = [tuple((j, (b >> (j * 2)) & 3) for j in range(4) if (b >> (j * 2)) & 3) for b in range(256)]
+
+
+# ------------ Encoding ------------
+@lru_cache(maxsize=4096)
+def term_of(date):
+    """(term start as YYYY-MM-DD, day offset within the term) for a YYYY-MM-DD date."""
+    day = datetime.date.fromisoformat(date)
+    start = datetime.date(day.year, 1 if day.month <= 6 else 7, 1)
+    return start.isoformat(), (day - start).days
+
+
+def encode(days):
+    """Pack {day offset: code} into a blob; trailing unmarked days take no space."""
+    marked = [i for i, code in days.items() if code]
+    if not marked:
+        return b""
+    buf = bytearray(max(marked) // 4 + 1)
+    for i, code in days.items():
+        buf[i >> 2] |= code << ((i & 3) * 2)
+    return bytes(buf)
+
+
+def decode(blob):
+    """Yield (day offset, code) for each marked day, in order."""
+    for index, byte in enumerate(blob):
+        if byte:
+            base = index * 4
+            for j, code in _BYTE_DAYS[byte]:
+                yield base + j, code
+
+
+def patch(blob, changes):
+    """Return `blob` with each (day offset, code) in `changes` set; code 0 clears the day."""
+    buf = bytearray(blob)
+    for i, code in changes:
+        if i >> 2 >= len(buf):
+            if not code:
+                continue
+            buf.extend(bytes((i >> 2) - len(buf) + 1))
+        shift = (i & 3) * 2
+        buf[i >> 2] = (buf[i >> 2] & ~(3 << shift) & 0xFF) | (code << shift)
+    return bytes(buf).rstrip(b"\0")
+
+
+@lru_cache(maxsize=64)
+def _term_day_names(term):
+    """YYYY-MM-DD of every day offset in a term."""
+    start = datetime.date.fromisoformat(term).toordinal()
+    return [datetime.date.fromordinal(start + i).isoformat() for i in range(TERM_DAYS)]
+
+
+def term_dates(term, blob):
+    """(date, status) for each marked day of a term's blob, oldest first."""
+    names = _term_day_names(term)
+    return [(names[i], STATUSES[code]) for i, code in decode(blob)]
+
+
+# ------------ Table ------------
+def create_table(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS attendance_bitmaps (
+        course_id INTEGER NOT NULL,
+        student_id INTEGER NOT NULL,
+        term TEXT NOT NULL,
+        days BLOB NOT NULL,
+        PRIMARY KEY (course_id, student_id, term)
+    ) WITHOUT ROWID
+    """)
+
+
+def bitmaps_enabled(cur):
+    """True once db_setup.py --build-bitmaps has created the table."""
+    return cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='attendance_bitmaps'") \
+        .fetchone() is not None
+
+
+def apply_bitmap_changes(cur, course_id, changes):
+    """Fold (student_id, date, new_status) changes for one course into the bitmaps.
+
+    Does nothing when the bitmaps are not enabled. Each affected
+    (student, term) blob is read, patched and written back once.
+    """
+    if not changes or not bitmaps_enabled(cur):
+        return
+    by_key = {}
+    for sid, date, status in changes:
+        try:
+            term, offset = term_of(date)
+        except ValueError:
+            continue  # not a YYYY-MM-DD date, so it has no day in any term
+        by_key.setdefault((sid, term), []).append((offset, CODES.get(status, 0)))
+
+    students = sorted({sid for sid, _ in by_key})
+    terms = sorted({term for _, term in by_key})
+    stored = {}
+    for i in range(0, len(students), 500):  # stay under SQLite's bound-parameter limit
+        chunk = students[i:i + 500]
+        cur.execute(f"""
+            SELECT student_id, term, days FROM attendance_bitmaps
+            WHERE course_id=? AND student_id IN ({",".join("?" * len(chunk))})
+              AND term IN ({",".join("?" * len(terms))})
+        """, (course_id, *chunk, *terms))
+        stored.update({(r[0], r[1]): r[2] for r in cur.fetchall()})
+
+    blobs = [(sid, term, patch(stored.get((sid, term), b""), days)) for (sid, term), days in by_key.items()]
+    cur.executemany("DELETE FROM attendance_bitmaps WHERE course_id=? AND student_id=? AND term=?",
+                    [(course_id, sid, term) for sid, term, blob in blobs if not blob])
+    cur.executemany("""
+        INSERT INTO attendance_bitmaps (course_id, student_id, term, days) VALUES (?,?,?,?)
+        ON CONFLICT (course_id, student_id, term) DO UPDATE SET days=excluded.days
+    """, [(course_id, sid, term, blob) for sid, term, blob in blobs if blob])
+
+
+def encode_rows(rows, counts):
+    """Yield (course_id, student_id, term, blob) from (student_id, course_id, date, status) rows.
+
+    Rows must be ordered by student and course. counts["encoded"] and
+    counts["skipped"] (unknown status or malformed date) are updated as rows
+    are read.
+    """
+    for (sid, cid), marks in groupby(rows, key=lambda r: (r[0], r[1])):
+        terms = {}
+        for _, _, date, status in marks:
+            code = CODES.get(status)
+            try:
+                term, offset = term_of(date)
+            except ValueError:
+                code = None
+            if not code:
+                counts["skipped"] += 1
+                continue
+            terms.setdefault(term, {})[offset] = code
+            counts["encoded"] += 1
+        for term, days in terms.items():
+            yield cid, sid, term, encode(days)
+
+
+def _ordered_rows(cur):
+    # ux_attendance_student_course_date delivers rows already in this order.
+    return cur.connection.execute("""
+        SELECT student_id, course_id, date, status FROM attendance
+        ORDER BY student_id, course_id, date
+    """)
+
+
+def build_bitmaps(cur):
+    """Create (or recreate) attendance_bitmaps from the attendance rows.
+
+    Returns (blobs written, rows encoded, rows skipped for an unknown status
+    or a malformed date).
+    """
+    cur.execute("DROP TABLE IF EXISTS attendance_bitmaps")
+    create_table(cur)
+    counts = {"encoded": 0, "skipped": 0}
+    blobs = 0
+    batch = []
+    for blob in encode_rows(_ordered_rows(cur), counts):
+        batch.append(blob)
+        if len(batch) >= BUILD_BATCH:
+            cur.executemany("INSERT INTO attendance_bitmaps (course_id, student_id, term, days) VALUES (?,?,?,?)",
+                            batch)
+            blobs += len(batch)
+            batch.clear()
+    cur.executemany("INSERT INTO attendance_bitmaps (course_id, student_id, term, days) VALUES (?,?,?,?)", batch)
+    return blobs + len(batch), counts["encoded"], counts["skipped"]
+
+
+def drop_bitmaps(cur):
+    cur.execute("DROP TABLE IF EXISTS attendance_bitmaps")
+
+
+def bitmap_history(cur, student_id, course_id):
+    """(date, status) of a student's marks in a course from the bitmaps, newest first."""
+    cur.execute("SELECT term, days FROM attendance_bitmaps WHERE course_id=? AND student_id=? ORDER BY term DESC",
+                (course_id, student_id))
+    return [mark for term, days in cur.fetchall() for mark in reversed(term_dates(term, days))]
+
+
+def check_bitmaps(cur):
+    """Compare the bitmaps with the attendance rows.
+
+    Returns (student_id, course_id, date, row status, bitmap status) for every
+    day that differs; statuses are None where one side has no mark. Rows with
+    a status the bitmaps cannot hold are not compared. The rows are encoded
+    again and compared blob by blob; only differing blobs are decoded.
+    """
+    stored = {(r[0], r[1], r[2]): r[3] for r in
+              cur.execute("SELECT course_id, student_id, term, days FROM attendance_bitmaps").fetchall()}
+    differing = []
+    for cid, sid, term, blob in encode_rows(_ordered_rows(cur), {"encoded": 0, "skipped": 0}):
+        days = stored.pop((cid, sid, term), b"")
+        if days != blob:
+            differing.append((cid, sid, term, blob, days))
+    differing += [(cid, sid, term, b"", days) for (cid, sid, term), days in stored.items()]
+
+    mismatches = []
+    for cid, sid, term, expected, actual in differing:
+        rows, bitmap = dict(term_dates(term, expected)), dict(term_dates(term, actual))
+        mismatches += [(sid, cid, date, rows.get(date), bitmap.get(date))
+                       for date in sorted(rows.keys() | bitmap.keys()) if rows.get(date) != bitmap.get(date)]
+    return sorted(mismatches)
@@ -0,0 +1,79 @@
+"""Read or trim the attendance/enrollment change log (see change_log.py).
+
+Usage:
+    python backend/change_feed.py changes --since 1200            # JSON lines after seq 1200
+    python backend/change_feed.py changes --since 1200 --batch 5000 -o delta.jsonl
+    python backend/change_feed.py compact --retention-days 30     # e.g. nightly from cron
+    python backend/change_feed.py stats
+
+`changes` reads in batches of --batch entries until it reaches the end of
+the log and prints the seq to continue from on stderr. It exits with status
+2 when entries after --since were purged (resync from a full dump). With a
+shard map, point --db at each shard file in turn; each has its own log.
+"""
+import argparse
+import datetime
+import json
+import sqlite3
+import sys
+
+from change_log import LogTruncated, changes, compact_and_purge, entry, log_stats
+from db_setup import DB_PATH
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Read or trim the attendance change log.")
+    parser.add_argument("--db", default=DB_PATH, help="database file")
+    sub = parser.add_subparsers(dest="action", required=True)
+    read = sub.add_parser("changes", help="print entries after --since as JSON lines")
+    read.add_argument("--since", type=int, default=0, help="last seq already applied")
+    read.add_argument("--batch", type=int, default=1000, help="entries read per query")
+    read.add_argument("-o", "--output", help="output file (default stdout)")
+    trim = sub.add_parser("compact", help="drop superseded entries and purge old ones")
+    trim.add_argument("--retention-days", type=float, default=30, help="purge entries older than this")
+    sub.add_parser("stats", help="row count, first/last seq and the purge horizon")
+    args = parser.parse_args(argv)
+
+    if args.action == "changes":
+        if args.since < 0:
+            parser.error("--since must be a seq (0 or more)")
+        if args.batch < 1:
+            parser.error("--batch must be at least 1")
+        conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+        out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+        since, total = args.since, 0
+        try:
+            while True:
+                # Each batch is its own short read, so writers are never held up by a long dump.
+                rows = changes(conn.cursor(), since, args.batch).fetchall()
+                for row in rows:
+                    out.write(json.dumps(entry(row)) + "\n")
+                total += len(rows)
+                if len(rows) < args.batch:
+                    break
+                since = rows[-1][0]
+            since = rows[-1][0] if rows else since
+        except LogTruncated as e:
+            print(f"❌ {e}", file=sys.stderr)
+            return 2
+        finally:
+            if args.output:
+                out.close()
+            conn.close()
+        print(f"✅ {total:,} changes; continue with --since {since}", file=sys.stderr)
+        return 0
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        if args.action == "compact":
+            compacted, purged = compact_and_purge(conn.cursor(), datetime.timedelta(days=args.retention_days))
+            conn.commit()
+            print(f"✅ {compacted:,} superseded and {purged:,} expired entries removed")
+        print(json.dumps(log_stats(conn.cursor())))
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
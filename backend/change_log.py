@@ -0,0 +1,106 @@
+"""Reading and trimming the attendance/enrollment change log.
+
+Triggers (migration 10) append a row to change_log for every attendance
+record and enrollment that is added, changed or removed, whichever write
+path made it. Rows carry a seq that only grows, so a downstream system
+(registrar, LMS) keeps the last seq it applied and asks for what came
+after it instead of re-reading whole tables:
+
+    entity "attendance": op "upsert" (with status) or "delete", keyed by
+                         (student_id, course_id, date)
+    entity "enrollment": op "upsert" or "delete", keyed by (student_id, course_id)
+
+Two kinds of trimming keep the log small:
+
+- compact() drops entries a later entry for the same key supersedes. Any
+  consumer still gets each key's latest state, so it is always safe.
+- purge() drops entries older than a retention period. A consumer whose
+  seq is behind the purged ones has missed changes and must resync from a
+  full dump; changes() raises LogTruncated for it.
+
+With a shard map every database file has its own log and sequence.
+"""
+import datetime
+
+# Entries kept by the purge step of compact_and_purge() by default.
+DEFAULT_RETENTION = datetime.timedelta(days=30)
+COLUMNS = ("seq", "changed_at", "entity", "op", "student_id", "course_id", "date", "status")
+
+
+class LogTruncated(Exception):
+    """The requested seq is older than the retained log."""
+
+    def __init__(self, since, purged_through):
+        super().__init__(f"changes after {since} were purged (through seq {purged_through}); resync from a full dump")
+        self.since = since
+        self.purged_through = purged_through
+
+
+def purged_through(cur):
+    cur.execute("SELECT purged_through FROM change_log_horizon WHERE id=1")
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def last_seq(cur):
+    cur.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log")
+    return cur.fetchone()[0]
+
+
+def changes(cur, since, limit):
+    """Execute the query for up to `limit` entries after `since`, oldest first, and return the cursor.
+
+    Raises LogTruncated when entries after `since` have been purged.
+    """
+    horizon = purged_through(cur)
+    if since < horizon:
+        raise LogTruncated(since, horizon)
+    cur.execute(f"SELECT {', '.join(COLUMNS)} FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?", (since, limit))
+    return cur
+
+
+def entry(row):
+    """A log row as a dict, without the columns that do not apply to its entity."""
+    item = dict(zip(COLUMNS, row))
+    if item["entity"] == "enrollment":
+        del item["date"], item["status"]
+    elif item["op"] == "delete":
+        del item["status"]
+    return item
+
+
+# ------------ Trimming ------------
+def compact(cur):
+    """Drop entries superseded by a later entry for the same key; returns the rows removed."""
+    cur.execute("""
+        DELETE FROM change_log WHERE seq NOT IN (
+            SELECT MAX(seq) FROM change_log GROUP BY entity, student_id, course_id, date)
+    """)
+    return cur.rowcount
+
+
+def purge(cur, older_than):
+    """Drop entries logged before `older_than` (a datetime, UTC); returns the rows removed."""
+    cutoff = older_than.strftime("%Y-%m-%dT%H:%M:%SZ")
+    cur.execute("SELECT MAX(seq) FROM change_log WHERE changed_at < ?", (cutoff,))
+    through = cur.fetchone()[0]
+    if through is None:
+        return 0
+    # By seq rather than time, so the horizon is exact even if clocks went backwards.
+    cur.execute("DELETE FROM change_log WHERE seq <= ?", (through,))
+    removed = cur.rowcount
+    cur.execute("UPDATE change_log_horizon SET purged_through = MAX(purged_through, ?) WHERE id=1", (through,))
+    return removed
+
+
+def compact_and_purge(cur, retention=DEFAULT_RETENTION):
+    """compact() everything, then purge() what is older than `retention`; returns (compacted, purged)."""
+    compacted = compact(cur)
+    purged = purge(cur, datetime.datetime.now(datetime.timezone.utc) - retention)
+    return compacted, purged
+
+
+def log_stats(cur):
+    cur.execute("SELECT COUNT(*), MIN(seq), MAX(seq) FROM change_log")
+    rows, first, last = cur.fetchone()
+    return {"rows": rows, "first_seq": first, "last_seq": last, "purged_through": purged_through(cur)}
@@ -0,0 +1,271 @@
+"""Request-scoped access to the pooled SQLite databases.
+
+Shared by app.py and the blueprints so they all draw from the same pools.
+Without a shard map there is one database. With one (SHARD_MAP, see
+shards.py) each shard file gets its own pool and writer thread; routes pass
+a course id to get the connection for the file that holds the course, and
+views that span courses use fan_out(). With DB_REPLICAS, pages that may
+show slightly old data read from local copies (see replicas.py) through
+get_read_connection(), except right after a write to the same database
+(see replicas_behind).
+"""
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, g, stream_with_context
+
+from db_pool import ConnectionPool
+from db_writer import DatabaseWriter
+from db_setup import migrate
+from instrumentation import bind_sql_stats
+from replicas import Replica
+from shards import MAIN, ShardMap, attached_factory
+
+# ------------ Paths ------------
+DB_PATH = os.environ.get("ATTENDANCE_DB_PATH",
+                         os.path.join(os.path.dirname(__file__), "..", "database", "attendance.db"))
+# Streamed responses are sent in pieces of about this many characters.
+STREAM_BUFFER_SIZE = 8192
+
+
+class Database:
+    """One database file: its pool, writer thread and optional read replica."""
+
+    def __init__(self, name, path, pool, writer=None, replica=None):
+        self.name = name
+        self.path = path
+        self.pool = pool
+        self.writer = writer
+        self.replica = replica
+        self.replica_pool = None
+
+    def stats(self):
+        return {
+            "pool": self.pool.stats(),
+            "writer": self.writer.stats() if self.writer else None,
+            "replica": {**self.replica.stats(), "pool": self.replica_pool.stats()} if self.replica else None,
+        }
+
+
+def init_app(app):
+    """Apply pending migrations and attach the connection pools to the app.
+
+    Returns the main database's pool.
+    """
+    ensure_schema(app.config["DB_PATH"])
+    factory = app.config.get("DB_CONNECTION_FACTORY") or sqlite3.Connection
+    pragmas = app.config["DB_PRAGMAS"]
+    shard_map = ShardMap.load(app.config["SHARD_MAP"]) if app.config.get("SHARD_MAP") else ShardMap({}, {})
+    paths = {MAIN: app.config["DB_PATH"], **shard_map.paths}
+
+    databases = {}
+    for name, path in paths.items():
+        if not os.path.exists(path):
+            raise RuntimeError(f"shard {name!r} ({path}) does not exist; run shards.py split first")
+        # Shard readers see the main tables through ATTACH; writers only touch their own file.
+        pool = ConnectionPool(path, pragmas=pragmas, max_connections=app.config["DB_POOL_SIZE"],
+                              factory=factory if name == MAIN else attached_factory(factory, paths[MAIN]))
+        writer = None
+        if app.config.get("DB_SINGLE_WRITER") or app.config.get("WRITE_QUEUE"):
+            writer = DatabaseWriter(path, pragmas=pragmas, factory=factory)
+        replica = None
+        if app.config.get("DB_REPLICAS"):
+            replica = Replica(path, os.path.join(app.config["REPLICA_DIR"], f"{name}.db"),
+                              interval=app.config["REPLICA_INTERVAL"])
+        databases[name] = Database(name, path, pool, writer, replica)
+
+    if app.config.get("DB_REPLICAS"):
+        main_replica = databases[MAIN].replica.path
+        for name, database in databases.items():
+            database.replica_pool = ConnectionPool(
+                database.replica.path, pragmas={**pragmas, "query_only": 1},
+                max_connections=app.config["DB_POOL_SIZE"],
+                factory=factory if name == MAIN else attached_factory(factory, main_replica))
+
+    app.extensions["databases"] = databases
+    app.extensions["shard_map"] = shard_map
+    app.extensions["db_pool"] = databases[MAIN].pool
+    if databases[MAIN].writer is not None:
+        app.extensions["db_writer"] = databases[MAIN].writer
+    if len(databases) > 1:
+        app.extensions["db_fan_out"] = ThreadPoolExecutor(max_workers=len(databases),
+                                                          thread_name_prefix="db-fan-out")
+    app.teardown_appcontext(release_db_connection)
+    return databases[MAIN].pool
+
+
+# ------------ Routing ------------
+def shard_of(course_id):
+    """Name of the database holding a course (shards.MAIN unless the shard map says otherwise)."""
+    return MAIN if course_id is None else current_app.extensions["shard_map"].shard_of(course_id)
+
+
+def group_by_shard(course_ids):
+    """{database name: sorted course ids} for a list of course ids."""
+    groups = {}
+    for cid in sorted(set(map(int, course_ids))):
+        groups.setdefault(shard_of(cid), []).append(cid)
+    return groups
+
+
+def _pool(database, replica):
+    """The replica's pool when asked for and the replica has every write this process marked."""
+    if replica and database.replica_pool and database.replica.current:
+        return database.replica_pool
+    return database.pool
+
+
+def _connection(name, replica=False):
+    database = current_app.extensions["databases"][name]
+    pool = _pool(database, replica)
+    connections = g.setdefault("db_connections", {})
+    key = (name, pool is database.replica_pool)
+    if key not in connections:
+        connections[key] = pool.acquire()
+    return connections[key]
+
+
+def get_db_connection(course_id=None):
+    """Return this request's pooled connection (rows support dict-like access).
+
+    The connection is to the database holding `course_id`, or the main
+    database when no course is given. The same connection is returned for
+    the rest of the request and goes back to the pool when the app context
+    is torn down.
+    """
+    return _connection(shard_of(course_id))
+
+
+def get_read_connection(course_id=None):
+    """get_db_connection for read-only pages, served from a replica when DB_REPLICAS is on."""
+    return _connection(shard_of(course_id), replica=True)
+
+
+def replicas_behind(names=None):
+    """Send reads of these databases (all when None) to the primary until their replicas catch up.
+
+    Call after committing a write, before anything rebuilds a cache from the
+    changed data; page_cache.bump does this for the scopes it bumps.
+    """
+    databases = current_app.extensions["databases"]
+    for name in databases if names is None else names:
+        if databases[name].replica is not None:
+            databases[name].replica.mark_stale()
+
+
+def get_shard_connection(name):
+    """This request's connection to the database called `name` (shards.MAIN or a shard); KeyError if unknown."""
+    return _connection(name)
+
+
+def fan_out(fn, course_ids=None, replica=False):
+    """Run fn(conn, ids) against each database holding some of `course_ids`.
+
+    `ids` is that database's share of the course ids (None for every
+    database when `course_ids` is None). With more than one database the
+    calls run in parallel on their own pooled connections. Returns the
+    results in a list.
+    """
+    databases = current_app.extensions["databases"]
+    groups = dict.fromkeys(databases) if course_ids is None else group_by_shard(course_ids)
+    if len(groups) <= 1:
+        return [fn(_connection(name, replica), ids) for name, ids in groups.items()]
+
+    def run(database, ids):
+        pool = _pool(database, replica)
+        conn = pool.acquire()
+        try:
+            return fn(conn, ids)
+        finally:
+            pool.release(conn)
+    executor = current_app.extensions["db_fan_out"]
+    run = bind_sql_stats(run)
+    return [f.result() for f in [executor.submit(run, databases[name], ids) for name, ids in groups.items()]]
+
+
+def run_write(fn, *args, shard=MAIN, **kwargs):
+    """Run fn(cursor, *args, **kwargs) as one committed transaction and return its result.
+
+    The write goes to the database named `shard` (see shard_of). With
+    DB_SINGLE_WRITER the job is queued to that database's writer thread;
+    otherwise it runs on this request's connection.
+    """
+    writer = current_app.extensions["databases"][shard].writer
+    if writer is not None:
+        return writer.run(bind_sql_stats(fn), *args, **kwargs)
+    conn = _connection(shard)
+    try:
+        result = fn(conn.cursor(), *args, **kwargs)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return result
+
+
+def run_write_by_shard(fn, course_ids, *args, **kwargs):
+    """Run fn(cursor, ids, *args, **kwargs) once per database holding some of `course_ids`.
+
+    Each database commits its share separately (concurrently, when they
+    have writer threads), so a change spanning shards is not atomic.
+    Returns {database name: result}.
+    """
+    databases = current_app.extensions["databases"]
+    groups = group_by_shard(course_ids)
+    if all(databases[name].writer is not None for name in groups):
+        job = bind_sql_stats(fn)
+        futures = {name: databases[name].writer.submit(job, ids, *args, **kwargs) for name, ids in groups.items()}
+        return {name: future.result() for name, future in futures.items()}
+    return {name: run_write(fn, ids, *args, shard=name, **kwargs) for name, ids in groups.items()}
+
+
+def database_stats():
+    return {name: database.stats() for name, database in current_app.extensions["databases"].items()}
+
+
+def stream_with_connection(gen, buffer_size=STREAM_BUFFER_SIZE):
+    """stream_with_context that keeps the request's connection until the stream ends.
+
+    Flask runs teardown once when the view returns and again after a streamed
+    body is finished; rows are still being read from the connection between
+    the two, so it must not go back to the pool at the first one.
+
+    Small chunks (one per row) are joined into writes of about `buffer_size`
+    characters; every chunk is a socket write, and under the ASGI server a
+    hand-off between threads as well.
+    """
+    g.streaming_response = True
+
+    def generate():
+        try:
+            chunks, size = [], 0
+            for chunk in gen:
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= buffer_size:
+                    yield chunks[0][:0].join(chunks)
+                    chunks, size = [], 0
+            if chunks:
+                yield chunks[0][:0].join(chunks)
+        finally:
+            g.streaming_response = False
+    return stream_with_context(generate())
+
+
+def release_db_connection(exc):
+    if g.get("streaming_response"):
+        return
+    databases = current_app.extensions["databases"]
+    for (name, replica), conn in g.pop("db_connections", {}).items():
+        database = databases[name]
+        (database.replica_pool if replica else database.pool).release(conn)
+
+
+def ensure_schema(path=DB_PATH):
+    """Apply any pending db_setup migrations before serving requests."""
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
@@ -1,14 +1,26 @@
+import argparse
+import datetime
 import sqlite3
 import os
+import sys
+
+from attendance import check_summary, rebuild_summary
+from bitmaps import build_bitmaps, check_bitmaps, drop_bitmaps
+from passwords import DEFAULT_METHOD
+from werkzeug.security import generate_password_hash
 
 # Path to database file (project layout: backend/<this file>, database folder sibling)
-DB_PATH = os.path.join(os.path.dirname(__file__), "..", "database", "attendance.db")
+DB_PATH = os.environ.get("ATTENDANCE_DB_PATH",
+                         os.path.join(os.path.dirname(__file__), "..", "database", "attendance.db"))
 
-def main():
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
+# ------------ Migrations ------------
+# Each migration runs once, in order, inside its own transaction. The applied
+# version is recorded in schema_version so re-running db_setup (or starting
+# the app) only applies what is missing. Append new migrations to MIGRATIONS;
+# never edit one that has shipped.
 
+def migrate_base_tables(cur):
+    """Create the core tables."""
     # -------------------------
     # TEACHERS
     # -------------------------
@@ -89,8 +101,407 @@ def main():
     );
     """)
 
+def migrate_attendance_unique(cur):
+    """Enforce one attendance row per (student, course, date).
+
+    Older databases may hold duplicate marks for the same day; the most
+    recent row wins. The unique index is what the bulk upsert in app.py
+    targets with ON CONFLICT.
+    """
+    cur.execute("""
+    DELETE FROM attendance
+    WHERE id NOT IN (
+        SELECT MAX(id) FROM attendance GROUP BY student_id, course_id, date
+    );
+    """)
+    cur.execute("""
+    CREATE UNIQUE INDEX IF NOT EXISTS ux_attendance_student_course_date
+    ON attendance (student_id, course_id, date);
+    """)
+
+def migrate_query_indexes(cur):
+    """Covering indexes for each query shape in app.py, plus reverse lookups.
+
+    - attendance by (course_id, date): per-date counts in teacher_attendance,
+      the edit_attendance page and the bulk upsert's existing-marks read.
+    - attendance by (student_id, course_id, date): student_view_attendance
+      (dropped again in migration 4).
+    - student_courses / teacher_courses by course_id: course rosters and
+      assignment lookups (their UNIQUE constraints only serve the other side).
+    """
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_attendance_course_date
+    ON attendance (course_id, date, student_id, status);
+    """)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_attendance_student_course_date
+    ON attendance (student_id, course_id, date, status);
+    """)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_student_courses_course
+    ON student_courses (course_id, student_id);
+    """)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_teacher_courses_course
+    ON teacher_courses (course_id, teacher_id);
+    """)
+
+def migrate_drop_student_history_index(cur):
+    """Drop the (student_id, course_id, date, status) index.
+
+    Student history pages are keyset-paginated on (date, id). The unique
+    index from migration 2 keeps rowids in date order, so it serves that sort
+    directly; the covering index cannot and was only extra write cost.
+    """
+    cur.execute("DROP INDEX IF EXISTS idx_attendance_student_course_date;")
 
+def migrate_attendance_summary(cur):
+    """Per-student present/absent/excused counts, kept in sync by attendance.py."""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS attendance_summary (
+        student_id INTEGER NOT NULL,
+        course_id INTEGER NOT NULL,
+        present INTEGER NOT NULL DEFAULT 0,
+        absent INTEGER NOT NULL DEFAULT 0,
+        excused INTEGER NOT NULL DEFAULT 0,
+        last_date TEXT,
+        PRIMARY KEY (student_id, course_id)
+    ) WITHOUT ROWID;
+    """)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_attendance_summary_course
+    ON attendance_summary (course_id);
+    """)
+    rebuild_summary(cur)
 
+def migrate_roster_imports(cur):
+    """Progress of bulk roster imports, so an interrupted one can resume."""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS roster_imports (
+        job TEXT PRIMARY KEY,
+        source TEXT,
+        rows_committed INTEGER NOT NULL DEFAULT 0,
+        started_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    );
+    """)
+
+def migrate_sessions(cur):
+    """Server-side sessions for SESSION_STORE=sqlite."""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS sessions (
+        sid TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        expires REAL NOT NULL
+    ) WITHOUT ROWID;
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires)")
+
+def migrate_attendance_submissions(cur):
+    """Idempotency keys of queued attendance submissions (see write_queue.py)."""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS attendance_submissions (
+        key TEXT PRIMARY KEY,
+        committed_at TEXT NOT NULL,
+        result TEXT NOT NULL
+    ) WITHOUT ROWID;
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_attendance_submissions_committed ON attendance_submissions(committed_at)")
+
+def migrate_student_search(cur):
+    """FTS5 index over student names and emails (see search.py), kept current by triggers.
+
+    Skipped on SQLite builds without FTS5; search falls back to LIKE there.
+    """
+    try:
+        cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS students_fts USING fts5(
+            name, email, content='students', content_rowid='id', prefix='2 3'
+        );
+        """)
+    except sqlite3.OperationalError as e:
+        if "fts5" not in str(e):
+            raise
+        print("⚠️  This SQLite has no FTS5; student search will scan with LIKE.")
+        return
+    # Not executescript: it would commit the migration's transaction first.
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS students_fts_insert AFTER INSERT ON students BEGIN
+        INSERT INTO students_fts (rowid, name, email) VALUES (new.id, new.name, new.email);
+    END;
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS students_fts_delete AFTER DELETE ON students BEGIN
+        INSERT INTO students_fts (students_fts, rowid, name, email) VALUES ('delete', old.id, old.name, old.email);
+    END;
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS students_fts_update AFTER UPDATE OF name, email ON students BEGIN
+        INSERT INTO students_fts (students_fts, rowid, name, email) VALUES ('delete', old.id, old.name, old.email);
+        INSERT INTO students_fts (rowid, name, email) VALUES (new.id, new.name, new.email);
+    END;
+    """)
+    cur.execute("INSERT INTO students_fts (students_fts) VALUES ('rebuild')")
+
+def migrate_change_log(cur):
+    """Append-only log of attendance and enrollment changes (see change_log.py), written by triggers."""
+    # AUTOINCREMENT: a seq is never handed out again after compaction deletes it.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        changed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%SZ', 'now')),
+        entity TEXT NOT NULL,
+        op TEXT NOT NULL,
+        student_id INTEGER NOT NULL,
+        course_id INTEGER NOT NULL,
+        date TEXT,
+        status TEXT
+    );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_change_log_changed_at ON change_log(changed_at)")
+    # Highest seq removed by retention; consumers behind it must resync.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS change_log_horizon (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        purged_through INTEGER NOT NULL
+    );
+    """)
+    cur.execute("INSERT OR IGNORE INTO change_log_horizon (id, purged_through) VALUES (1, 0)")
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS change_log_attendance_insert AFTER INSERT ON attendance BEGIN
+        INSERT INTO change_log (entity, op, student_id, course_id, date, status)
+        VALUES ('attendance', 'upsert', new.student_id, new.course_id, new.date, new.status);
+    END;
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS change_log_attendance_rekey AFTER UPDATE ON attendance
+    WHEN new.student_id IS NOT old.student_id OR new.course_id IS NOT old.course_id OR new.date IS NOT old.date
+    BEGIN
+        INSERT INTO change_log (entity, op, student_id, course_id, date)
+        VALUES ('attendance', 'delete', old.student_id, old.course_id, old.date);
+    END;
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS change_log_attendance_update AFTER UPDATE ON attendance
+    WHEN new.status IS NOT old.status OR new.student_id IS NOT old.student_id
+        OR new.course_id IS NOT old.course_id OR new.date IS NOT old.date
+    BEGIN
+        INSERT INTO change_log (entity, op, student_id, course_id, date, status)
+        VALUES ('attendance', 'upsert', new.student_id, new.course_id, new.date, new.status);
+    END;
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS change_log_attendance_delete AFTER DELETE ON attendance BEGIN
+        INSERT INTO change_log (entity, op, student_id, course_id, date)
+        VALUES ('attendance', 'delete', old.student_id, old.course_id, old.date);
+    END;
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS change_log_enrollment_insert AFTER INSERT ON student_courses BEGIN
+        INSERT INTO change_log (entity, op, student_id, course_id)
+        VALUES ('enrollment', 'upsert', new.student_id, new.course_id);
+    END;
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS change_log_enrollment_delete AFTER DELETE ON student_courses BEGIN
+        INSERT INTO change_log (entity, op, student_id, course_id)
+        VALUES ('enrollment', 'delete', old.student_id, old.course_id);
+    END;
+    """)
+
+def migrate_attendance_archives(cur):
+    """Per-term archive files for closed terms (see archive.py)."""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS attendance_archives (
+        term TEXT PRIMARY KEY,
+        file TEXT NOT NULL,
+        start_date TEXT NOT NULL,
+        end_date TEXT NOT NULL,
+        rows INTEGER NOT NULL DEFAULT 0,
+        archived_at TEXT
+    ) WITHOUT ROWID;
+    """)
+    # Counts of the rows moved out, so attendance_summary can still be recomputed.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS attendance_term_summary (
+        student_id INTEGER NOT NULL,
+        course_id INTEGER NOT NULL,
+        term TEXT NOT NULL,
+        present INTEGER NOT NULL DEFAULT 0,
+        absent INTEGER NOT NULL DEFAULT 0,
+        excused INTEGER NOT NULL DEFAULT 0,
+        last_date TEXT,
+        PRIMARY KEY (student_id, course_id, term)
+    ) WITHOUT ROWID;
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_attendance_term_summary_course ON attendance_term_summary(course_id)")
+    # Archival (and shards.py split/merge) set paused=1 inside their own
+    # transactions (so nobody else ever sees it): moving a row out is not a
+    # deletion consumers should apply.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS change_log_pause (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        paused INTEGER NOT NULL DEFAULT 0
+    );
+    """)
+    cur.execute("INSERT OR IGNORE INTO change_log_pause (id, paused) VALUES (1, 0)")
+    cur.execute("DROP TRIGGER IF EXISTS change_log_attendance_delete")
+    cur.execute("""
+    CREATE TRIGGER change_log_attendance_delete AFTER DELETE ON attendance
+    WHEN COALESCE((SELECT paused FROM change_log_pause WHERE id = 1), 0) = 0
+    BEGIN
+        INSERT INTO change_log (entity, op, student_id, course_id, date)
+        VALUES ('attendance', 'delete', old.student_id, old.course_id, old.date);
+    END;
+    """)
+
+def migrate_change_log_moves(cur):
+    """Keep enrollment deletes out of the change log while change_log_pause is set.
+
+    shards.py split/merge move enrollments between files as archive.py moves
+    attendance out; the rows still exist, so the source's log must not
+    record them as deleted.
+    """
+    cur.execute("DROP TRIGGER IF EXISTS change_log_enrollment_delete")
+    cur.execute("""
+    CREATE TRIGGER change_log_enrollment_delete AFTER DELETE ON student_courses
+    WHEN COALESCE((SELECT paused FROM change_log_pause WHERE id = 1), 0) = 0
+    BEGIN
+        INSERT INTO change_log (entity, op, student_id, course_id)
+        VALUES ('enrollment', 'delete', old.student_id, old.course_id);
+    END;
+    """)
+
+def migrate_jobs(cur):
+    """Persistent schedule and run metrics for jobs.py, and the alerts it has sent."""
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        name TEXT PRIMARY KEY,
+        task TEXT NOT NULL,
+        schedule TEXT NOT NULL,
+        args TEXT NOT NULL DEFAULT '{}',
+        enabled INTEGER NOT NULL DEFAULT 1,
+        max_attempts INTEGER NOT NULL DEFAULT 3,
+        next_run_at TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        locked_by TEXT,
+        locked_until TEXT,
+        runs INTEGER NOT NULL DEFAULT 0,
+        failures INTEGER NOT NULL DEFAULT 0,
+        last_started_at TEXT,
+        last_finished_at TEXT,
+        last_status TEXT,
+        last_error TEXT,
+        last_result TEXT,
+        last_seconds REAL,
+        total_seconds REAL NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS attendance_alerts (
+        student_id INTEGER NOT NULL,
+        course_id INTEGER NOT NULL,
+        rate REAL NOT NULL,
+        sent_at TEXT NOT NULL,
+        PRIMARY KEY (student_id, course_id)
+    ) WITHOUT ROWID;
+    """)
+
+MIGRATIONS = [
+    (1, "base tables", migrate_base_tables),
+    (2, "unique attendance per student/course/date", migrate_attendance_unique),
+    (3, "query indexes", migrate_query_indexes),
+    (4, "drop student history covering index", migrate_drop_student_history_index),
+    (5, "attendance summary", migrate_attendance_summary),
+    (6, "roster import progress", migrate_roster_imports),
+    (7, "sessions", migrate_sessions),
+    (8, "attendance submission keys", migrate_attendance_submissions),
+    (9, "student search index", migrate_student_search),
+    (10, "change log", migrate_change_log),
+    (11, "attendance archives", migrate_attendance_archives),
+    (12, "scheduled jobs", migrate_jobs),
+    (13, "pausable enrollment deletes in the change log", migrate_change_log_moves),
+]
+
+def schema_version(conn):
+    """Return the highest applied migration version (0 for a fresh database)."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TEXT NOT NULL
+    );
+    """)
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+def migrate(conn):
+    """Apply pending migrations and return the versions that were applied."""
+    applied = []
+    for version, name, func in MIGRATIONS:
+        if version <= schema_version(conn):
+            continue
+        # IMMEDIATE takes the write lock up front, so two processes starting
+        # together cannot both apply the same migration.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= schema_version(conn):
+                conn.rollback()
+                continue
+            func(conn.cursor())
+            conn.execute("INSERT INTO schema_version (version, name, applied_at) VALUES (?,?,?)",
+                         (version, name, datetime.datetime.now().isoformat(timespec="seconds")))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+# ------------ Query plan checks ------------
+# One entry per query shape in app.py: (label, sql, index the plan must use).
+# A plan that falls back to a full SCAN or a temp B-tree for sorting fails.
+QUERY_PLAN_CHECKS = [
+    ("teacher_attendance dates",
+     "SELECT date, COUNT(*) as total FROM attendance WHERE course_id = 1 GROUP BY date ORDER BY date DESC",
+     "idx_attendance_course_date"),
+    ("edit_attendance records",
+     "SELECT a.id, a.student_id, s.name, a.status FROM attendance a JOIN students s ON a.student_id = s.id "
+     "WHERE a.course_id=1 AND a.date='2025-01-01'",
+     "idx_attendance_course_date"),
+    ("save_attendance existing marks",
+     "SELECT student_id, status FROM attendance WHERE course_id=1 AND date='2025-01-01'",
+     "idx_attendance_course_date"),
+    ("student_view_attendance history",
+     "SELECT id, date, status FROM attendance WHERE student_id=1 AND course_id=1 "
+     "AND date <= '2025-01-01' AND (date < '2025-01-01' OR id < 10) ORDER BY date DESC, id DESC LIMIT 51",
+     "ux_attendance_student_course_date"),
+    ("course roster",
+     "SELECT s.id, s.name, s.email FROM students s JOIN student_courses sc ON s.id = sc.student_id "
+     "WHERE sc.course_id = 1",
+     "idx_student_courses_course"),
+    ("course teachers",
+     "SELECT teacher_id FROM teacher_courses WHERE course_id = 1",
+     "idx_teacher_courses_course"),
+]
+
+def check_query_plans(conn):
+    """Run EXPLAIN QUERY PLAN for every known query shape.
+
+    Returns a list of (label, plan lines) for shapes that scan a table,
+    sort in a temp B-tree or miss their expected index; empty means all good.
+    """
+    failures = []
+    for label, sql, index in QUERY_PLAN_CHECKS:
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+        scans = [line for line in plan if line.startswith("SCAN") or "TEMP B-TREE" in line]
+        if scans or not any(index in line for line in plan):
+            failures.append((label, plan))
+    return failures
+
+# ------------ Seed ------------
+def seed(cur):
+    """Insert sample courses and accounts."""
     # -------------------------
     # Seed: sample courses and accounts
     # (INSERT OR IGNORE used so re-running won't duplicate)
@@ -102,16 +513,17 @@ def main():
 
 
     # Sample teacher (will not duplicate because of OR IGNORE on unique email)
+    # Passwords are stored hashed; the plaintext ones are listed in the README.
     cur.execute("""
     INSERT OR IGNORE INTO teachers (id, name, email, password)
-    VALUES (1, 'Test Teacher', 'teacher@example.com', 'password123')
-    """)
+    VALUES (1, 'Test Teacher', 'teacher@example.com', ?)
+    """, (generate_password_hash('password123', DEFAULT_METHOD),))
 
     # Sample student
     cur.execute("""
     INSERT OR IGNORE INTO students (id, name, email, password)
-    VALUES (1, 'Student One', 'student1@example.com', 'studpass1')
-    """)
+    VALUES (1, 'Student One', 'student1@example.com', ?)
+    """, (generate_password_hash('studpass1', DEFAULT_METHOD),))
 
     # Map teacher to course(s)
     cur.execute("INSERT OR IGNORE INTO teacher_courses (id, teacher_id, course_id) VALUES (1, 1, 1)")
@@ -120,9 +532,84 @@ def main():
     # Map sample student to a course
     cur.execute("INSERT OR IGNORE INTO student_courses (id, student_id, course_id) VALUES (1, 1, 1)")
 
+def report_query_plans(conn):
+    """Print query plan regressions; return 1 if there are any."""
+    failures = check_query_plans(conn)
+    for label, plan in failures:
+        print(f"❌ {label}: " + " | ".join(plan))
+    if not failures:
+        print("✅ All query plans use their indexes.")
+    return 1 if failures else 0
+
+def report_summary(conn):
+    """Print attendance_summary rows that differ from a recompute; return 1 if any."""
+    mismatches = check_summary(conn.cursor())
+    for student_id, course_id, stored, expected in mismatches:
+        print(f"❌ student {student_id}, course {course_id}: stored {stored}, expected {expected}")
+    if not mismatches:
+        print("✅ attendance_summary matches the attendance table.")
+    return 1 if mismatches else 0
+
+def report_bitmaps(conn):
+    """Print days where attendance_bitmaps and the attendance rows disagree; return 1 if any."""
+    mismatches = check_bitmaps(conn.cursor())
+    for student_id, course_id, date, row, bitmap in mismatches[:50]:
+        print(f"❌ student {student_id}, course {course_id}, {date}: row {row}, bitmap {bitmap}")
+    if len(mismatches) > 50:
+        print(f"❌ ... {len(mismatches) - 50} more")
+    if not mismatches:
+        print("✅ attendance_bitmaps match the attendance table.")
+    return 1 if mismatches else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create or upgrade the attendance database.")
+    parser.add_argument("--check-plans", action="store_true",
+                        help="verify every app query uses its index; exit 1 on a scan regression")
+    parser.add_argument("--rebuild-summary", action="store_true",
+                        help="recompute attendance_summary from the attendance table")
+    parser.add_argument("--check-summary", action="store_true",
+                        help="compare attendance_summary with a full recompute; exit 1 on drift")
+    parser.add_argument("--build-bitmaps", action="store_true",
+                        help="(re)build the compact attendance_bitmaps copy; app writes keep it current from then on")
+    parser.add_argument("--check-bitmaps", action="store_true",
+                        help="compare attendance_bitmaps with the attendance table; exit 1 on drift")
+    parser.add_argument("--drop-bitmaps", action="store_true", help="remove attendance_bitmaps")
+    args = parser.parse_args(argv)
+
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(DB_PATH)
+
+    applied = migrate(conn)
+    seed(conn.cursor())
     conn.commit()
+    print(f"✅ Database ready at schema version {MIGRATIONS[-1][0]} (applied: {applied or 'none'}). Sample data inserted.")
+
+    status = 0
+    if args.check_plans:
+        status |= report_query_plans(conn)
+    if args.rebuild_summary:
+        rebuild_summary(conn.cursor())
+        conn.commit()
+        print("✅ attendance_summary rebuilt.")
+    if args.check_summary:
+        status |= report_summary(conn)
+    if args.drop_bitmaps:
+        drop_bitmaps(conn.cursor())
+        conn.commit()
+        print("✅ attendance_bitmaps dropped.")
+    if args.build_bitmaps:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")  # no app writes can slip in between the read and the swap
+        blobs, encoded, skipped = build_bitmaps(cur)
+        conn.commit()
+        print(f"✅ attendance_bitmaps built: {encoded} records in {blobs} bitmaps"
+              + (f", {skipped} records with an unknown status or date left out." if skipped else "."))
+    if args.check_bitmaps:
+        status |= report_bitmaps(conn)
+
     conn.close()
-    print("✅ Database & tables created (attendance.db). Sample data inserted.")
+    if status:
+        sys.exit(status)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,142 @@
+"""A single thread that performs all attendance writes for this process.
+
+SQLite allows one writer at a time. When request threads write through
+their own connections they queue on the database lock and, past
+busy_timeout, fail with "database is locked". Routing writes through one
+thread turns that contention into an in-process queue, so writers wait in
+order and never see lock errors from each other.
+
+Jobs are functions taking a cursor. Jobs that are already queued when the
+thread wakes are committed together in one transaction, each inside its own
+savepoint, so a failing job is rolled back alone while the others still
+share a single commit. Each caller gets its job's return value, or its
+exception, only after that commit.
+"""
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from db_pool import DEFAULT_PRAGMAS
+
+
+class WriterClosed(RuntimeError):
+    pass
+
+
+class DatabaseWriter:
+    def __init__(self, path, pragmas=None, max_pending=1000, max_batch=64, factory=sqlite3.Connection):
+        self.path = path
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self.max_batch = max_batch
+        self.factory = factory
+        self._queue = queue.Queue(max_pending)
+        self._closed = False
+        self._lock = threading.Lock()
+        self._jobs = 0
+        self._failed = 0
+        self._commits = 0
+        self._queue_seconds = 0.0
+        self._busy_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(cursor, *args, **kwargs) and return a Future for its result."""
+        if self._closed:
+            raise WriterClosed("database writer is closed")
+        future = Future()
+        self._queue.put((future, time.perf_counter(), fn, args, kwargs))
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        """Run a write job and wait for it to be committed."""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def close(self, timeout=None):
+        """Finish queued jobs and stop the thread."""
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": self._queue.qsize(),
+                "jobs": self._jobs,
+                "failed": self._failed,
+                "commits": self._commits,
+                "jobs_per_commit": round(self._jobs / self._commits, 2) if self._commits else 0.0,
+                "queue_seconds": round(self._queue_seconds, 6),
+                "busy_seconds": round(self._busy_seconds, 6),
+            }
+
+    def _connect(self):
+        # isolation_level=None: transactions are managed explicitly below.
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False,
+                               isolation_level=None, factory=self.factory)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        return conn
+
+    def _run(self):
+        conn = self._connect()
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._commit_batch(conn, batch)
+        conn.close()
+
+    def _commit_batch(self, conn, batch):
+        started = time.perf_counter()
+        outcomes = []
+        cur = conn.cursor()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            for future, queued, fn, args, kwargs in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                cur.execute("SAVEPOINT job")
+                try:
+                    result = fn(cur, *args, **kwargs)
+                    cur.execute("RELEASE job")
+                    outcomes.append((future, queued, True, result))
+                except Exception as e:
+                    cur.execute("ROLLBACK TO job")
+                    cur.execute("RELEASE job")
+                    outcomes.append((future, queued, False, e))
+            cur.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            # Nothing was committed, so every job in the batch fails.
+            outcomes = [(future, queued, False, e) for future, queued, *_ in batch
+                        if future.running() or future.set_running_or_notify_cancel()]
+
+        finished = time.perf_counter()
+        with self._lock:
+            self._commits += 1
+            self._busy_seconds += finished - started
+            for future, queued, ok, value in outcomes:
+                self._jobs += 1
+                self._failed += not ok
+                self._queue_seconds += started - queued
+        for future, _, ok, value in outcomes:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
@@ -0,0 +1,121 @@
+"""Enrollment changes as set-based diffs.
+
+Every change to student_courses goes through here so attendance_summary
+follows it: pairs that gain an enrollment get their summary recomputed
+(a re-enrolled student may already have marks), pairs that lose one have
+it dropped. Attendance rows are never deleted; they come back into the
+summary if the student rejoins.
+
+Each helper computes the diff once and applies it with executemany, and
+leaves the commit to the caller so a whole change is one transaction.
+"""
+from attendance import refresh_summary_pairs
+
+
+# ------------ Pairs ------------
+def enroll_pairs(cur, pairs):
+    """Add (student_id, course_id) enrollments; returns the pairs that were new."""
+    pairs = sorted(set(pairs))
+    if not pairs:
+        return []
+    existing = _existing_pairs(cur, pairs)
+    added = [p for p in pairs if p not in existing]
+    cur.executemany("INSERT OR IGNORE INTO student_courses (student_id, course_id) VALUES (?,?)", added)
+    refresh_summary_pairs(cur, added)
+    return added
+
+
+def unenroll_pairs(cur, pairs):
+    """Remove (student_id, course_id) enrollments and their summary rows."""
+    pairs = sorted(set(pairs))
+    cur.executemany("DELETE FROM student_courses WHERE student_id=? AND course_id=?", pairs)
+    cur.executemany("DELETE FROM attendance_summary WHERE student_id=? AND course_id=?", pairs)
+    return pairs
+
+
+def _existing_pairs(cur, pairs):
+    students = sorted({sid for sid, _ in pairs})
+    courses = sorted({cid for _, cid in pairs})
+    found = set()
+    for i in range(0, len(students), 500):  # stay under SQLite's bound-parameter limit
+        chunk = students[i:i + 500]
+        cur.execute(f"""
+            SELECT student_id, course_id FROM student_courses
+            WHERE student_id IN ({",".join("?" * len(chunk))}) AND course_id IN ({",".join("?" * len(courses))})
+        """, (*chunk, *courses))
+        found.update((r[0], r[1]) for r in cur.fetchall())
+    return found
+
+
+# ------------ One student or teacher ------------
+def sync_student_courses(cur, student_id, selected, scope=None):
+    """Make a student's enrollments equal `selected`.
+
+    Only courses in `scope` are touched when it is given (e.g. the courses
+    of the teacher making the change). Returns (added, removed, before) as
+    sets of course ids.
+    """
+    cur.execute("SELECT course_id FROM student_courses WHERE student_id=?", (student_id,))
+    before = {r[0] for r in cur.fetchall()}
+    selected = set(selected)
+    if scope is not None:
+        selected &= set(scope)
+        before_in_scope = before & set(scope)
+    else:
+        before_in_scope = before
+    added, removed = selected - before, before_in_scope - selected
+    enroll_pairs(cur, [(student_id, cid) for cid in added])
+    unenroll_pairs(cur, [(student_id, cid) for cid in removed])
+    return added, removed, before
+
+
+def sync_teacher_courses(cur, teacher_id, selected):
+    """Make a teacher's course assignments equal `selected`; returns (added, removed)."""
+    cur.execute("SELECT course_id FROM teacher_courses WHERE teacher_id=?", (teacher_id,))
+    before = {r[0] for r in cur.fetchall()}
+    added, removed = set(selected) - before, before - set(selected)
+    cur.executemany("INSERT OR IGNORE INTO teacher_courses (teacher_id, course_id) VALUES (?,?)",
+                    [(teacher_id, cid) for cid in sorted(added)])
+    cur.executemany("DELETE FROM teacher_courses WHERE teacher_id=? AND course_id=?",
+                    [(teacher_id, cid) for cid in sorted(removed)])
+    return added, removed
+
+
+# ------------ Bulk ------------
+def course_students(cur, course_id):
+    cur.execute("SELECT student_id FROM student_courses WHERE course_id=?", (course_id,))
+    return {r[0] for r in cur.fetchall()}
+
+
+def move_students(cur, from_course, to_course, student_ids=None):
+    """Move students (the whole roster when `student_ids` is None) between courses.
+
+    Students not enrolled in `from_course` are ignored; ones already in
+    `to_course` just leave `from_course`. Returns the sorted ids moved.
+    """
+    roster = course_students(cur, from_course)
+    moving = sorted(roster if student_ids is None else roster & set(student_ids))
+    enroll_pairs(cur, [(sid, to_course) for sid in moving])
+    unenroll_pairs(cur, [(sid, from_course) for sid in moving])
+    return moving
+
+
+def enroll_cohort(cur, course_ids, student_ids):
+    """Enroll every student in every course; returns the (student_id, course_id) pairs added.
+
+    Takes the course ids first so it can run once per shard
+    (db.run_write_by_shard). Check the ids with existing_ids() beforehand;
+    a shard connection cannot see the students and courses tables.
+    """
+    return enroll_pairs(cur, [(sid, cid) for sid in student_ids for cid in course_ids])
+
+
+def existing_ids(cur, table, ids):
+    """The sorted subset of `ids` that are rows of `table` (students or courses)."""
+    ids = sorted(set(ids))
+    found = set()
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        cur.execute(f"SELECT id FROM {table} WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+        found.update(r[0] for r in cur.fetchall())
+    return sorted(found)
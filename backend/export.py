@@ -0,0 +1,109 @@
+"""Student-by-date attendance matrix export as streamed CSV or XLSX.
+
+Only the list of dates in the range is held in memory. Students are read one
+at a time from a single cursor and each row is written out before the next
+is fetched, so memory use does not grow with the roster size.
+
+Ranges that reach into archived terms (see archive.py) read the archive
+files too when given the archive directory: each file is queried the same
+way and the per-student streams are merged.
+"""
+import csv
+import heapq
+import io
+from itertools import groupby
+
+from archive import archived_terms, attached
+
+try:
+    import xlsxwriter
+except ImportError:  # optional dependency, only needed for .xlsx
+    xlsxwriter = None
+
+# Rows are buffered into chunks of roughly this many bytes before being yielded.
+CSV_CHUNK_BYTES = 64 * 1024
+
+
+def course_dates(cur, course_id, start, end, schema="main"):
+    """Dates in [start, end] on which the course has any attendance, oldest first."""
+    cur.execute(f"""
+        SELECT DISTINCT date FROM {schema}.attendance
+        WHERE course_id=? AND date BETWEEN ? AND ?
+        ORDER BY date
+    """, (course_id, start, end))
+    return [r[0] for r in cur.fetchall()]
+
+
+def _student_rows(conn, schema, course_id, start, end):
+    # The roster index returns students in id order, so groupby sees each
+    # student's rows together. Dates within a student need no ordering.
+    # INDEXED BY keeps the per-student lookup on (student_id, course_id, date);
+    # without table statistics the planner may otherwise scan the course's
+    # whole date range once per student.
+    return conn.execute(f"""
+        SELECT s.id, s.name, s.email, a.date, a.status
+        FROM student_courses sc
+        JOIN students s ON s.id = sc.student_id
+        LEFT JOIN {schema}.attendance a INDEXED BY ux_attendance_student_course_date
+               ON a.student_id = sc.student_id AND a.course_id = sc.course_id
+              AND a.date BETWEEN ? AND ?
+        WHERE sc.course_id = ?
+        ORDER BY sc.student_id
+    """, (start, end, course_id))
+
+
+def iter_matrix(conn, course_id, start, end, archive_dir=None):
+    """Yield the header row, then one row per enrolled student.
+
+    Each row is [student_id, name, email, status-on-date-1, ...]; days with
+    no record are blank. With `archive_dir`, archived terms in the range are
+    included.
+    """
+    terms = archived_terms(conn.cursor(), start, end) if archive_dir else []
+    with attached(conn, archive_dir, terms) as archives:
+        schemas = ["main", *archives]
+        cur = conn.cursor()
+        dates = sorted({d for schema in schemas for d in course_dates(cur, course_id, start, end, schema)})
+        yield ["student_id", "name", "email", *dates]
+
+        # One stream per file, each in student order; a student's rows from
+        # every file then sit next to each other in the merge.
+        cursors = [_student_rows(conn, schema, course_id, start, end) for schema in schemas]
+        try:
+            rows = cursors[0] if len(cursors) == 1 else heapq.merge(*cursors, key=lambda r: r[0])
+            for (sid, name, email), group in groupby(rows, key=lambda r: (r[0], r[1], r[2])):
+                statuses = {r[3]: r[4] for r in group if r[3] is not None}
+                yield [sid, name, email, *(statuses.get(d, "") for d in dates)]
+        finally:
+            # An open cursor would keep its file from being detached.
+            for c in cursors:
+                c.close()
+
+
+def iter_csv(rows):
+    """Encode rows as CSV text, yielding chunks of about CSV_CHUNK_BYTES."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() >= CSV_CHUNK_BYTES:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def write_xlsx(rows, path):
+    """Write rows to an .xlsx file using xlsxwriter's constant-memory mode.
+
+    constant_memory flushes each row to disk once the next one starts, so
+    rows must arrive in order, which iter_matrix guarantees.
+    """
+    if xlsxwriter is None:
+        raise RuntimeError("XLSX export needs the xlsxwriter package (pip install xlsxwriter)")
+    workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+    sheet = workbook.add_worksheet("Attendance")
+    for r, row in enumerate(rows):
+        sheet.write_row(r, 0, row)
+    workbook.close()
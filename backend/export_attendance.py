@@ -0,0 +1,52 @@
+"""Export a course's attendance as a student-by-date matrix.
+
+Usage:
+    python backend/export_attendance.py --course 1 --start 2025-01-01 --end 2025-06-30 -o out.csv
+    python backend/export_attendance.py --course 1 --format xlsx -o out.xlsx
+
+Without -o, CSV is written to stdout. Archived terms in the range are read
+from --archive-dir (default: archive/ next to the database).
+"""
+import argparse
+import os
+import sqlite3
+import sys
+
+from db import DB_PATH
+from export import iter_csv, iter_matrix, write_xlsx
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a course's attendance matrix.")
+    parser.add_argument("--course", type=int, required=True, help="course id")
+    parser.add_argument("--start", default="0001-01-01", help="first date (YYYY-MM-DD)")
+    parser.add_argument("--end", default="9999-12-31", help="last date (YYYY-MM-DD)")
+    parser.add_argument("--format", choices=["csv", "xlsx"], default="csv")
+    parser.add_argument("-o", "--output", help="output file (required for xlsx)")
+    parser.add_argument("--db", default=DB_PATH, help="database file")
+    parser.add_argument("--archive-dir", default=os.environ.get("ATTENDANCE_ARCHIVE_DIR"),
+                        help="archive files directory (see archive.py)")
+    args = parser.parse_args(argv)
+    args.archive_dir = args.archive_dir or os.path.join(os.path.dirname(os.path.abspath(args.db)), "archive")
+
+    if args.format == "xlsx" and not args.output:
+        parser.error("--format xlsx needs -o/--output")
+
+    conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+    try:
+        rows = iter_matrix(conn, args.course, args.start, args.end, args.archive_dir)
+        if args.format == "xlsx":
+            write_xlsx(rows, args.output)
+        elif args.output:
+            with open(args.output, "w", newline="", encoding="utf-8") as f:
+                for chunk in iter_csv(rows):
+                    f.write(chunk)
+        else:
+            for chunk in iter_csv(rows):
+                sys.stdout.write(chunk)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
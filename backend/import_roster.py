@@ -0,0 +1,102 @@
+"""Bulk-import students and enrollments from a CSV or JSON roster.
+
+Usage:
+    python backend/import_roster.py intake.csv
+    python backend/import_roster.py intake.jsonl --job fall-intake --batch-size 2000
+    python backend/import_roster.py intake.csv --errors rejected.csv
+
+With a shard map (--shard-map or ATTENDANCE_SHARD_MAP), enrollments in
+courses that live in a shard are written to that shard's file.
+
+Re-running an interrupted import with the same --job (default: the file
+name and a digest of its contents) resumes after the last committed batch;
+pass --restart to import from the first row again. A finished job starts
+from the first row.
+"""
+import argparse
+import csv
+import os
+import sqlite3
+
+from db import DB_PATH
+from enrollment import enroll_pairs
+from passwords import DEFAULT_METHOD, PasswordHasher
+from roster_import import DEFAULT_BATCH_SIZE, detect_format, file_digest, import_roster, iter_records
+from shards import MAIN, ShardMap
+
+
+def shard_enroller(shard_map, connections):
+    """import_roster's elsewhere and enroll_elsewhere for a shard map, enrolling pairs in their shard files.
+
+    `connections` caches one connection per shard; the caller closes them.
+    """
+    def elsewhere(course_id):
+        return shard_map.shard_of(course_id) != MAIN
+
+    def enroll(pairs):
+        by_shard, added = {}, 0
+        for sid, cid in pairs:
+            by_shard.setdefault(shard_map.shard_of(cid), set()).add((sid, cid))
+        for name, group in by_shard.items():
+            if name not in connections:
+                connections[name] = sqlite3.connect(shard_map.paths[name], timeout=30)
+            conn = connections[name]
+            added += len(enroll_pairs(conn.cursor(), group))
+            conn.commit()
+        return added
+    return elsewhere, enroll
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-import students and course enrollments.")
+    parser.add_argument("path", help="CSV, JSON Lines (.jsonl) or JSON array (.json) file")
+    parser.add_argument("--format", choices=["csv", "jsonl", "json"], help="override detection by extension")
+    parser.add_argument("--job", help="name used to track progress (default: file name and digest)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--restart", action="store_true", help="ignore saved progress")
+    parser.add_argument("--errors", help="write rejected rows (row, error) to this CSV file")
+    parser.add_argument("--password-method", default=os.environ.get("ATTENDANCE_PASSWORD_METHOD", DEFAULT_METHOD),
+                        help="werkzeug hash method for new students' passwords")
+    parser.add_argument("--db", default=DB_PATH, help="database file")
+    parser.add_argument("--shard-map", default=os.environ.get("ATTENDANCE_SHARD_MAP"),
+                        help="shard map (JSON); enrollments in sharded courses go to their shard's file")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or detect_format(args.path)
+    job = args.job
+    if not job:
+        with open(args.path, "rb") as f:
+            job = f"{os.path.basename(args.path)}:{file_digest(f)}"
+    hasher = PasswordHasher(args.password_method, max_workers=os.cpu_count(), cache_ttl=0)
+    conn = sqlite3.connect(args.db, timeout=30)
+    shard_connections = {}
+    elsewhere, enroll_elsewhere = (shard_enroller(ShardMap.load(args.shard_map), shard_connections)
+                                   if args.shard_map else (None, None))
+    try:
+        with open(args.path, encoding="utf-8-sig", newline="") as f:
+            report = import_roster(conn, iter_records(f, fmt), job, source=os.path.abspath(args.path),
+                                   batch_size=args.batch_size, resume=not args.restart,
+                                   hash_passwords=hasher.hash_many, elsewhere=elsewhere,
+                                   enroll_elsewhere=enroll_elsewhere)
+    finally:
+        conn.close()
+        for shard in shard_connections.values():
+            shard.close()
+        hasher.shutdown()
+
+    for key, value in report.as_dict().items():
+        print(f"{key:>20}: {value}")
+    if args.errors and report.errors:
+        with open(args.errors, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["row", "error"])
+            writer.writerows(report.errors)
+    elif report.errors:
+        for row, message in report.errors[:20]:
+            print(f"  row {row}: {message}")
+        if len(report.errors) > 20:
+            print(f"  ... {len(report.errors) - 20} more (use --errors FILE to save them all)")
+
+
+if __name__ == "__main__":
+    main()
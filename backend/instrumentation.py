@@ -0,0 +1,352 @@
+"""Opt-in request, SQL and template instrumentation (ATTENDANCE_INSTRUMENT=1).
+
+When enabled:
+
+* Pooled connections are InstrumentedConnection objects. Every statement is
+  recorded under its normalised text (literals -> ?, IN lists collapsed),
+  with the time spent executing and fetching and the number of rows.
+* Template rendering is timed through Flask's template signals.
+* Everything is aggregated per endpoint and served at /metrics in the
+  Prometheus text format.
+* A sample of requests (PROFILE_SAMPLE_RATE) runs under cProfile; the
+  PROFILE_KEEP slowest are kept and listed at /metrics/profiles.
+
+Streamed responses are measured until the stream finishes, since their
+queries and rendering happen while the body is being sent. Statements run
+for a request on another thread (the writer thread, fan_out) count towards
+it when they go through bind_sql_stats.
+
+Both endpoints need METRICS_TOKEN as a Bearer token and are off without it.
+"""
+import cProfile
+import functools
+import heapq
+import hmac
+import io
+import pstats
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from flask import Response, abort, before_render_template, current_app, g, jsonify, request, template_rendered
+
+# Upper bounds (seconds) of the request duration histogram buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Distinct statements kept per endpoint; the rest are counted under "other".
+MAX_STATEMENTS = 200
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"IN\s*\((?:\s*\?\s*,)*\s*\?\s*\)", re.IGNORECASE)
+_SPACE = re.compile(r"\s+")
+
+_local = threading.local()
+_merge_lock = threading.Lock()
+
+
+def normalize_sql(sql):
+    """Collapse whitespace, replace literals with ? and IN (?, ?, ...) with IN (...)."""
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _SPACE.sub(" ", sql).strip()
+    return _IN_LIST.sub("IN (...)", sql)
+
+
+# ------------ SQL ------------
+class InstrumentedCursor(sqlite3.Cursor):
+    """Records execute time, then adds fetch time and rows to the same statement."""
+
+    _stat = None
+
+    def _record(self, sql, start, rows=0):
+        self._stat = _current_statement(sql)
+        if self._stat is not None:
+            self._stat[0] += 1
+            self._stat[1] += time.perf_counter() - start
+            self._stat[2] += rows
+
+    def _fetched(self, start, rows):
+        if self._stat is not None:
+            self._stat[1] += time.perf_counter() - start
+            self._stat[2] += rows
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        super().execute(sql, parameters)
+        self._record(sql, start, max(self.rowcount, 0))
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._record(sql, start, max(self.rowcount, 0))
+        return self
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        row = super().__next__()
+        self._fetched(start, 1)
+        return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    # sqlite3.Connection.execute does not go through cursor(), so both are overridden.
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def _current_statement(sql):
+    """The [calls, seconds, rows] slot for `sql` in the current request, if any."""
+    stats = getattr(_local, "sql", None)
+    if stats is None:
+        return None
+    return stats[_statement_key(stats, normalize_sql(sql))]
+
+
+def _statement_key(stats, key):
+    return "other" if key not in stats and len(stats) >= MAX_STATEMENTS else key
+
+
+def bind_sql_stats(fn):
+    """Wrap fn so its statements count towards the calling request on whichever thread it runs.
+
+    The statements are collected on that thread and added to the request's
+    totals when fn returns, so several threads can work for one request.
+    Without instrumentation, or outside a request, fn is returned as is.
+    """
+    stats = getattr(_local, "sql", None)
+    if stats is None:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapped(*args, **kwargs):
+        previous, _local.sql = getattr(_local, "sql", None), defaultdict(lambda: [0, 0.0, 0])
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            collected, _local.sql = _local.sql, previous
+            with _merge_lock:
+                for statement, (calls, seconds, rows) in collected.items():
+                    total = stats[_statement_key(stats, statement)]
+                    total[0] += calls
+                    total[1] += seconds
+                    total[2] += rows
+    return wrapped
+
+
+# ------------ Aggregation ------------
+class Metrics:
+    """Per-endpoint totals; all updates happen under one lock at request end."""
+
+    def __init__(self, profile_keep=20):
+        self.lock = threading.Lock()
+        self.requests = defaultdict(lambda: [0, 0.0, [0] * (len(BUCKETS) + 1)])  # count, sum, buckets
+        self.statuses = defaultdict(int)
+        self.sql = defaultdict(lambda: [0, 0.0, 0])                               # calls, seconds, rows
+        self.templates = defaultdict(lambda: [0, 0.0])                             # renders, seconds
+        self.profile_keep = profile_keep
+        self.profiles = []                                                         # min-heap by duration
+
+    def record(self, endpoint, method, status, duration, sql, templates):
+        with self.lock:
+            entry = self.requests[(endpoint, method)]
+            entry[0] += 1
+            entry[1] += duration
+            entry[2][next((i for i, b in enumerate(BUCKETS) if duration <= b), len(BUCKETS))] += 1
+            self.statuses[(endpoint, method, status)] += 1
+            for statement, (calls, seconds, rows) in sql.items():
+                total = self.sql[(endpoint, statement)]
+                total[0] += calls
+                total[1] += seconds
+                total[2] += rows
+            for name, seconds in templates:
+                total = self.templates[(endpoint, name)]
+                total[0] += 1
+                total[1] += seconds
+
+    def keep_profile(self, duration, endpoint, path, profile):
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(30)
+        item = (duration, time.time(), endpoint, path, out.getvalue())
+        with self.lock:
+            if len(self.profiles) < self.profile_keep:
+                heapq.heappush(self.profiles, item)
+            elif duration > self.profiles[0][0]:
+                heapq.heapreplace(self.profiles, item)
+
+    def prometheus(self, extra_gauges=()):
+        lines = []
+
+        def metric(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self.lock:
+            metric("attendance_request_duration_seconds", "histogram", "Request duration by endpoint.")
+            for (endpoint, method), (count, total, buckets) in sorted(self.requests.items()):
+                labels = f'endpoint="{_esc(endpoint)}",method="{method}"'
+                cumulative = 0
+                for bound, n in zip(BUCKETS, buckets):
+                    cumulative += n
+                    lines.append(f'attendance_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'attendance_request_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+                lines.append(f"attendance_request_duration_seconds_sum{{{labels}}} {total:.6f}")
+                lines.append(f"attendance_request_duration_seconds_count{{{labels}}} {count}")
+
+            metric("attendance_responses_total", "counter", "Responses by endpoint and status.")
+            for (endpoint, method, status), n in sorted(self.statuses.items()):
+                lines.append(f'attendance_responses_total{{endpoint="{_esc(endpoint)}",method="{method}",'
+                             f'status="{status}"}} {n}')
+
+            for name, index, help_text in (("calls", 0, "Statements executed."),
+                                           ("seconds", 1, "Time executing and fetching."),
+                                           ("rows", 2, "Rows fetched or changed.")):
+                metric(f"attendance_sql_{name}_total", "counter", f"{help_text} By endpoint and statement.")
+                for (endpoint, statement), values in sorted(self.sql.items()):
+                    value = f"{values[index]:.6f}" if index == 1 else values[index]
+                    lines.append(f'attendance_sql_{name}_total{{endpoint="{_esc(endpoint)}",'
+                                 f'statement="{_esc(statement)}"}} {value}')
+
+            metric("attendance_template_renders_total", "counter", "Template renders by endpoint.")
+            for (endpoint, name), (count, _) in sorted(self.templates.items()):
+                lines.append(f'attendance_template_renders_total{{endpoint="{_esc(endpoint)}",'
+                             f'template="{_esc(name)}"}} {count}')
+            metric("attendance_template_render_seconds_total", "counter", "Time rendering templates.")
+            for (endpoint, name), (_, seconds) in sorted(self.templates.items()):
+                lines.append(f'attendance_template_render_seconds_total{{endpoint="{_esc(endpoint)}",'
+                             f'template="{_esc(name)}"}} {seconds:.6f}')
+
+        for name, help_text, value in extra_gauges:
+            metric(name, "gauge", help_text)
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _esc(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+# ------------ Flask hooks ------------
+def _before_request():
+    _local.sql = defaultdict(lambda: [0, 0.0, 0])
+    _local.templates = []
+    _local.template_started = []
+    g.instrument_start = time.perf_counter()
+    g.instrument_status = None
+    if random.random() < current_app.config["PROFILE_SAMPLE_RATE"]:
+        g.profile = cProfile.Profile()
+        g.profile.enable()
+
+
+def _after_request(response):
+    g.instrument_status = response.status_code
+    return response
+
+
+def _teardown_request(exc):
+    if g.get("streaming_response"):
+        return  # runs again when the stream ends (see db.stream_with_connection)
+    start = g.pop("instrument_start", None)
+    if start is None:
+        return
+    duration = time.perf_counter() - start
+    profile = g.pop("profile", None)
+    if profile is not None:
+        profile.disable()
+    metrics = current_app.extensions["metrics"]
+    endpoint = request.endpoint or "unmatched"
+    with _merge_lock:
+        metrics.record(endpoint, request.method, g.pop("instrument_status", None) or 500, duration,
+                       getattr(_local, "sql", {}), getattr(_local, "templates", []))
+    if profile is not None:
+        # The path only: query strings can hold search terms.
+        metrics.keep_profile(duration, endpoint, request.path, profile)
+    _local.sql = None
+
+
+def _template_started(sender, template, context, **extra):
+    if getattr(_local, "template_started", None) is not None:
+        _local.template_started.append(time.perf_counter())
+
+
+def _template_done(sender, template, context, **extra):
+    if getattr(_local, "template_started", None):
+        _local.templates.append((template.name, time.perf_counter() - _local.template_started.pop()))
+
+
+def _require_token():
+    token = current_app.config.get("METRICS_TOKEN")
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        abort(401)
+
+
+def metrics_view():
+    """Prometheus text exposition of the collected metrics."""
+    _require_token()
+    pool = current_app.extensions["db_pool"].stats()
+    gauges = [("attendance_db_pool_open", "Open pooled connections.", pool["open"]),
+              ("attendance_db_pool_in_use", "Checked-out pooled connections.", pool["in_use"]),
+              ("attendance_db_pool_waits_total", "Acquires that had to wait.", pool["waits"])]
+    queue = current_app.extensions.get("write_queue")
+    if queue is not None:
+        q = queue.stats()
+        gauges += [("attendance_write_queue_depth", "Queued attendance submissions not yet committed.", q["depth"]),
+                   ("attendance_write_queue_committed_total", "Queued submissions committed.", q["committed"]),
+                   ("attendance_write_queue_failed_total", "Queued submissions that failed.", q["failed"]),
+                   ("attendance_write_queue_dead_letters", "Failed submissions awaiting replay.", q["dead_letters"]),
+                   ("attendance_write_queue_commit_latency_seconds_max", "Longest time from accept to commit.",
+                    q["commit_latency_max"])]
+    return Response(current_app.extensions["metrics"].prometheus(gauges),
+                    mimetype="text/plain; version=0.0.4")
+
+
+def profiles_view():
+    """The slowest sampled requests with their cProfile output, slowest first."""
+    _require_token()
+    metrics = current_app.extensions["metrics"]
+    with metrics.lock:
+        profiles = sorted(metrics.profiles, reverse=True)
+    return jsonify(items=[{"seconds": round(duration, 6), "at": at, "endpoint": endpoint, "path": path,
+                           "profile": text} for duration, at, endpoint, path, text in profiles])
+
+
+def init_app(app):
+    """Install the hooks; call before db.init_app so pooled connections are instrumented."""
+    app.config["DB_CONNECTION_FACTORY"] = InstrumentedConnection
+    app.extensions["metrics"] = Metrics(profile_keep=app.config["PROFILE_KEEP"])
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_done, app)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
+    app.add_url_rule("/metrics/profiles", "metrics_profiles", profiles_view)
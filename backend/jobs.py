@@ -0,0 +1,400 @@
+"""In-process scheduler for recurring background jobs (ATTENDANCE_JOBS=1).
+
+Jobs live in the `jobs` table (migration 12), one row per job: the task it
+runs (tasks.TASKS), its schedule, keyword arguments as JSON, and the
+metrics of its runs. DEFAULT_JOBS are added the first time the scheduler
+starts; after that the table is the source of truth, so a schedule changed
+with `jobs.py schedule` survives restarts and deploys.
+
+    every 15m | every 2h | every 90s     after each run
+    daily 02:00                          at that local time
+
+A thread in each app process wakes every JOB_POLL_SECONDS, claims due jobs
+with a lease (locked_until) so that only one process runs each job, and
+hands them to a pool of JOB_WORKERS processes. Reports and summary checks
+scan whole tables; in their own processes they hold no GIL and no pooled
+connection that request threads need. The pool size is the concurrency
+limit, and a job never overlaps itself: it stays leased until its run is
+recorded, or until JOB_TIMEOUT passes when its process died.
+
+A failed run is retried after RETRY_DELAY, doubling each time, up to the
+job's max_attempts; then the job waits for its next scheduled time.
+
+Workers are forked, so a task never re-imports the app (app.py builds the
+app at import time, which a spawned worker would repeat). The fork is only
+safe while the process has no other threads, whose locks (SQLite's
+included) the children would inherit held: the app calls start_workers()
+before anything else starts a thread, and a pool that breaks later is not
+re-forked; that process stops taking jobs until it restarts, and the other
+app processes run them. Fork makes the scheduler POSIX-only.
+
+    python backend/jobs.py list
+    python backend/jobs.py run course-reports          # now, in this process
+    python backend/jobs.py schedule low-attendance-alerts "daily 07:30"
+    python backend/jobs.py disable rebuild-summary
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app
+
+from db_setup import DB_PATH
+from shards import MAIN, ShardMap
+from tasks import TASKS
+
+# (name, task, schedule, args)
+DEFAULT_JOBS = [
+    ("course-reports", "course_reports", "daily 02:00", {"threshold": 75.0}),
+    ("low-attendance-alerts", "low_attendance_alerts", "daily 07:00", {"threshold": 75.0}),
+    ("rebuild-summary", "rebuild_summary", "daily 03:00", {}),
+    ("compact-change-log", "compact_change_log", "daily 03:30", {"retention_days": 30}),
+]
+# First retry after this many seconds, then twice as long each time.
+RETRY_DELAY = 60.0
+SCHEDULE = re.compile(r"^(?:every (\d+)([smh])|daily ([01]\d|2[0-3]):([0-5]\d))$")
+
+
+def _now():
+    return datetime.datetime.now().replace(microsecond=0)
+
+
+def next_run(schedule, after):
+    """The first time after `after` (a datetime) that `schedule` is due; ValueError if malformed."""
+    match = SCHEDULE.match(schedule.strip())
+    if not match:
+        raise ValueError(f"schedule must be 'every <n>s|m|h' or 'daily HH:MM', not {schedule!r}")
+    count, unit, hour, minute = match.groups()
+    if count:
+        return after + datetime.timedelta(seconds=int(count) * {"s": 1, "m": 60, "h": 3600}[unit])
+    at = after.replace(hour=int(hour), minute=int(minute), second=0, microsecond=0)
+    return at if at > after else at + datetime.timedelta(days=1)
+
+
+def add_default_jobs(conn):
+    now = _now()
+    conn.executemany("INSERT OR IGNORE INTO jobs (name, task, schedule, args, next_run_at) VALUES (?,?,?,?,?)",
+                     [(name, task, schedule, json.dumps(args), next_run(schedule, now).isoformat())
+                      for name, task, schedule, args in DEFAULT_JOBS])
+    conn.commit()
+
+
+def run_task(task, context, args):
+    """Worker-process entry point: run one task and return (result, seconds)."""
+    started = time.perf_counter()
+    try:
+        result = TASKS[task](context, **args)
+    except Exception:
+        # The traceback would not survive pickling back to the scheduler.
+        raise RuntimeError(traceback.format_exc(limit=5)) from None
+    return result, time.perf_counter() - started
+
+
+def record_run(conn, name, ok, result, seconds, now=None):
+    """Store a finished run's outcome and schedule the next one."""
+    now = now or _now()
+    row = conn.execute("SELECT schedule, attempts, max_attempts FROM jobs WHERE name=?", (name,)).fetchone()
+    if row is None:
+        return
+    schedule, attempts, max_attempts = row
+    if ok:
+        status, attempts, due, error = "ok", 0, next_run(schedule, now), None
+    elif attempts + 1 < max_attempts:
+        status, attempts, error = "retrying", attempts + 1, result
+        due = now + datetime.timedelta(seconds=RETRY_DELAY * 2 ** attempts)
+    else:
+        status, attempts, due, error = "failed", 0, next_run(schedule, now), result
+    conn.execute("""
+        UPDATE jobs SET locked_by=NULL, locked_until=NULL, attempts=?, next_run_at=?,
+            runs=runs+1, failures=failures+?, last_finished_at=?, last_status=?, last_error=?,
+            last_result=COALESCE(?, last_result), last_seconds=?, total_seconds=total_seconds+?
+        WHERE name=?
+    """, (attempts, due.isoformat(), int(not ok), now.isoformat(), status, error,
+          json.dumps(result) if ok else None, seconds, seconds, name))
+    conn.commit()
+
+
+def start_workers(workers):
+    """Fork a pool of `workers` job processes; call before this process starts any thread."""
+    if "fork" not in multiprocessing.get_all_start_methods():
+        raise RuntimeError("the job scheduler needs fork (POSIX)")
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"))
+    # With fork every worker starts on the first submit, so they are all forked now.
+    pool.submit(int).result()
+    return pool
+
+
+class JobScheduler:
+    def __init__(self, db_path, context, pool, workers=2, poll=30.0, timeout=3600.0):
+        self.db_path = db_path
+        self.context = context
+        self.workers = workers
+        self.poll = poll
+        self.timeout = timeout
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._running = {}  # job name -> started (perf_counter)
+        self._done = queue.Queue()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._started = self._completed = self._failed = self._retried = 0
+        self._seconds = 0.0
+        self._last_error = None
+        self._broken = False
+
+        conn = self._connect()
+        try:
+            add_default_jobs(conn)
+        finally:
+            conn.close()
+        self._pool = pool
+        self._thread = threading.Thread(target=self._run, name="job-scheduler", daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+
+    # ------------ Claiming and running ------------
+    def _claim(self, conn, now):
+        """Lease up to the free worker count of due jobs; returns [(name, task, args)]."""
+        with self._lock:
+            free = self.workers - len(self._running)
+            busy = set(self._running)
+        if free <= 0 or self._broken:
+            return []
+        rows = conn.execute("""
+            SELECT name, task, args FROM jobs
+            WHERE enabled=1 AND next_run_at <= ? AND (locked_until IS NULL OR locked_until <= ?)
+            ORDER BY next_run_at LIMIT ?
+        """, (now.isoformat(), now.isoformat(), free + len(busy))).fetchall()
+        claimed = []
+        for name, task, args in rows:
+            if name in busy or len(claimed) == free:
+                continue
+            cur = conn.execute("""
+                UPDATE jobs SET locked_by=?, locked_until=?, last_started_at=?
+                WHERE name=? AND (locked_until IS NULL OR locked_until <= ?)
+            """, (self.owner, (now + datetime.timedelta(seconds=self.timeout)).isoformat(), now.isoformat(),
+                  name, now.isoformat()))
+            conn.commit()
+            if cur.rowcount == 1:  # another process may have taken it first
+                claimed.append((name, task, json.loads(args)))
+        return claimed
+
+    def _submit(self, conn, name, task, args):
+        if task not in TASKS:
+            record_run(conn, name, False, f"unknown task {task!r}", 0.0)
+            return
+        try:
+            future = self._pool.submit(run_task, task, self.context, args)
+        except BrokenProcessPool:
+            # Forking a new pool now could copy locks held by request threads; see the module docstring.
+            error = "job workers died; this process takes no more jobs until it restarts"
+            with self._lock:
+                self._broken = True
+                self._last_error = f"{name}: {error}"
+            record_run(conn, name, False, error, 0.0)
+            return
+        with self._lock:
+            self._running[name] = time.perf_counter()
+            self._started += 1
+        future.add_done_callback(lambda f: self._finished(name, f))
+
+    def _finished(self, name, future):
+        # Runs on the pool's management thread; the database work happens on ours.
+        try:
+            result, seconds = future.result()
+            self._done.put((name, True, result, seconds))
+        except Exception as e:
+            with self._lock:
+                started = self._running.get(name, time.perf_counter())
+            self._done.put((name, False, str(e) if isinstance(e, RuntimeError) else repr(e),
+                            time.perf_counter() - started))
+        self._wake.set()
+
+    def _record(self, conn):
+        while True:
+            try:
+                name, ok, result, seconds = self._done.get_nowait()
+            except queue.Empty:
+                return
+            record_run(conn, name, ok, result, seconds)
+            status = conn.execute("SELECT last_status FROM jobs WHERE name=?", (name,)).fetchone()
+            with self._lock:
+                self._running.pop(name, None)
+                self._seconds += seconds
+                self._completed += ok
+                self._failed += not ok
+                self._retried += bool(status and status[0] == "retrying")
+                if not ok:
+                    self._last_error = f"{name}: {result.strip().splitlines()[-1] if result else ''}"
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while not self._stop.is_set():
+                try:
+                    self._record(conn)
+                    for name, task, args in self._claim(conn, _now()):
+                        self._submit(conn, name, task, args)
+                except sqlite3.Error as e:
+                    with self._lock:
+                        self._last_error = repr(e)
+                self._wake.wait(self.poll)
+                self._wake.clear()
+            self._record(conn)
+        finally:
+            conn.close()
+
+    # ------------ Control ------------
+    def run_now(self, name):
+        """Make a job due immediately; returns False if there is no such job."""
+        conn = self._connect()
+        try:
+            cur = conn.execute("UPDATE jobs SET next_run_at=? WHERE name=?", (_now().isoformat(), name))
+            conn.commit()
+        finally:
+            conn.close()
+        self._wake.set()
+        return cur.rowcount == 1
+
+    def close(self, timeout=30.0):
+        """Stop claiming jobs, wait up to `timeout` for running ones and record them."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not self._running:
+                    break
+            time.sleep(0.05)
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            finished = self._completed + self._failed
+            return {
+                "workers": self.workers,
+                "broken": self._broken,
+                "running": sorted(self._running),
+                "started": self._started,
+                "completed": self._completed,
+                "failed": self._failed,
+                "retried": self._retried,
+                "mean_seconds": round(self._seconds / finished, 3) if finished else None,
+                "last_error": self._last_error,
+            }
+
+
+def job_context(config, databases):
+    """The plain-value settings tasks get (see tasks.py); `databases` maps names to paths."""
+    return {
+        "databases": dict(databases),
+        "mail_url": config["MAIL_URL"],
+        "mail_from": config["MAIL_FROM"],
+        "report_dir": config["REPORT_DIR"],
+    }
+
+
+def job_stats():
+    scheduler = current_app.extensions.get("jobs")
+    return scheduler.stats() if scheduler is not None else None
+
+
+def init_workers(app):
+    """Fork the job workers when JOBS is set; call before anything in the app starts a thread."""
+    if app.config["JOBS"]:
+        app.extensions["job_pool"] = start_workers(app.config["JOB_WORKERS"])
+
+
+def init_app(app):
+    """Start the scheduler when JOBS is set, on the workers init_workers forked."""
+    if not app.config["JOBS"]:
+        return
+    databases = {name: database.path for name, database in app.extensions["databases"].items()}
+    app.extensions["jobs"] = JobScheduler(app.config["DB_PATH"], job_context(app.config, databases),
+                                          app.extensions["job_pool"], workers=app.config["JOB_WORKERS"], poll=app.config["JOB_POLL_SECONDS"],
+                                          timeout=app.config["JOB_TIMEOUT"])
+
+
+# ------------ CLI ------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List, run and reschedule background jobs.")
+    parser.add_argument("--db", default=DB_PATH, help="main database file")
+    parser.add_argument("--shard-map", default=os.environ.get("ATTENDANCE_SHARD_MAP"), help="shard map (JSON)")
+    sub = parser.add_subparsers(dest="action", required=True)
+    sub.add_parser("list", help="jobs with their schedule and last run")
+    run = sub.add_parser("run", help="run a job now in this process and record the run")
+    run.add_argument("name")
+    schedule = sub.add_parser("schedule", help="change a job's schedule")
+    schedule.add_argument("name")
+    schedule.add_argument("schedule", help="'every <n>s|m|h' or 'daily HH:MM'")
+    for action in ("enable", "disable"):
+        sub.add_parser(action, help=f"{action} a job").add_argument("name")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        add_default_jobs(conn)
+        if args.action == "list":
+            for row in conn.execute("""
+                SELECT name, schedule, enabled, next_run_at, last_status, runs, failures, last_seconds, last_error
+                FROM jobs ORDER BY name
+            """):
+                name, sched, enabled, due, status, runs, failures, seconds, error = row
+                print(f"{name:<24} {sched:<14} {'on ' if enabled else 'off'} next {due}  "
+                      f"last {status or '-'} ({runs} runs, {failures} failed"
+                      f"{f', {seconds:.2f}s' if seconds is not None else ''})")
+                if error and status != "ok":
+                    print("    " + error.strip().splitlines()[-1])
+            return 0
+        row = conn.execute("SELECT task, args FROM jobs WHERE name=?", (args.name,)).fetchone()
+        if row is None:
+            parser.error(f"no job named {args.name!r}")
+        if args.action == "schedule":
+            try:
+                due = next_run(args.schedule, _now())
+            except ValueError as e:
+                parser.error(str(e))
+            conn.execute("UPDATE jobs SET schedule=?, next_run_at=? WHERE name=?",
+                         (args.schedule, due.isoformat(), args.name))
+        elif args.action in ("enable", "disable"):
+            conn.execute("UPDATE jobs SET enabled=? WHERE name=?", (int(args.action == "enable"), args.name))
+        else:
+            databases = {MAIN: args.db, **(ShardMap.load(args.shard_map).paths if args.shard_map else {})}
+            context = job_context({
+                "MAIL_URL": os.environ.get("ATTENDANCE_MAIL_URL"),
+                "MAIL_FROM": os.environ.get("ATTENDANCE_MAIL_FROM") or "attendance@localhost",
+                "REPORT_DIR": os.environ.get("ATTENDANCE_REPORT_DIR")
+                or os.path.join(os.path.dirname(os.path.abspath(args.db)), "reports"),
+            }, databases)
+            try:
+                result, seconds = run_task(row[0], context, json.loads(row[1]))
+            except RuntimeError as e:
+                record_run(conn, args.name, False, str(e), 0.0)
+                print(f"❌ {args.name} failed:\n{e}")
+                return 1
+            record_run(conn, args.name, True, result, seconds)
+            print(f"✅ {args.name} in {seconds:.2f}s: {json.dumps(result)}")
+            return 0
+        conn.commit()
+        print(f"✅ {args.name} updated")
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
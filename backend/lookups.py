@@ -0,0 +1,67 @@
+"""Cached read-mostly lookups used by nearly every teacher route.
+
+Course names, course rosters and teacher->course assignments change a few
+times per term but are read on every page. Each lookup takes a connection
+and is only queried on a cache miss. Routes that change the underlying rows
+must call the matching invalidate_* hook before returning.
+"""
+from cache import TTLCache
+
+courses_cache = TTLCache(maxsize=1024, ttl=600)
+teacher_courses_cache = TTLCache(maxsize=4096, ttl=300)
+roster_cache = TTLCache(maxsize=1024, ttl=300)
+
+
+def course_name(conn, course_id):
+    """Name of a course, or None if it does not exist."""
+    def load():
+        row = conn.execute("SELECT name FROM courses WHERE id=?", (course_id,)).fetchone()
+        return row["name"] if row else None
+    return courses_cache.get_or_load(course_id, load)
+
+
+def teacher_courses(conn, teacher_id):
+    """(id, name) rows of the courses a teacher is assigned to."""
+    def load():
+        return conn.execute("""
+            SELECT c.id, c.name
+            FROM courses c
+            JOIN teacher_courses tc ON c.id = tc.course_id
+            WHERE tc.teacher_id = ?
+        """, (teacher_id,)).fetchall()
+    return teacher_courses_cache.get_or_load(teacher_id, load)
+
+
+def is_teacher_assigned(conn, teacher_id, course_id):
+    """True if the teacher teaches the course."""
+    return any(c["id"] == course_id for c in teacher_courses(conn, teacher_id))
+
+
+def course_roster(conn, course_id):
+    """(id, name, email) rows of the students enrolled in a course."""
+    def load():
+        return conn.execute("""
+            SELECT s.id, s.name, s.email
+            FROM students s
+            JOIN student_courses sc ON s.id = sc.student_id
+            WHERE sc.course_id = ?
+        """, (course_id,)).fetchall()
+    return roster_cache.get_or_load(course_id, load)
+
+
+def invalidate_teacher_courses(teacher_id):
+    """Call after a teacher's course assignments change."""
+    teacher_courses_cache.invalidate(teacher_id)
+
+
+def invalidate_rosters(course_ids):
+    """Call after enrollments in, or student details on, these courses change."""
+    roster_cache.invalidate(*{int(cid) for cid in course_ids})
+
+
+def cache_stats():
+    return {
+        "courses": courses_cache.stats(),
+        "teacher_courses": teacher_courses_cache.stats(),
+        "rosters": roster_cache.stats(),
+    }
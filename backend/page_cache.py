@@ -0,0 +1,141 @@
+"""Rendered-page cache for read-mostly routes.
+
+Each cached page declares the data scopes it depends on, e.g.
+("course", 3) or ("teacher", 1). Every scope has a version counter that
+write routes bump with bump() after their commit. A page is cached under
+its endpoint, URL, the logged-in user and the current versions of its
+scopes, so a bump makes the old entries unreachable and they age out of
+the LRU.
+
+Bodies are stored gzipped, once, and sent as-is to clients that accept
+gzip. Responses carry a strong ETag and Last-Modified with
+`Cache-Control: private, no-cache`, so browsers revalidate every time and
+get a 304 while the page is unchanged.
+
+Versions live in this process only. Entries also expire after
+RESPONSE_CACHE_TTL seconds, so with several worker processes a write made
+through another worker shows up within that time, as with lookups.py.
+A bump also keeps this process's reads of the bumped data off stale
+replicas (db.replicas_behind) until the replicas have caught up.
+"""
+import functools
+import gzip
+import hashlib
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from flask import Response, current_app, request, session
+
+from cache import TTLCache
+from db import replicas_behind, shard_of
+
+GZIP_LEVEL = 6
+
+
+class CachedPage:
+    __slots__ = ("body", "mimetype", "etag", "modified")
+
+    def __init__(self, body, mimetype):
+        self.body = gzip.compress(body, GZIP_LEVEL)
+        self.mimetype = mimetype
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.modified = datetime.now(timezone.utc).replace(microsecond=0)
+
+    def respond(self):
+        """A response for the current request, 304 when the client's copy is current."""
+        gzipped = request.accept_encodings["gzip"] > 0
+        response = Response(self.body if gzipped else gzip.decompress(self.body), mimetype=self.mimetype)
+        if gzipped:
+            response.headers["Content-Encoding"] = "gzip"
+        # The gzipped bytes are a different representation, so they get their own strong tag.
+        response.set_etag(self.etag + ("-gz" if gzipped else ""))
+        response.last_modified = self.modified
+        response.vary.update(("Accept-Encoding", "Cookie"))
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+
+class PageCache:
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.pages = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._versions = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def versions(self, scopes):
+        with self._lock:
+            return tuple(self._versions[scope] for scope in scopes)
+
+    def bump(self, scopes):
+        with self._lock:
+            for scope in scopes:
+                self._versions[scope] += 1
+
+    def stats(self):
+        with self._lock:
+            scopes = len(self._versions)
+        return {**self.pages.stats(), "scopes": scopes}
+
+
+def cached_page(scopes):
+    """Serve a GET view from the page cache.
+
+    `scopes(**view_args)` returns the scopes the page depends on. Only 200
+    responses that are not streamed are cached; anything else (403s, POSTs)
+    goes straight through. Put this below the login decorators so the access
+    check runs on every request. Checks inside the view (has_course) only run
+    on a miss, so a write that takes a course away from someone must bump
+    that course's scope, as edit_teacher_profile does.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            cache = current_app.extensions.get("page_cache")
+            if cache is None or request.method != "GET":
+                return view(**kwargs)
+            deps = tuple(scopes(**kwargs))
+            key = (request.endpoint, request.full_path, session.get("role"), session.get("id"),
+                   deps, cache.versions(deps))
+            page = cache.pages.get(key)
+            if page is None:
+                response = current_app.make_response(view(**kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                page = CachedPage(response.get_data(), response.mimetype)
+                cache.pages.set(key, page)
+            return page.respond()
+        return wrapper
+    return decorator
+
+
+def bump(*scopes):
+    """Call after a commit that changes data in these scopes.
+
+    Reads of the databases holding them also go to the primary until their
+    replicas have copied the commit, so the pages (and analytics frames)
+    rebuilt next are not filled from a copy older than the write.
+    """
+    if all(kind == "course" for kind, _ in scopes):
+        replicas_behind({shard_of(cid) for _, cid in scopes})
+    else:
+        replicas_behind()  # teacher and student scopes can span every database
+    cache = current_app.extensions.get("page_cache")
+    if cache is not None:
+        cache.bump(scopes)
+
+
+def courses(course_ids):
+    """("course", id) scopes for a list of course ids (form values may be strings)."""
+    return [("course", int(cid)) for cid in course_ids]
+
+
+def page_cache_stats():
+    cache = current_app.extensions.get("page_cache")
+    return cache.stats() if cache is not None else None
+
+
+def init_app(app):
+    if app.config["RESPONSE_CACHE"]:
+        app.extensions["page_cache"] = PageCache(maxsize=app.config["RESPONSE_CACHE_SIZE"],
+                                                 ttl=app.config["RESPONSE_CACHE_TTL"])
@@ -0,0 +1,75 @@
+"""Keyset (seek) pagination helpers.
+
+Pages are addressed by the sort key of the last row shown rather than an
+OFFSET, so fetching page N costs the same as fetching page 1 and rows are
+read straight from the cursor instead of being loaded into a list.
+"""
+import base64
+import json
+
+
+def encode_cursor(*values):
+    """Pack a row's sort key into an opaque, URL-safe token."""
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def clamp_page_size(requested, default, maximum):
+    """A page_size query argument limited to 1..maximum; `default` when it is missing."""
+    return max(1, min(requested or default, maximum))
+
+
+def decode_cursor(token, size):
+    """Unpack a token from encode_cursor; raises ValueError if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("invalid page cursor") from e
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("invalid page cursor")
+    return values
+
+
+class KeysetPage:
+    """Lazily yields up to `page_size` rows from an executed cursor.
+
+    The query must fetch page_size + 1 rows; the extra row only signals that
+    another page exists. `next_cursor` is set once iteration reaches the end
+    of the page, so templates read it after their loop.
+    """
+
+    def __init__(self, cursor, page_size, key):
+        self.page_size = page_size
+        self.next_cursor = None
+        self._cursor = cursor
+        self._key = key
+        self._first = cursor.fetchone()
+
+    @classmethod
+    def from_rows(cls, rows, page_size, key):
+        """A page over rows already fetched (up to page_size + 1 of them, in order)."""
+        return cls(_RowCursor(iter(rows)), page_size, key)
+
+    def __bool__(self):
+        return self._first is not None
+
+    def __iter__(self):
+        row, count = self._first, 0
+        while row is not None:
+            if count == self.page_size:
+                self.next_cursor = encode_cursor(*self._key(last))
+                break
+            yield row
+            last, count = row, count + 1
+            row = self._cursor.fetchone()
+
+
+class _RowCursor:
+    """The fetchone() of a cursor, over an iterator of rows."""
+
+    def __init__(self, rows):
+        self._rows = rows
+
+    def fetchone(self):
+        return next(self._rows, None)
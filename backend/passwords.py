@@ -0,0 +1,79 @@
+"""Salted password hashing with a configurable KDF cost.
+
+Hashes use werkzeug's "method$salt$hash" format, e.g.
+"scrypt:32768:8:1$..." or "pbkdf2:sha256:600000$...". The method string sets
+the cost, so raising it only needs a config change: a stored hash made with a
+different method (or a legacy plaintext password) still verifies, and
+`needs_rehash` tells the login route to store a fresh hash.
+
+KDF work runs on a small bounded thread pool. hashlib's scrypt and pbkdf2
+release the GIL, so verifications run in parallel up to `max_workers` while
+any burst beyond that queues instead of starving every request thread of CPU.
+Successful verifications are remembered for a few minutes under an HMAC of
+(stored hash, password) keyed with a per-process secret, so repeated logins
+skip the KDF without keeping passwords or reusable digests in memory.
+"""
+import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from cache import TTLCache
+
+DEFAULT_METHOD = "scrypt:32768:8:1"
+KDF_PREFIXES = ("scrypt:", "pbkdf2:")
+
+
+def is_hashed(stored):
+    """True if the value looks like a werkzeug hash rather than legacy plaintext."""
+    return stored.startswith(KDF_PREFIXES) and stored.count("$") == 2
+
+
+class PasswordHasher:
+    def __init__(self, method=DEFAULT_METHOD, max_workers=None, cache_ttl=300, cache_size=4096):
+        self.method = method
+        # The normalised prefix hashes carry, e.g. "pbkdf2:sha256" -> "pbkdf2:sha256:1000000".
+        self.prefix = generate_password_hash("", method).split("$", 1)[0]
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="kdf")
+        self._key = os.urandom(32)
+        self.verified = TTLCache(maxsize=cache_size, ttl=cache_ttl) if cache_ttl else None
+        # Checked when the account does not exist so both failures take as long.
+        self._dummy = generate_password_hash(os.urandom(16).hex(), method)
+
+    def hash(self, password):
+        return self._executor.submit(generate_password_hash, password, self.method).result()
+
+    def hash_many(self, passwords):
+        """Hash a list of passwords in parallel on the KDF pool (for bulk imports)."""
+        return list(self._executor.map(lambda pw: generate_password_hash(pw, self.method), passwords))
+
+    def verify(self, stored, password):
+        """Check a password against a stored hash; `stored` may be None or legacy plaintext."""
+        password = password or ""
+        if stored is None:
+            self._executor.submit(check_password_hash, self._dummy, password).result()
+            return False
+        if not is_hashed(stored):
+            return hmac.compare_digest(stored.encode(), password.encode())
+
+        key = hmac.new(self._key, f"{stored}\0{password}".encode(), hashlib.sha256).digest()
+        if self.verified is not None and self.verified.get(key):
+            return True
+        ok = self._executor.submit(check_password_hash, stored, password).result()
+        if ok and self.verified is not None:
+            self.verified.set(key, True)
+        return ok
+
+    def needs_rehash(self, stored):
+        """True for plaintext or hashes made with a different method/cost."""
+        return not is_hashed(stored) or stored.split("$", 1)[0] != self.prefix
+
+    def stats(self):
+        return {"method": self.prefix, "max_workers": self.max_workers,
+                "cache": self.verified.stats() if self.verified is not None else None}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,90 @@
+"""Read replicas refreshed with SQLite's online backup API.
+
+A Replica copies its source database into a local file every `interval`
+seconds. Each copy is a single backup step, so it is a consistent snapshot
+of the source, and the source keeps accepting writes while it runs (WAL).
+The replica file is in WAL mode too, so connections reading it keep their
+snapshot until their transaction ends and never block the copy.
+
+Reads served from a replica may be up to `interval` seconds (plus the time
+a copy takes) behind the source; use them only for pages that can show
+slightly old data. After mark_stale() (called for each write this process
+commits) the replica is not `current` until a copy started after the mark
+has finished, and readers should use the source until then.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+
+class Replica:
+    def __init__(self, source, path, interval=30.0):
+        self.source = source
+        self.path = path
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._refreshes = 0
+        self._errors = 0
+        self._last_error = None
+        self._last_refresh = None
+        self._last_seconds = 0.0
+        self._copied_from = None  # time.monotonic() when the last finished copy started
+        self._stale_since = None
+        self._stop = threading.Event()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.refresh()  # the replica must exist before anything reads it
+        self._thread = threading.Thread(target=self._run, name=f"replica-{os.path.basename(path)}", daemon=True)
+        self._thread.start()
+
+    def refresh(self):
+        """Copy the source into the replica now."""
+        copied_from = time.monotonic()
+        started = time.perf_counter()
+        source = sqlite3.connect(self.source, timeout=30)
+        target = sqlite3.connect(self.path, timeout=30)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        with self._lock:
+            self._refreshes += 1
+            self._last_refresh = time.time()
+            self._last_seconds = time.perf_counter() - started
+            self._copied_from = copied_from
+
+    def mark_stale(self):
+        """Note that the source has a write the replica may not have copied yet."""
+        with self._lock:
+            self._stale_since = time.monotonic()
+
+    @property
+    def current(self):
+        """True unless a write marked since the last copy started is missing."""
+        with self._lock:
+            return self._stale_since is None or self._copied_from > self._stale_since
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except sqlite3.Error as e:
+                with self._lock:
+                    self._errors += 1
+                    self._last_error = repr(e)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "refreshes": self._refreshes,
+                "errors": self._errors,
+                "last_error": self._last_error,
+                "age_seconds": round(time.time() - self._last_refresh, 3) if self._last_refresh else None,
+                "last_refresh_seconds": round(self._last_seconds, 6),
+                "current": self._stale_since is None or self._copied_from > self._stale_since,
+            }
@@ -0,0 +1,264 @@
+"""Bulk import of students and course enrollments from CSV or JSON.
+
+Input is read and validated one row at a time. Valid rows are written in
+batches, each batch in its own transaction:
+
+    SELECT email FROM students WHERE email IN (...)
+    INSERT OR IGNORE INTO students ...      (executemany; email is UNIQUE)
+    SELECT id, email FROM students WHERE email IN (...)
+    INSERT OR IGNORE INTO student_courses ...  (executemany)
+
+Rows whose email already exists are not changed, but they still get any
+missing enrollments; only new students' passwords are hashed. Progress is saved in `roster_imports` in the same
+transaction as each batch (after it, when some enrollments go to shard
+files), so an interrupted import can resume after the last committed batch. A job's progress is cleared once all of its input has
+been read, so only interrupted imports resume; job names include a digest
+of the file (file_digest) so that a different file never resumes another's.
+
+Columns: name, email, password, courses. `courses` holds course ids or
+names separated by ";" (a list of ids/names in JSON).
+"""
+import csv
+import datetime
+import hashlib
+import io
+import json
+import time
+
+from attendance import refresh_summary_pairs
+from passwords import PasswordHasher
+
+DEFAULT_BATCH_SIZE = 1000
+REQUIRED_FIELDS = ("name", "email", "password")
+
+
+class ImportReport:
+    """Counters and per-row errors for one import run."""
+
+    def __init__(self, job):
+        self.job = job
+        self.rows_read = 0
+        self.rows_skipped = 0      # already committed by an earlier run
+        self.students_created = 0
+        self.students_existing = 0
+        self.enrollments_created = 0
+        self.batches = 0
+        self.errors = []           # (row number, message)
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return round(self.rows_read / self.elapsed, 1) if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            "job": self.job,
+            "rows_read": self.rows_read,
+            "rows_skipped": self.rows_skipped,
+            "students_created": self.students_created,
+            "students_existing": self.students_existing,
+            "enrollments_created": self.enrollments_created,
+            "batches": self.batches,
+            "errors": len(self.errors),
+            "seconds": round(self.elapsed, 3),
+            "rows_per_second": self.rows_per_second,
+        }
+
+
+def iter_records(stream, fmt):
+    """Yield dict rows from a text stream.
+
+    CSV and JSON Lines are read incrementally. A plain JSON array has to be
+    parsed whole, so prefer JSON Lines for large rosters.
+    """
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    elif fmt == "jsonl":
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    elif fmt == "json":
+        yield from json.load(stream)
+    else:
+        raise ValueError(f"unsupported format: {fmt}")
+
+
+def detect_format(filename):
+    name = (filename or "").lower()
+    if name.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    if name.endswith(".json"):
+        return "json"
+    return "csv"
+
+
+def load_courses(conn):
+    """Map both course ids (as strings) and lower-cased names to course ids."""
+    lookup = {}
+    for cid, name in conn.execute("SELECT id, name FROM courses"):
+        lookup[str(cid)] = cid
+        lookup[name.strip().lower()] = cid
+    return lookup
+
+
+def validate(record, courses, allowed_course_ids):
+    """Return (name, email, password, course_ids) or raise ValueError."""
+    if not isinstance(record, dict):
+        raise ValueError("row is not an object")
+    values = {f: str(record.get(f) or "").strip() for f in REQUIRED_FIELDS}
+    missing = [f for f in REQUIRED_FIELDS if not values[f]]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    email = values["email"].lower()
+    if "@" not in email:
+        raise ValueError(f"invalid email {values['email']!r}")
+
+    raw = record.get("courses") or []
+    if isinstance(raw, str):
+        raw = raw.split(";")
+    course_ids = set()
+    for item in raw:
+        key = str(item).strip()
+        if not key:
+            continue
+        cid = courses.get(key) or courses.get(key.lower())
+        if cid is None:
+            raise ValueError(f"unknown course {key!r}")
+        if allowed_course_ids is not None and cid not in allowed_course_ids:
+            raise ValueError(f"not allowed to enroll in course {key!r}")
+        course_ids.add(cid)
+    return values["name"], email, values["password"], course_ids
+
+
+def file_digest(binary):
+    """Short SHA-256 of a seekable binary stream, which is left at the start."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: binary.read(1 << 16), b""):
+        digest.update(chunk)
+    binary.seek(0)
+    return digest.hexdigest()[:16]
+
+
+def job_progress(conn, job):
+    """Rows already committed for a job (0 if it never ran)."""
+    row = conn.execute("SELECT rows_committed FROM roster_imports WHERE job=?", (job,)).fetchone()
+    return row[0] if row else 0
+
+
+def _save_progress(cur, job, source, last_row):
+    now = datetime.datetime.now().isoformat(timespec="seconds")
+    cur.execute("""
+        INSERT INTO roster_imports (job, source, rows_committed, started_at, updated_at)
+        VALUES (?,?,?,?,?)
+        ON CONFLICT (job) DO UPDATE SET rows_committed=excluded.rows_committed, updated_at=excluded.updated_at
+    """, (job, source, last_row, now, now))
+
+
+def _finish_job(conn, job):
+    conn.execute("DELETE FROM roster_imports WHERE job=?", (job,))
+    conn.commit()
+
+
+def _write_batch(conn, job, source, batch, last_row, report, hash_passwords, elsewhere, enroll_elsewhere):
+    cur = conn.cursor()
+    emails = list({email for _, _, email, _, _ in batch})
+    in_emails = f"email IN ({','.join('?' * len(emails))})"
+    cur.execute(f"SELECT email FROM students WHERE {in_emails}", emails)
+    existing = {r[0] for r in cur.fetchall()}
+
+    # Only students that will actually be created pay for password hashing.
+    new = {}
+    for _, name, email, password, _ in batch:
+        if email not in existing and email not in new:
+            new[email] = (name, password)
+    hashes = hash_passwords([password for _, password in new.values()])
+    # executemany's rowcount is the total over all rows; IGNOREd rows add 0.
+    cur.executemany("INSERT OR IGNORE INTO students (name, email, password) VALUES (?,?,?)",
+                    [(name, email, h) for (email, (name, _)), h in zip(new.items(), hashes)])
+    created = cur.rowcount if new else 0
+
+    cur.execute(f"SELECT id, email FROM students WHERE {in_emails}", emails)
+    ids = {email: sid for sid, email in cur.fetchall()}
+
+    pairs = {(ids[email], cid) for _, _, email, _, course_ids in batch for cid in course_ids}
+    remote = {p for p in pairs if elsewhere(p[1])} if elsewhere else set()
+    local = pairs - remote
+    cur.executemany("INSERT OR IGNORE INTO student_courses (student_id, course_id) VALUES (?,?)", sorted(local))
+    enrolled = cur.rowcount if local else 0
+    # Re-enrolled students may already have attendance in these courses.
+    refresh_summary_pairs(cur, local)
+
+    if not remote:
+        _save_progress(cur, job, source, last_row)
+    conn.commit()
+    if remote:
+        # Only now are the new students' ids final; progress is saved after
+        # the other files' enrollments, so a failure in between redoes the batch.
+        enrolled += enroll_elsewhere(remote)
+        _save_progress(cur, job, source, last_row)
+        conn.commit()
+
+    report.batches += 1
+    report.students_created += created
+    report.students_existing += len(batch) - created
+    report.enrollments_created += enrolled
+    return {cid for _, cid in pairs}
+
+
+def import_roster(conn, records, job, source="", batch_size=DEFAULT_BATCH_SIZE, allowed_course_ids=None,
+                  resume=True, hash_passwords=None, on_batch=None, elsewhere=None, enroll_elsewhere=None):
+    """Validate and insert records; returns an ImportReport.
+
+    With `resume`, rows up to the job's last committed row are skipped; that
+    is only the case when an earlier run of the job stopped part way.
+    `allowed_course_ids` restricts enrollments (e.g. to a teacher's courses).
+    `on_batch(course_ids)` is called after each commit with the courses that
+    gained students, so callers can invalidate caches. `hash_passwords` maps a
+    batch's passwords to stored hashes (PasswordHasher.hash_many).
+    With a shard map, `elsewhere(course_id)` is true for courses that live in
+    another database file (see shards.py), and `enroll_elsewhere(pairs)`
+    enrolls those (student_id, course_id) pairs there, returning the number
+    added. It runs after the batch commits, so it never enrolls a student id
+    that was rolled back, and before the batch's progress is saved; it must
+    be idempotent (INSERT OR IGNORE), since a retry repeats it.
+    """
+    report = ImportReport(job)
+    hash_passwords = hash_passwords or PasswordHasher().hash_many
+    courses = load_courses(conn)
+    skip = job_progress(conn, job) if resume else 0
+    batch = []
+    row_number = 0
+
+    def flush():
+        touched = _write_batch(conn, job, source, batch, row_number, report, hash_passwords, elsewhere,
+                               enroll_elsewhere)
+        batch.clear()
+        if on_batch:
+            on_batch(touched)
+
+    try:
+        for row_number, record in enumerate(records, start=1):
+            if row_number <= skip:
+                report.rows_skipped += 1
+                continue
+            report.rows_read += 1
+            try:
+                batch.append((row_number, *validate(record, courses, allowed_course_ids)))
+            except ValueError as e:
+                report.errors.append((row_number, str(e)))
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+        _finish_job(conn, job)
+    except (csv.Error, json.JSONDecodeError, UnicodeDecodeError) as e:
+        conn.rollback()
+        report.errors.append((row_number + 1, f"unreadable input: {e}"))
+    report.elapsed = time.perf_counter() - report.started
+    return report
+
+
+def text_stream(binary):
+    """Wrap an uploaded binary stream for the CSV/JSON readers."""
+    return io.TextIOWrapper(binary, encoding="utf-8-sig", newline="")
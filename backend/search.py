@@ -0,0 +1,86 @@
+"""Student search over the students_fts full-text index.
+
+students_fts (migration 9) is an FTS5 index over students.name and
+students.email, kept in step with the students table by triggers. Every
+word of a search is matched as a prefix, so "ann sm" finds "Anna Smith" and
+"ann.smith@example.edu". Results are restricted to the students enrolled
+in the given courses and come back in (name, id) order, one keyset page at
+a time.
+
+SQLite builds without FTS5 skip the index; search then falls back to a
+LIKE scan with the same prefix semantics.
+"""
+import heapq
+import re
+import sqlite3
+
+from pagination import KeysetPage, decode_cursor
+
+WORD = re.compile(r"\w+")
+
+
+def match_query(text):
+    """An FTS5 query matching every word of `text` as a prefix; "" when there are no words."""
+    return " ".join(f'"{word}"*' for word in WORD.findall(text or ""))
+
+
+def fts_available(conn):
+    # Not a sqlite_master lookup: on a shard connection the index is in the attached core database.
+    try:
+        conn.execute("SELECT 1 FROM students_fts LIMIT 0")
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+def matching_students(conn, text, course_ids, limit, after, fts=None):
+    """Up to `limit` enrolled students matching `text` in (name, id) order, after the (name, id) `after`.
+
+    `fts` forces the index on or off (benchmarks); by default it is used when present.
+    """
+    marks = ",".join("?" * len(course_ids))
+    words = WORD.findall(text or "")
+    if words and (fts_available(conn) if fts is None else fts):
+        # Start from the index matches and probe enrollment per match: a search
+        # usually matches far fewer students than a teacher's courses hold.
+        source = "students_fts f CROSS JOIN students s ON s.id = f.rowid"
+        clauses = ["students_fts MATCH ?",
+                   f"EXISTS (SELECT 1 FROM student_courses sc WHERE sc.student_id = s.id AND sc.course_id IN ({marks}))"]
+        params = [match_query(text), *course_ids]
+    else:
+        source = "students s"
+        clauses = [f"s.id IN (SELECT student_id FROM student_courses WHERE course_id IN ({marks}))"]
+        params = list(course_ids)
+        for word in words:
+            # Same prefix semantics as FTS5: a word starts the name/email or follows a separator.
+            clauses.append("(s.name LIKE ? OR s.name LIKE ? OR s.email LIKE ? OR s.email LIKE ? OR s.email LIKE ?)")
+            params += [f"{word}%", f"% {word}%", f"{word}%", f"%.{word}%", f"%@{word}%"]
+    if after:
+        clauses.append("s.name >= ? AND (s.name > ? OR s.id > ?)")
+        params += [after[0], after[0], after[1]]
+    return conn.execute(f"""
+        SELECT s.id, s.name, s.email FROM {source}
+        WHERE {" AND ".join(clauses)}
+        ORDER BY s.name, s.id LIMIT ?
+    """, (*params, limit)).fetchall()
+
+
+def search_students(fan_out, text, course_ids, page_size, after=None):
+    """One page of the students in `course_ids` matching `text`, as a KeysetPage.
+
+    `fan_out` is db.fan_out: each database holding some of the courses is
+    searched for a page and the pages are merged. An empty `text` lists
+    every enrolled student. `after` is the previous page's next_cursor; a
+    malformed token raises ValueError.
+    """
+    after = decode_cursor(after, 2) if after else None
+    if not course_ids:
+        return KeysetPage.from_rows([], page_size, key=None)
+    pages = fan_out(lambda conn, ids: matching_students(conn, text, ids, page_size + 1, after), course_ids)
+    # A student enrolled in courses on several shards comes back once per shard.
+    rows, seen = [], set()
+    for row in heapq.merge(*pages, key=lambda r: (r["name"], r["id"])):
+        if row["id"] not in seen:
+            seen.add(row["id"])
+            rows.append(row)
+    return KeysetPage.from_rows(rows[:page_size + 1], page_size, key=lambda r: (r["name"], r["id"]))
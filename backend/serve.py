@@ -0,0 +1,51 @@
+"""Run the app with the development server or an ASGI server.
+
+    python backend/serve.py                                 # uvicorn, 1 worker
+    python backend/serve.py --workers 4 --threads 32        # uvicorn, 4 processes
+    python backend/serve.py --server dev                    # Werkzeug dev server
+
+ASGI mode needs `pip install uvicorn a2wsgi`. With more than one worker, set
+ATTENDANCE_SECRET_KEY so every worker accepts the same session cookies, and
+use the cookie or sqlite session store (the memory store is per process).
+Each worker has its own database writer thread; between processes SQLite's
+busy_timeout still applies.
+"""
+import argparse
+import os
+import sys
+
+BACKEND = os.path.dirname(os.path.abspath(__file__))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the attendance app.")
+    parser.add_argument("--server", choices=["asgi", "dev"], default="asgi")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=1, help="ASGI worker processes")
+    parser.add_argument("--threads", type=int, default=16, help="request threads per worker")
+    parser.add_argument("--log-level", default="warning")
+    args = parser.parse_args(argv)
+
+    if args.server == "dev":
+        from app import app
+        app.run(host=args.host, port=args.port, threaded=True)
+        return
+
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("ASGI mode needs uvicorn and a2wsgi: pip install uvicorn a2wsgi")
+    if args.workers > 1:
+        if not os.environ.get("ATTENDANCE_SECRET_KEY"):
+            sys.exit("Set ATTENDANCE_SECRET_KEY when running more than one worker")
+        if os.environ.get("ATTENDANCE_SESSION_STORE") == "memory":
+            sys.exit("The memory session store is per process; use cookie or sqlite with several workers")
+    # Read by asgi.py; worker processes inherit the environment.
+    os.environ["ATTENDANCE_ASGI_THREADS"] = str(args.threads)
+    uvicorn.run("asgi:application", app_dir=BACKEND, host=args.host, port=args.port,
+                workers=args.workers, log_level=args.log_level)
+
+
+if __name__ == "__main__":
+    main()
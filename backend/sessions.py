@@ -0,0 +1,140 @@
+"""Session stores for login state.
+
+SESSION_STORE selects where session data lives:
+
+    "cookie"  Flask's signed cookie (default). No server state, works across
+              any number of workers, but the data travels with every request.
+    "memory"  An in-process LRU keyed by a random session id. Fastest, but
+              sessions are per-process and lost on restart.
+    "sqlite"  A `sessions` table in the app database, shared by all workers.
+
+Server-side stores only write when the session changes (login, logout,
+profile edits), so a normal page view costs one lookup and no write.
+"""
+import json
+import secrets
+import time
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from cache import TTLCache
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.stale_sid = None
+
+    def rotate(self):
+        """Move the data to a new session id (call on login to prevent fixation)."""
+        if not self.new:
+            self.stale_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+class MemorySessionStore:
+    def __init__(self, maxsize=10000, ttl=43200):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def load(self, sid):
+        return self.cache.get(sid)
+
+    def save(self, sid, data, expires):
+        self.cache.set(sid, data)
+
+    def delete(self, sid):
+        self.cache.invalidate(sid)
+
+
+class SQLiteSessionStore:
+    """Sessions in the `sessions` table, using connections from a ConnectionPool."""
+
+    # Expired rows are deleted on roughly one save in this many.
+    PURGE_EVERY = 100
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def load(self, sid):
+        conn = self.pool.acquire()
+        try:
+            row = conn.execute("SELECT data FROM sessions WHERE sid=? AND expires>?",
+                               (sid, time.time())).fetchone()
+        finally:
+            self.pool.release(conn)
+        return json.loads(row[0]) if row else None
+
+    def save(self, sid, data, expires):
+        conn = self.pool.acquire()
+        try:
+            conn.execute("""
+                INSERT INTO sessions (sid, data, expires) VALUES (?,?,?)
+                ON CONFLICT (sid) DO UPDATE SET data=excluded.data, expires=excluded.expires
+            """, (sid, json.dumps(data), expires))
+            if secrets.randbelow(self.PURGE_EVERY) == 0:
+                conn.execute("DELETE FROM sessions WHERE expires<=?", (time.time(),))
+            conn.commit()
+        finally:
+            self.pool.release(conn)
+
+    def delete(self, sid):
+        conn = self.pool.acquire()
+        try:
+            conn.execute("DELETE FROM sessions WHERE sid=?", (sid,))
+            conn.commit()
+        finally:
+            self.pool.release(conn)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keeps session data in a store; the cookie only carries a random id."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        data = self.store.load(sid) if sid else None
+        if data is None:
+            return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+        return ServerSideSession(data, sid=sid)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.stale_sid:
+            self.store.delete(session.stale_sid)
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+
+        expires = self.get_expiration_time(app, session)
+        ttl = expires.timestamp() if expires else time.time() + app.permanent_session_lifetime.total_seconds()
+        self.store.save(session.sid, dict(session), ttl)
+        response.set_cookie(name, session.sid, expires=expires, domain=domain, path=path,
+                            httponly=self.get_cookie_httponly(app), secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+
+def init_app(app, pool):
+    """Install the session interface named by app.config["SESSION_STORE"]."""
+    store = app.config["SESSION_STORE"]
+    if store == "memory":
+        app.session_interface = ServerSideSessionInterface(
+            MemorySessionStore(ttl=app.permanent_session_lifetime.total_seconds()))
+    elif store == "sqlite":
+        app.session_interface = ServerSideSessionInterface(SQLiteSessionStore(pool))
+    elif store != "cookie":
+        raise ValueError(f"unknown SESSION_STORE {store!r} (use cookie, memory or sqlite)")
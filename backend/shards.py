@@ -0,0 +1,223 @@
+"""Placing courses in separate SQLite files (shards).
+
+The main database keeps everything that is not per course: teachers,
+students, courses, teacher_courses, sessions. A shard file holds the
+per-course tables (SHARD_TABLES) for the courses the shard map assigns to
+it; courses the map does not name stay in the main file. Every file has its
+own write lock and writer thread, so one campus's marking rush does not
+hold up the others.
+
+Connections that read a shard ATTACH the main database as "core". SQLite
+looks an unqualified table name up in the shard first and then in the
+attached database, so the existing queries (which join students and
+courses) run unchanged. Writes to a shard only touch its own tables and use
+a connection without the attachment, since BEGIN IMMEDIATE would lock the
+main database as well.
+
+Map file (JSON; shard paths are relative to the map file):
+
+    {"shards": {"north": "north.db", "south": "south.db"},
+     "courses": {"north": [1, 2], "south": [3]}}
+
+    python backend/shards.py split --map shards.json   # move mapped courses' rows into their shards
+    python backend/shards.py merge --map shards.json   # move every shard's rows back
+
+Shard files are created by `split` with only the shard tables. Do not run
+db_setup.py against one: it would create empty copies of the main tables
+that hide the real ones. Running split again adds tables, indexes and
+triggers a newer migration created (e.g. the change log); a migration that
+changes an existing shard table has to be applied to each shard by hand.
+"""
+import argparse
+import json
+import os
+import sqlite3
+
+from db_setup import DB_PATH
+
+MAIN = "main"
+# Per-course tables, in the order rows are moved.
+SHARD_TABLES = ("student_courses", "attendance", "attendance_summary", "attendance_bitmaps", "attendance_term_summary")
+# Created in every shard but not moved: rows are not tied to one course, or
+# (the change log) belong to the file they were written in.
+SHARD_ONLY_SCHEMA = ("attendance_submissions", "change_log", "change_log_horizon", "change_log_pause",
+                     "attendance_archives")
+# The single row some of those tables need.
+SEED_ROWS = {
+    "change_log_horizon": "INSERT OR IGNORE INTO change_log_horizon (id, purged_through) VALUES (1, 0)",
+    "change_log_pause": "INSERT OR IGNORE INTO change_log_pause (id, paused) VALUES (1, 0)",
+}
+
+
+class ShardMap:
+    def __init__(self, paths, courses):
+        self.paths = dict(paths)      # shard name -> file
+        self.courses = dict(courses)  # course id -> shard name
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        base = os.path.dirname(os.path.abspath(path))
+        paths = {name: os.path.join(base, file) for name, file in data.get("shards", {}).items()}
+        if MAIN in paths:
+            raise ValueError(f"{MAIN!r} is the main database and cannot be a shard name")
+        courses = {}
+        for name, ids in data.get("courses", {}).items():
+            if name not in paths:
+                raise ValueError(f"courses are mapped to unknown shard {name!r}")
+            for cid in ids:
+                if courses.setdefault(int(cid), name) != name:
+                    raise ValueError(f"course {cid} is mapped to two shards")
+        return cls(paths, courses)
+
+    def shard_of(self, course_id):
+        return self.courses.get(int(course_id), MAIN)
+
+    def course_ids(self, name):
+        return sorted(cid for cid, shard in self.courses.items() if shard == name)
+
+
+def attached_factory(factory, main_path):
+    """A connection class that ATTACHes the main database as "core" on connect."""
+    class ShardConnection(factory):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.execute("ATTACH DATABASE ? AS core", (main_path,))
+    return ShardConnection
+
+
+# ------------ Moving rows ------------
+def _schema(conn, tables):
+    """CREATE statements for the tables and their indexes and triggers, tables first."""
+    rows = conn.execute(f"""
+        SELECT type, name, sql FROM main.sqlite_master
+        WHERE tbl_name IN ({",".join("?" * len(tables))}) AND sql IS NOT NULL
+        ORDER BY type != 'table', name
+    """, tables).fetchall()
+    return [(name, sql) for _, name, sql in rows]
+
+
+def _create_schema(conn, path, tables):
+    """Create whichever of the main database's `tables` (and indexes) the shard lacks.
+
+    Triggers a later migration redefined are replaced, so running split
+    again after an upgrade brings existing shards up to date.
+    """
+    shard = sqlite3.connect(path)
+    try:
+        existing = dict(shard.execute("SELECT name, sql FROM sqlite_master"))
+        shard.execute("PRAGMA journal_mode=WAL")
+        for name, sql in _schema(conn, tables):
+            if name in existing and sql != existing[name] and sql.lstrip().upper().startswith("CREATE TRIGGER"):
+                shard.execute(f"DROP TRIGGER {name}")
+                del existing[name]
+            if name not in existing:
+                shard.execute(sql)
+        for table in tables:
+            if table in SEED_ROWS:
+                shard.execute(SEED_ROWS[table])
+        shard.commit()
+    finally:
+        shard.close()
+
+
+def _columns(conn, schema, table):
+    # Row ids are local to each file, so rows are copied without them.
+    return [r[1] for r in conn.execute(f"PRAGMA {schema}.table_info({table})") if r[1] != "id"]
+
+
+def _move(conn, tables, source, target, where="", params=()):
+    # The rows live on in `target`, whose change log records them as upserts;
+    # the source's log must not report them deleted (see change_log_pause).
+    pausable = _present(conn, source, ["change_log_pause"])
+    if pausable:
+        conn.execute(f"UPDATE {source}.change_log_pause SET paused = 1 WHERE id = 1")
+    moved = {}
+    for table in tables:
+        columns = ", ".join(_columns(conn, source, table))
+        cur = conn.execute(f"INSERT OR IGNORE INTO {target}.{table} ({columns}) "
+                           f"SELECT {columns} FROM {source}.{table} {where}", params)
+        moved[table] = cur.rowcount
+        conn.execute(f"DELETE FROM {source}.{table} {where}", params)
+    if pausable:
+        conn.execute(f"UPDATE {source}.change_log_pause SET paused = 0 WHERE id = 1")
+    return moved
+
+
+def _present(conn, schema, tables):
+    names = {r[0] for r in conn.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type='table'")}
+    return [t for t in tables if t in names]
+
+
+def split(main_path, shard_map):
+    """Move each mapped course's rows from the main database into its shard.
+
+    Returns {shard: {table: rows copied}}. Each shard is moved in one
+    transaction over both files. Under WAL a crash can leave that commit
+    applied to one file only; rows are then in both, and running split again
+    finishes the move (copies skip rows that are already there).
+    """
+    conn = sqlite3.connect(main_path, isolation_level=None, timeout=30)
+    report = {}
+    try:
+        tables = _present(conn, "main", SHARD_TABLES)
+        for name, path in shard_map.paths.items():
+            _create_schema(conn, path, tables + _present(conn, "main", SHARD_ONLY_SCHEMA))
+            ids = shard_map.course_ids(name)
+            if not ids:
+                continue
+            conn.execute("ATTACH DATABASE ? AS shard", (path,))
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                report[name] = _move(conn, tables, "main", "shard",
+                                     f"WHERE course_id IN ({','.join('?' * len(ids))})", ids)
+                conn.execute("COMMIT")
+            finally:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                conn.execute("DETACH DATABASE shard")
+    finally:
+        conn.close()
+    return report
+
+
+def merge(main_path, shard_map):
+    """Move every row of every shard back into the main database."""
+    conn = sqlite3.connect(main_path, isolation_level=None, timeout=30)
+    report = {}
+    try:
+        for name, path in shard_map.paths.items():
+            if not os.path.exists(path):
+                continue
+            # Brings the shard's change log triggers up to date before rows leave it.
+            _create_schema(conn, path, _present(conn, "main", SHARD_TABLES + SHARD_ONLY_SCHEMA))
+            conn.execute("ATTACH DATABASE ? AS shard", (path,))
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                report[name] = _move(conn, _present(conn, "shard", SHARD_TABLES), "shard", "main")
+                conn.execute("COMMIT")
+            finally:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                conn.execute("DETACH DATABASE shard")
+    finally:
+        conn.close()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move course data between the main database and shards.")
+    parser.add_argument("action", choices=("split", "merge"))
+    parser.add_argument("--map", required=True, help="shard map JSON file")
+    parser.add_argument("--db", default=DB_PATH, help="main database (default: ATTENDANCE_DB_PATH)")
+    args = parser.parse_args(argv)
+
+    report = (split if args.action == "split" else merge)(args.db, ShardMap.load(args.map))
+    for name, tables in report.items():
+        print(f"{name}: " + ", ".join(f"{table} {rows:,}" for table, rows in tables.items()))
+    print(f"✅ {args.action} done")
+
+
+if __name__ == "__main__":
+    main()
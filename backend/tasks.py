@@ -0,0 +1,239 @@
+"""The work scheduled jobs do (see jobs.py), run in the scheduler's worker processes.
+
+Each task is task(context, **args) and returns a small JSON-able dict that
+is kept as the job's last_result. `context` only holds plain values
+(database paths, mail settings, the report directory) because it is sent
+to another process; a task opens its own connections and closes them
+before it returns.
+
+With a shard map every database file is visited in turn: the per-course
+tables are read from the file that holds the course, and students, teachers
+and courses through the attached main database, as the app does.
+"""
+import contextlib
+import csv
+import datetime
+import io
+import os
+import sqlite3
+
+from attendance import attendance_rate, check_summary, refresh_summary_pairs
+from change_log import compact_and_purge
+from mailer import build_message, make_sender
+from shards import MAIN, attached_factory
+
+# Written next to a day's reports: one "<report file>\t<address>" line per email sent.
+EMAILED = "emailed.txt"
+
+
+@contextlib.contextmanager
+def _connect(context, name, attach=True):
+    """A connection to one database file; shards see the main tables unless `attach` is False.
+
+    Writes to a shard need attach=False: BEGIN IMMEDIATE would lock the main
+    database too.
+    """
+    path = context["databases"][name]
+    factory = attached_factory(sqlite3.Connection, context["databases"][MAIN]) \
+        if name != MAIN and attach else sqlite3.Connection
+    conn = sqlite3.connect(path, timeout=30, factory=factory)
+    conn.row_factory = sqlite3.Row
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def _course_ids(conn, only=None):
+    """Courses whose rosters live in this file."""
+    ids = [r[0] for r in conn.execute("SELECT DISTINCT course_id FROM main.student_courses ORDER BY course_id")]
+    return [cid for cid in ids if only is None or cid in only]
+
+
+def _send(context, messages):
+    """Send (to, subject, body, attachments) messages one at a time, yielding each once it went out.
+
+    Nothing is sent with email off. Callers record every message as it is
+    yielded, so a run that fails part-way is retried without sending the
+    earlier ones again.
+    """
+    sender = make_sender(context.get("mail_url"))
+    if sender is None:
+        return
+    for message in messages:
+        to, subject, body, attachments = message
+        sender.send(build_message(context["mail_from"], to, subject, body, attachments))
+        yield message
+
+
+# ------------ Reports ------------
+def _course_report(conn, course_id, since):
+    """(header, rows) of a course's per-student counts, overall and since `since`."""
+    rows = conn.execute("""
+        SELECT s.id, s.name, s.email, sm.present, sm.absent, sm.excused, r.present AS recent_present,
+               r.marked AS recent_marked
+        FROM student_courses sc
+        JOIN students s ON s.id = sc.student_id
+        LEFT JOIN attendance_summary sm ON sm.student_id = sc.student_id AND sm.course_id = sc.course_id
+        LEFT JOIN (
+            SELECT student_id, SUM(status = 'Present') AS present, COUNT(*) AS marked
+            FROM attendance WHERE course_id = ? AND date >= ?
+            GROUP BY student_id
+        ) r ON r.student_id = sc.student_id
+        WHERE sc.course_id = ?
+        ORDER BY s.name, s.id
+    """, (course_id, since, course_id)).fetchall()
+    header = ["student_id", "name", "email", "present", "absent", "excused", "rate", "recent_rate"]
+    table = []
+    for r in rows:
+        counts = {"present": r["present"] or 0, "absent": r["absent"] or 0, "excused": r["excused"] or 0}
+        recent = round(100.0 * r["recent_present"] / r["recent_marked"], 1) if r["recent_marked"] else None
+        table.append([r["id"], r["name"], r["email"], counts["present"], counts["absent"], counts["excused"],
+                      attendance_rate(counts), recent])
+    return header, table
+
+
+def course_reports(context, threshold=75.0, recent_days=30, courses=None):
+    """Write each course's attendance report to the report directory and email it to its teachers.
+
+    A teacher gets a course's report at most once a day (see EMAILED), so a
+    retried or repeated run only emails whoever has not had it yet.
+    """
+    today = datetime.date.today()
+    since = (today - datetime.timedelta(days=recent_days)).isoformat()
+    directory = os.path.join(context["report_dir"], today.isoformat())
+    os.makedirs(directory, exist_ok=True)
+    emailed = _emailed(directory)
+    written, keys, messages = 0, [], []
+    for name in context["databases"]:
+        with _connect(context, name) as conn:
+            for course_id in _course_ids(conn, courses and set(courses)):
+                header, table = _course_report(conn, course_id, since)
+                buf = io.StringIO()
+                csv.writer(buf).writerows([header, *table])
+                filename = f"course-{course_id}.csv"
+                with open(os.path.join(directory, filename), "w", newline="", encoding="utf-8") as f:
+                    f.write(buf.getvalue())
+                written += 1
+
+                course = conn.execute("SELECT name FROM courses WHERE id=?", (course_id,)).fetchone()
+                rates = [row[6] for row in table if row[6] is not None]
+                low = [row for row in table if row[6] is not None and row[6] < threshold]
+                body = "\n".join([
+                    f"Attendance report for {course['name'] if course else course_id}, {today.isoformat()}",
+                    "",
+                    f"Students: {len(table)}",
+                    f"Average rate: {round(sum(rates) / len(rates), 1) if rates else '-'}%",
+                    f"Below {threshold:g}%: {len(low)}",
+                    *(f"  {row[1]} ({row[6]}%)" for row in sorted(low, key=lambda row: row[6])),
+                    "",
+                    f"Per-student counts are attached; rates over the last {recent_days} days are in recent_rate.",
+                ])
+                teachers = conn.execute("""
+                    SELECT t.email FROM teachers t JOIN teacher_courses tc ON tc.teacher_id = t.id
+                    WHERE tc.course_id = ?
+                """, (course_id,)).fetchall()
+                for t in teachers:
+                    if (filename, t["email"]) in emailed:
+                        continue
+                    keys.append((filename, t["email"]))
+                    messages.append((t["email"], f"Attendance report: {course['name'] if course else course_id}",
+                                     body, [(filename, buf.getvalue().encode(), "text/csv")]))
+    sent = 0
+    with open(os.path.join(directory, EMAILED), "a", encoding="utf-8") as log:
+        for key, _ in zip(keys, _send(context, messages)):
+            log.write("\t".join(key) + "\n")
+            log.flush()
+            sent += 1
+    return {"reports": written, "directory": directory, "emails": sent, "unsent": len(messages) - sent,
+            "already_emailed": len(emailed)}
+
+
+def _emailed(directory):
+    """{(report file, address)} already emailed from this report directory."""
+    try:
+        with open(os.path.join(directory, EMAILED), encoding="utf-8") as f:
+            return {tuple(line.rstrip("\n").split("\t", 1)) for line in f if "\t" in line}
+    except FileNotFoundError:
+        return set()
+
+
+# ------------ Alerts ------------
+def low_attendance_alerts(context, threshold=75.0, min_marks=5, repeat_days=7):
+    """Email students whose rate in a course is below `threshold`, at most once per `repeat_days`.
+
+    Students need `min_marks` marks in the course first, so one absence in
+    the first week does not trigger an alert. Each alert is recorded as soon
+    as it is sent, so a retry after a failure part-way does not repeat it.
+    With email off nothing is recorded, so the alerts go out once it is
+    configured.
+    """
+    now = datetime.datetime.now()
+    cutoff = (now - datetime.timedelta(days=repeat_days)).isoformat(timespec="seconds")
+    with _connect(context, MAIN) as main:
+        recent = {(r[0], r[1]) for r in main.execute(
+            "SELECT student_id, course_id FROM attendance_alerts WHERE sent_at >= ?", (cutoff,))}
+
+    due = []
+    for name in context["databases"]:
+        with _connect(context, name) as conn:
+            due += [r for r in conn.execute("""
+                SELECT sm.student_id, sm.course_id, s.name, s.email, c.name AS course,
+                       100.0 * sm.present / (sm.present + sm.absent + sm.excused) AS rate
+                FROM attendance_summary sm
+                JOIN students s ON s.id = sm.student_id
+                JOIN courses c ON c.id = sm.course_id
+                WHERE sm.present + sm.absent + sm.excused >= ?
+                  AND 100.0 * sm.present / (sm.present + sm.absent + sm.excused) < ?
+            """, (min_marks, threshold)) if (r["student_id"], r["course_id"]) not in recent]
+
+    messages = [(r["email"], f"Low attendance in {r['course']}",
+                 f"Hello {r['name']},\n\nYour attendance in {r['course']} is {r['rate']:.1f}%, below the "
+                 f"{threshold:g}% expected. Please talk to your teacher if something is keeping you away.\n",
+                 ()) for r in due]
+    sent = 0
+    with _connect(context, MAIN) as main:
+        for r, _ in zip(due, _send(context, messages)):
+            main.execute("""
+                INSERT INTO attendance_alerts (student_id, course_id, rate, sent_at) VALUES (?,?,?,?)
+                ON CONFLICT (student_id, course_id) DO UPDATE SET rate=excluded.rate, sent_at=excluded.sent_at
+            """, (r["student_id"], r["course_id"], round(r["rate"], 1), now.isoformat(timespec="seconds")))
+            main.commit()
+            sent += 1
+    return {"below_threshold": len(due), "emails": sent, "unsent": len(messages) - sent}
+
+
+# ------------ Maintenance ------------
+def rebuild_summary(context):
+    """Recompute attendance_summary where it drifted from the attendance rows, in every database."""
+    fixed = {}
+    for name in context["databases"]:
+        with _connect(context, name, attach=False) as conn:
+            conn.execute("BEGIN")  # one snapshot for both sides of the comparison
+            pairs = [(sid, cid) for sid, cid, _, _ in check_summary(conn.cursor())]
+            conn.rollback()
+            if pairs:
+                conn.execute("BEGIN IMMEDIATE")
+                refresh_summary_pairs(conn.cursor(), pairs)
+                conn.commit()
+            fixed[name] = len(pairs)
+    return {"fixed": fixed}
+
+
+def compact_change_log(context, retention_days=30):
+    """change_log.compact_and_purge in every database."""
+    removed = {}
+    for name in context["databases"]:
+        with _connect(context, name, attach=False) as conn:
+            compacted, purged = compact_and_purge(conn.cursor(), datetime.timedelta(days=retention_days))
+            conn.commit()
+            removed[name] = {"compacted": compacted, "purged": purged}
+    return removed
+
+
+TASKS = {
+    "course_reports": course_reports,
+    "low_attendance_alerts": low_attendance_alerts,
+    "rebuild_summary": rebuild_summary,
+    "compact_change_log": compact_change_log,
+}
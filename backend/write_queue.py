@@ -0,0 +1,458 @@
+"""Durable queue for attendance marking (ATTENDANCE_WRITE_QUEUE=1).
+
+At the start of a period many teachers submit attendance within the same
+minute. With the queue on, a submission is appended to this process's
+journal file and fsynced, and the request is answered straight away; the
+database writer thread (db_writer.py) then commits whatever has queued up
+together, one savepoint per submission.
+
+Every submission has an idempotency key. The keys of committed submissions
+are stored in attendance_submissions in the same transaction as the marks,
+so a resubmitted key (a double-clicked form, a client retry, a journal
+replayed after a crash) is applied at most once.
+
+Each process writes its own journal, segment-<id>.jsonl in the journal
+directory, holding an exclusive flock on it for as long as it runs, and
+empties it whenever everything in it has been committed. At startup, a
+segment whose lock can be taken was left by a process that died; its
+entries are replayed and the file removed. When several workers start
+together, whichever takes a segment's lock first replays it and the others
+skip it once it is gone. A segment is created as new-<id> and renamed once
+locked; a new- file is only removed as the leftover of a dead process once
+it is NEW_SEGMENT_GRACE seconds old, since a younger one may be a process
+starting up that has not locked it yet. flock makes this POSIX-only.
+
+With a shard map (shards.py) each submission names the database its
+courses live in and goes to that database's writer.
+
+A submission that cannot be committed (after MAX_ATTEMPTS on a busy
+database, or at once for any other error) is appended to dead-letters.jsonl
+in the journal directory, with its error, before it leaves the journal. It
+stays there, listed on the Mark Attendance page and counted in /health,
+until it is replayed or discarded:
+
+    python backend/write_queue.py list
+    python backend/write_queue.py replay
+    python backend/write_queue.py discard teacher-3:abc123
+
+If the dead-letter journal cannot be written either (disk full), the
+process keeps its own journal from then on instead of emptying it, so the
+entry is replayed at the next start.
+
+Marks waiting in the queue are kept in memory until they are committed, so
+pages rendered by the same process can show them (pending()). Other worker
+processes only see them once they are committed.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from flask import current_app
+
+from analytics import invalidate_frames
+from attendance import save_marks
+from db_setup import DB_PATH
+from page_cache import bump, courses as course_scopes
+from shards import MAIN, ShardMap
+
+# Committed keys are remembered this long, so a retry within it is still recognised.
+SUBMISSION_RETENTION = datetime.timedelta(days=7)
+# Submissions that fail on a busy/locked database are retried this many times.
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 1.0
+DEAD_LETTERS = "dead-letters.jsonl"
+NEW_SEGMENT_GRACE = 60.0  # seconds before an unrenamed new- file counts as left by a dead process
+
+
+def apply_submission(cur, entry):
+    """Writer job: save a queued submission unless its key was already committed."""
+    row = cur.execute("SELECT result FROM attendance_submissions WHERE key=?", (entry["key"],)).fetchone()
+    if row:
+        return json.loads(row[0])
+    results = save_marks(cur, entry["batches"])
+    now = datetime.datetime.now()
+    cur.execute("INSERT INTO attendance_submissions (key, committed_at, result) VALUES (?,?,?)",
+                (entry["key"], now.isoformat(timespec="seconds"), json.dumps(results)))
+    if random.random() < 0.01:
+        cur.execute("DELETE FROM attendance_submissions WHERE committed_at < ?",
+                    ((now - SUBMISSION_RETENTION).isoformat(timespec="seconds"),))
+    return results
+
+
+def committed_result(conn, key):
+    """The stored results of a committed submission, or None."""
+    row = conn.execute("SELECT result FROM attendance_submissions WHERE key=?", (key,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+# ------------ Dead letters ------------
+def read_dead_letters(journal_dir):
+    """Entries that failed to commit, oldest first, each with its "error" and "failed_at"."""
+    try:
+        with open(os.path.join(journal_dir, DEAD_LETTERS), "rb") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return []
+    entries = []
+    for line in lines:
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue  # being appended right now
+    return entries
+
+
+def add_dead_letters(journal_dir, failures):
+    """Append (entry, error) pairs to the dead-letter journal and fsync it."""
+    now = time.time()
+    data = b"".join(json.dumps({**entry, "error": repr(error), "failed_at": now}).encode() + b"\n"
+                    for entry, error in failures)
+    with open(os.path.join(journal_dir, DEAD_LETTERS), "ab") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def rewrite_dead_letters(journal_dir, fn):
+    """Replace the dead letters with fn(entries), holding the journal's lock throughout."""
+    with open(os.path.join(journal_dir, DEAD_LETTERS), "a+b") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        f.seek(0)
+        entries = [json.loads(line) for line in f if line.strip()]
+        keep = fn(entries)
+        f.seek(0)
+        f.truncate()
+        f.write(b"".join(json.dumps(entry).encode() + b"\n" for entry in keep))
+        f.flush()
+        os.fsync(f.fileno())
+    return keep
+
+
+class WriteQueue:
+    def __init__(self, writers, journal_dir, fsync=True, on_commit=None, on_fail=None):
+        if fcntl is None:
+            raise RuntimeError("the attendance write queue needs fcntl (POSIX)")
+        os.makedirs(journal_dir, exist_ok=True)
+        self.writers = writers  # database name -> DatabaseWriter
+        self.journal_dir = journal_dir
+        self.fsync = fsync
+        self.on_commit = on_commit
+        self.on_fail = on_fail
+        self._lock = threading.Lock()
+        self._pending = {}  # key -> entry, oldest first
+        self._accepted = 0
+        self._duplicates = 0
+        self._committed = 0
+        self._retries = 0
+        self._failed = 0
+        self._keep_journal = False
+        self._last_error = None
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+        # Lock the segment before giving it the name other processes look for,
+        # so none of them can take it for an orphan.
+        name = uuid.uuid4().hex
+        tmp = os.path.join(journal_dir, f"new-{name}")
+        self._journal = open(tmp, "ab")
+        fcntl.flock(self._journal.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.journal_path = os.path.join(journal_dir, f"segment-{name}.jsonl")
+        os.rename(tmp, self.journal_path)
+        self._replayed = self._recover()
+
+    # ------------ Submitting ------------
+    def submit(self, conn, key, batches, shard=MAIN):
+        """Accept a submission for one database. Returns (state, results).
+
+        `conn` is a connection to that database, used to look the key up.
+
+        state is "queued" once the entry is in the journal, "pending" when the
+        key is already waiting in this process, or "committed" with the
+        stored results when the key was committed before.
+        """
+        with self._lock:
+            if key in self._pending:
+                self._duplicates += 1
+                return "pending", None
+        results = committed_result(conn, key)
+        if results is not None:
+            with self._lock:
+                self._duplicates += 1
+            return "committed", results
+
+        entry = {"key": key, "shard": shard, "received": time.time(), "attempts": 0, "batches": batches}
+        line = json.dumps(entry).encode() + b"\n"
+        with self._lock:
+            if key in self._pending:
+                self._duplicates += 1
+                return "pending", None
+            self._journal.write(line)
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self._pending[key] = entry
+            self._accepted += 1
+        self._enqueue(entry)
+        return "queued", None
+
+    def pending(self, course_id, date=None):
+        """{date: {student_id: status}} of this course's marks not yet committed."""
+        with self._lock:
+            entries = list(self._pending.values())
+        marks = {}
+        for entry in entries:
+            for batch in entry["batches"]:
+                if batch["course_id"] == course_id and date in (None, batch["date"]):
+                    marks.setdefault(batch["date"], {}).update(
+                        {int(sid): status for sid, status in batch["statuses"].items() if str(sid).isdigit()})
+        return marks
+
+    def failed(self, course_id):
+        """[(date, marks, error)] of this course's submissions in the dead-letter journal."""
+        return [(batch.get("date"), len(batch.get("statuses") or {}), entry["error"])
+                for entry in read_dead_letters(self.journal_dir)
+                for batch in entry.get("batches") or [] if batch.get("course_id") == course_id]
+
+    def _enqueue(self, entry):
+        entry["attempts"] += 1
+        self._writer(entry).submit(apply_submission, entry).add_done_callback(lambda f: self._done(entry, f))
+
+    def _done(self, entry, future):
+        # Runs on the writer thread once the entry's batch has committed (or failed).
+        error = future.exception()
+        if isinstance(error, sqlite3.OperationalError) and entry["attempts"] < MAX_ATTEMPTS:
+            with self._lock:
+                self._retries += 1
+            threading.Timer(RETRY_DELAY * entry["attempts"], self._enqueue, (entry,)).start()
+            return
+        lost = None
+        if error is not None:
+            # Kept before the entry can be truncated away with the journal.
+            try:
+                add_dead_letters(self.journal_dir, [(entry, error)])
+            except Exception as e:
+                lost = e
+        latency = time.time() - entry["received"]
+        with self._lock:
+            self._pending.pop(entry["key"], None)
+            if error is None:
+                self._committed += 1
+            else:
+                self._failed += 1
+                self._last_error = f"{entry['key']}: {error!r}"
+                if lost is not None:
+                    # The journal's copy is the only one left: keep it for the next start to replay.
+                    self._keep_journal = True
+                    self._last_error += f" (not dead-lettered: {lost!r})"
+            self._latency_total += latency
+            self._latency_max = max(self._latency_max, latency)
+            if not self._pending and not self._keep_journal:
+                # Everything in the journal is committed or dead-lettered; start it over.
+                os.ftruncate(self._journal.fileno(), 0)
+        callback = self.on_commit if error is None else self.on_fail
+        if callback is not None:
+            callback({batch["course_id"] for batch in entry["batches"]})
+
+    # ------------ Recovery ------------
+    def _recover(self):
+        """Replay segments left behind by processes that died; returns the entries replayed."""
+        replayed = 0
+        for name in sorted(os.listdir(self.journal_dir)):
+            path = os.path.join(self.journal_dir, name)
+            if not name.startswith(("segment-", "new-")) or path == self.journal_path:
+                continue
+            if name.startswith("new-"):
+                # Died before writing anything, unless it is another process starting up right now.
+                with contextlib.suppress(FileNotFoundError):
+                    if time.time() - os.stat(path).st_mtime > NEW_SEGMENT_GRACE:
+                        os.remove(path)
+                continue
+            try:
+                f = open(path, "rb")
+            except FileNotFoundError:
+                continue  # another process starting up replayed it first
+            with f:
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue  # a live process owns it
+                if os.fstat(f.fileno()).st_nlink == 0:
+                    continue  # replayed and removed by another process between our open and flock
+                entries = []
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        break  # the last append was cut short by the crash
+                try:
+                    futures = [self._writer(entry).submit(apply_submission, entry) for entry in entries]
+                except KeyError as e:
+                    # The shard map no longer names this database; leave the segment for the next start.
+                    self._last_error = f"replaying {name}: unknown database {e}"
+                    continue
+                errors = [future.exception() for future in futures]
+                if any(isinstance(e, sqlite3.OperationalError) for e in errors):
+                    # Busy or locked: leave the segment for the next start rather than lose marks.
+                    self._last_error = f"replaying {name}: {next(e for e in errors if e)!r}"
+                    continue
+                failures = [(entry, e) for entry, e in zip(entries, errors) if e]
+                if failures:
+                    add_dead_letters(self.journal_dir, failures)
+                    self._failed += len(failures)
+                    self._last_error = f"replaying {name}: {failures[-1][1]!r}"
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+                committed = [entry for entry, e in zip(entries, errors) if not e]
+                replayed += len(committed)
+                if committed and self.on_commit is not None:
+                    self.on_commit({b["course_id"] for entry in committed for b in entry["batches"]})
+        return replayed
+
+    def _writer(self, entry):
+        return self.writers[entry.get("shard", MAIN)]
+
+    def close(self, timeout=10.0):
+        """Wait up to `timeout` seconds for pending entries, then close the journal.
+
+        An empty journal is removed; one with entries left is replayed at the
+        next start.
+        """
+        deadline = time.monotonic() + timeout
+        while self.stats()["depth"] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        with self._lock:
+            if not self._pending and not self._keep_journal:
+                os.remove(self.journal_path)
+            self._journal.close()
+
+    def stats(self):
+        with self._lock:
+            done = self._committed + self._failed
+            return {
+                "depth": len(self._pending),
+                "accepted": self._accepted,
+                "duplicates": self._duplicates,
+                "committed": self._committed,
+                "retries": self._retries,
+                "failed": self._failed,
+                "replayed": self._replayed,
+                "commit_latency_mean": round(self._latency_total / done, 6) if done else 0.0,
+                "commit_latency_max": round(self._latency_max, 6),
+                "journal_bytes": os.fstat(self._journal.fileno()).st_size if not self._journal.closed else 0,
+                "dead_letters": len(read_dead_letters(self.journal_dir)),
+                "last_error": self._last_error,
+            }
+
+
+def write_queue_stats():
+    queue = current_app.extensions.get("write_queue")
+    return queue.stats() if queue is not None else None
+
+
+def init_app(app):
+    """Start the queue (and replay orphaned journals) when WRITE_QUEUE is set; needs the db writer."""
+    if not app.config["WRITE_QUEUE"]:
+        return
+
+    def committed(course_ids):
+        with app.app_context():
+            invalidate_frames(course_ids)
+            bump(*course_scopes(course_ids))
+
+    def failed(course_ids):
+        # Pages showing the marks as "being saved" now show them as failed.
+        with app.app_context():
+            bump(*course_scopes(course_ids))
+
+    writers = {name: database.writer for name, database in app.extensions["databases"].items()}
+    app.extensions["write_queue"] = WriteQueue(writers, app.config["WRITE_QUEUE_DIR"],
+                                               fsync=app.config["WRITE_QUEUE_FSYNC"],
+                                               on_commit=committed, on_fail=failed)
+
+
+# ------------ CLI ------------
+def replay_dead_letters(journal_dir, databases):
+    """Commit what can be of the dead letters; returns (committed, still failing).
+
+    `databases` maps database names to files. Each entry is applied in its
+    own transaction, and keys already committed are skipped as usual.
+    """
+    committed = []
+
+    def replay(entries):
+        keep = []
+        for entry in entries:
+            path = databases.get(entry.get("shard", MAIN))
+            if path is None:
+                keep.append({**entry, "error": f"unknown database {entry.get('shard')!r}", "failed_at": time.time()})
+                continue
+            conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                apply_submission(conn.cursor(), entry)
+                conn.execute("COMMIT")
+                committed.append(entry)
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                keep.append({**entry, "error": repr(e), "failed_at": time.time()})
+            finally:
+                conn.close()
+        return keep
+    keep = rewrite_dead_letters(journal_dir, replay)
+    return committed, keep
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List, replay or discard attendance submissions that failed.")
+    parser.add_argument("--dir", default=os.environ.get("ATTENDANCE_WRITE_QUEUE_DIR")
+                        or os.path.join(os.path.dirname(DB_PATH), "write-queue"), help="journal directory")
+    parser.add_argument("--db", default=DB_PATH, help="main database file")
+    parser.add_argument("--shard-map", default=os.environ.get("ATTENDANCE_SHARD_MAP"), help="shard map (JSON)")
+    sub = parser.add_subparsers(dest="action", required=True)
+    sub.add_parser("list", help="failed submissions with their errors")
+    sub.add_parser("replay", help="commit them again; those that still fail are kept")
+    sub.add_parser("discard", help="drop a failed submission").add_argument("key")
+    args = parser.parse_args(argv)
+
+    def describe(entry):
+        batches = ", ".join(f"course {b.get('course_id')} {b.get('date')} ({len(b.get('statuses') or {})} marks)"
+                            for b in entry.get("batches") or [])
+        failed_at = datetime.datetime.fromtimestamp(entry["failed_at"]).isoformat(timespec="seconds")
+        return f"{entry['key']}  {failed_at}  {batches}\n    {entry['error']}"
+
+    if args.action == "list":
+        for entry in read_dead_letters(args.dir):
+            print(describe(entry))
+    elif args.action == "replay":
+        databases = {MAIN: args.db, **(ShardMap.load(args.shard_map).paths if args.shard_map else {})}
+        committed, keep = replay_dead_letters(args.dir, databases)
+        print(f"✅ {len(committed)} committed, {len(keep)} still failing")
+        for entry in keep:
+            print(describe(entry))
+    else:
+        def discard(entries):
+            keep = [entry for entry in entries if entry["key"] != args.key]
+            if len(keep) == len(entries):
+                parser.error(f"no failed submission with key {args.key!r}")
+            return keep
+        rewrite_dead_letters(args.dir, discard)
+        print(f"✅ discarded {args.key}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
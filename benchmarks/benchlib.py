@@ -0,0 +1,29 @@
+"""Shared helpers for the benchmark scripts."""
+import os
+import statistics
+import sys
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+BACKEND = os.path.join(ROOT, "backend")
+DEFAULT_DB = os.path.join(ROOT, "database", "attendance.db")
+
+if BACKEND not in sys.path:
+    sys.path.insert(0, BACKEND)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def summarize(latencies, wall, errors=0):
+    """Throughput and latency percentiles (ms) for one benchmark run."""
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / wall, 1) if wall else 0.0,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
@@ -0,0 +1,118 @@
+"""On-disk size and read latency: attendance rows vs attendance_bitmaps.
+
+Works on a scratch copy of the database, building the bitmaps there if the
+source has none. Reports the pages used by `attendance` plus its indexes
+against `attendance_bitmaps` (from SQLite's dbstat table), then times two
+reads both ways: one student's history in a course (student_view_attendance)
+and every record of a course (export, analytics).
+
+    python benchmarks/datagen.py -o /tmp/bench.db
+    python benchmarks/bitmap_bench.py --db /tmp/bench.db
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from benchlib import DEFAULT_DB, summarize
+from bitmaps import bitmap_history, bitmaps_enabled, build_bitmaps, term_dates
+
+ROW_TABLES = ("attendance", "idx_attendance_course_date", "ux_attendance_student_course_date")
+
+
+def table_sizes(conn):
+    """Bytes per table/index, or None when SQLite was built without dbstat."""
+    try:
+        return dict(conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name").fetchall())
+    except sqlite3.OperationalError:
+        return None
+
+
+def rows_history(cur, student_id, course_id):
+    cur.execute("SELECT date, status FROM attendance WHERE student_id=? AND course_id=? ORDER BY date DESC",
+                (student_id, course_id))
+    return cur.fetchall()
+
+
+def rows_course(cur, course_id):
+    cur.execute("SELECT student_id, date, status FROM attendance WHERE course_id=?", (course_id,))
+    return cur.fetchall()
+
+
+def bitmap_course(cur, course_id):
+    cur.execute("SELECT student_id, term, days FROM attendance_bitmaps WHERE course_id=?", (course_id,))
+    return [(sid, date, status) for sid, term, days in cur.fetchall() for date, status in term_dates(term, days)]
+
+
+def timed(fn, args_list):
+    latencies = []
+    start = time.perf_counter()
+    for args in args_list:
+        t = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare attendance rows with the bitmap format.")
+    parser.add_argument("--db", default=DEFAULT_DB, help="database to copy for the run")
+    parser.add_argument("--samples", type=int, default=2000, help="student histories to read")
+    parser.add_argument("--courses", type=int, default=20, help="whole courses to read")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    scratch = tempfile.mkdtemp()
+    try:
+        db = os.path.join(scratch, "bench.db")
+        source = sqlite3.connect(args.db)
+        source.execute(f"VACUUM INTO '{db}'")  # compact copy, so sizes are not inflated by free pages
+        source.close()
+        conn = sqlite3.connect(db)
+        cur = conn.cursor()
+        if not bitmaps_enabled(cur):
+            started = time.perf_counter()
+            blobs, encoded, skipped = build_bitmaps(cur)
+            conn.commit()
+            print(f"Built {blobs:,} bitmaps from {encoded:,} records in {time.perf_counter() - started:.1f}s"
+                  + (f" ({skipped:,} skipped)" if skipped else ""))
+            conn.execute("VACUUM")
+
+        sizes = table_sizes(conn)
+        if sizes is None:
+            print("dbstat is not available in this SQLite build; skipping sizes.")
+        else:
+            rows = sum(sizes.get(name, 0) for name in ROW_TABLES)
+            bitmaps = sizes.get("attendance_bitmaps", 0)
+            print(f"\n{'storage':<40} {'MB':>10}")
+            for name in ROW_TABLES:
+                print(f"  {name:<38} {sizes.get(name, 0) / 1e6:>10.1f}")
+            print(f"{'rows + indexes':<40} {rows / 1e6:>10.1f}")
+            print(f"{'attendance_bitmaps':<40} {bitmaps / 1e6:>10.1f}   ({rows / max(bitmaps, 1):.0f}x smaller)")
+
+        rng = random.Random(args.seed)
+        pairs = conn.execute("SELECT student_id, course_id FROM student_courses").fetchall()
+        histories = [(cur, *p) for p in rng.choices(pairs, k=args.samples)]
+        course_ids = [r[0] for r in conn.execute("SELECT id FROM courses").fetchall()]
+        courses = [(cur, c) for c in rng.choices(course_ids, k=args.courses)]
+
+        sample = histories[0][1:]
+        assert [tuple(r) for r in rows_history(cur, *sample)] == bitmap_history(cur, *sample), "formats disagree"
+
+        print(f"\n{'read':<40} {'p50 ms':>10} {'p99 ms':>10} {'mean ms':>10}")
+        for label, fn, calls in (("student history, rows", rows_history, histories),
+                                 ("student history, bitmaps", bitmap_history, histories),
+                                 ("whole course, rows", rows_course, courses),
+                                 ("whole course, bitmaps", bitmap_course, courses)):
+            stats = timed(fn, calls)
+            print(f"{label:<40} {stats['p50_ms']:>10.3f} {stats['p99_ms']:>10.3f} {stats['mean_ms']:>10.3f}")
+        conn.close()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
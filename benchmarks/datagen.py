@@ -0,0 +1,174 @@
+"""Generate a synthetic attendance database for benchmarks and load tests.
+
+Builds a fresh database with the current schema, then fills it with
+teachers, courses, students, enrollments and one attendance record per
+enrolled student per weekday. Row counts are roughly
+
+    attendance = students * courses_per_student * weekdays(years)
+
+so the defaults (2,000 students x 4 courses x 1 year) give ~2M rows and
+`--students 40000 --courses-per-student 5 --years 1` gives ~52M.
+
+    python benchmarks/datagen.py -o /tmp/bench.db
+    python benchmarks/datagen.py -o /tmp/big.db --students 40000 --courses-per-student 5
+
+Every generated account uses the password "password" (hashed once with
+--password-method). Teachers are teacher<N>@example.edu and students
+student<N>@example.edu, numbered from 1.
+
+Secondary indexes are dropped during the load and rebuilt afterwards, which
+is much faster than maintaining them row by row.
+"""
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import sys
+import time
+
+import benchlib  # noqa: F401  (puts backend/ on sys.path)
+from attendance import rebuild_summary
+from db_setup import migrate
+from passwords import DEFAULT_METHOD
+from werkzeug.security import generate_password_hash
+
+PASSWORD = "password"
+BATCH = 50000
+STATUSES = ("Present", "Absent", "Excused")
+
+
+def school_days(start, years):
+    """Weekdays from `start` for `years` years."""
+    end = start + datetime.timedelta(days=round(365.25 * years))
+    day = start
+    while day < end:
+        if day.weekday() < 5:
+            yield day.isoformat()
+        day += datetime.timedelta(days=1)
+
+
+def attendance_indexes(conn):
+    """(name, sql) of the explicitly created indexes on attendance."""
+    return conn.execute("""
+        SELECT name, sql FROM sqlite_master
+        WHERE type='index' AND tbl_name='attendance' AND sql IS NOT NULL
+    """).fetchall()
+
+
+def change_log_triggers(conn):
+    """(name, sql) of the triggers that write the change log."""
+    return conn.execute("SELECT name, sql FROM sqlite_master WHERE type='trigger' AND name LIKE 'change_log_%'").fetchall()
+
+
+def generate(conn, args, log=print):
+    rng = random.Random(args.seed)
+    cur = conn.cursor()
+    # Generated data is the starting state, not a stream of changes: keep it out of the change log.
+    triggers = change_log_triggers(conn)
+    for name, _ in triggers:
+        cur.execute(f"DROP TRIGGER {name}")
+    password = generate_password_hash(PASSWORD, args.password_method)
+
+    cur.executemany("INSERT INTO courses (id, name) VALUES (?,?)",
+                    [(c, f"Course {c}") for c in range(1, args.courses + 1)])
+    cur.executemany("INSERT INTO teachers (id, name, email, password) VALUES (?,?,?,?)",
+                    [(t, f"Teacher {t}", f"teacher{t}@example.edu", password) for t in range(1, args.teachers + 1)])
+    # Every course gets a teacher; teachers share the rest round-robin.
+    cur.executemany("INSERT INTO teacher_courses (teacher_id, course_id) VALUES (?,?)",
+                    [((c - 1) % args.teachers + 1, c) for c in range(1, args.courses + 1)])
+    cur.executemany("INSERT INTO students (id, name, email, password) VALUES (?,?,?,?)",
+                    [(s, f"Student {s}", f"student{s}@example.edu", password) for s in range(1, args.students + 1)])
+
+    per_student = min(args.courses_per_student, args.courses)
+    enrollments = {c: [] for c in range(1, args.courses + 1)}
+    for s in range(1, args.students + 1):
+        for c in rng.sample(range(1, args.courses + 1), per_student):
+            enrollments[c].append(s)
+    cur.executemany("INSERT INTO student_courses (student_id, course_id) VALUES (?,?)",
+                    [(s, c) for c, students in enrollments.items() for s in students])
+    conn.commit()
+    log(f"  {args.teachers} teachers, {args.courses} courses, {args.students} students, "
+        f"{args.students * per_student} enrollments")
+
+    # Each student has their own absence rate so per-student summaries vary.
+    absence = {s: min(0.9, rng.expovariate(1 / args.absent_rate)) for s in range(1, args.students + 1)}
+    days = list(school_days(args.start, args.years))
+
+    indexes = attendance_indexes(conn)
+    for name, _ in indexes:
+        cur.execute(f"DROP INDEX {name}")
+
+    total, started = 0, time.perf_counter()
+    batch = []
+    for course_id, students in enrollments.items():
+        for day in days:
+            for s in students:
+                r = rng.random()
+                status = "Absent" if r < absence[s] else "Excused" if r < absence[s] + args.excused_rate else "Present"
+                batch.append((s, course_id, day, status))
+            if len(batch) >= BATCH:
+                cur.executemany("INSERT INTO attendance (student_id, course_id, date, status) VALUES (?,?,?,?)", batch)
+                total += len(batch)
+                batch.clear()
+        conn.commit()
+        log(f"\r  {total:,} attendance rows ({total / (time.perf_counter() - started):,.0f}/s)", end="")
+    cur.executemany("INSERT INTO attendance (student_id, course_id, date, status) VALUES (?,?,?,?)", batch)
+    total += len(batch)
+    conn.commit()
+    log(f"\r  {total:,} attendance rows over {len(days)} days in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    for name, sql in indexes + triggers:
+        cur.execute(sql)
+    conn.commit()
+    log(f"  rebuilt {len(indexes)} indexes and {len(triggers)} triggers in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    rebuild_summary(cur)
+    cur.execute("ANALYZE")
+    conn.commit()
+    log(f"  summary and statistics in {time.perf_counter() - started:.1f}s")
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic attendance database.")
+    parser.add_argument("-o", "--output", required=True, help="database file to create")
+    parser.add_argument("--teachers", type=int, default=50)
+    parser.add_argument("--courses", type=int, default=100)
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--courses-per-student", type=int, default=4, help="enrollment density")
+    parser.add_argument("--years", type=float, default=1.0, help="years of weekday attendance")
+    parser.add_argument("--start", type=datetime.date.fromisoformat, default=datetime.date(2024, 9, 2))
+    parser.add_argument("--absent-rate", type=float, default=0.08, help="mean per-student absence rate")
+    parser.add_argument("--excused-rate", type=float, default=0.02)
+    parser.add_argument("--password-method", default=DEFAULT_METHOD)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--force", action="store_true", help="overwrite an existing output file")
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.output):
+        if not args.force:
+            sys.exit(f"{args.output} exists (use --force to overwrite)")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.output + suffix):
+                os.remove(args.output + suffix)
+
+    started = time.perf_counter()
+    conn = sqlite3.connect(args.output)
+    migrate(conn)
+    # Bulk-load settings; the file is not usable if the process dies midway anyway.
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-262144")
+    print(f"Generating {args.output}")
+    generate(conn, args, log=print)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.close()
+    print(f"Done in {time.perf_counter() - started:.1f}s, {os.path.getsize(args.output) / 1e6:,.0f} MB. "
+          f"Log in as teacher1@example.edu / student1@example.edu with password {PASSWORD!r}.")
+
+
+if __name__ == "__main__":
+    main()
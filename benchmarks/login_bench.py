@@ -0,0 +1,79 @@
+"""Login latency and throughput at several password hash costs.
+
+Runs POST /teacher/login through the Flask test client from several threads
+against a scratch copy of the database, and prints p50/p99 latency and
+logins/second for each hash method. The "cached" rows repeat the run with
+the verification cache enabled, which is what repeat logins within its TTL
+see.
+
+    python benchmarks/login_bench.py
+    python benchmarks/login_bench.py --threads 16 --logins 400 \\
+        --methods scrypt:16384:8:1 scrypt:32768:8:1 pbkdf2:sha256:600000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchlib import DEFAULT_DB, summarize
+
+DEFAULT_METHODS = ["pbkdf2:sha256:100000", "pbkdf2:sha256:600000", "scrypt:16384:8:1", "scrypt:32768:8:1"]
+EMAIL, PASSWORD = "teacher@example.com", "password123"
+
+
+def run(app_module, logins, threads):
+    """Return per-login latencies in seconds and total wall time."""
+    def login(_):
+        client = app_module.app.test_client()
+        start = time.perf_counter()
+        response = client.post("/teacher/login", data={"email": EMAIL, "password": PASSWORD})
+        elapsed = time.perf_counter() - start
+        if response.status_code != 302:
+            raise RuntimeError(f"login failed with status {response.status_code}")
+        return elapsed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        latencies = list(executor.map(login, range(logins)))
+    return latencies, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--methods", nargs="+", default=DEFAULT_METHODS)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--workers", type=int, default=None, help="KDF pool size (default: app default)")
+    parser.add_argument("--db", default=DEFAULT_DB, help="database to copy for the run")
+    args = parser.parse_args(argv)
+
+    scratch = tempfile.mkdtemp()
+    os.environ["ATTENDANCE_DB_PATH"] = os.path.join(scratch, "bench.db")
+    shutil.copy(args.db, os.environ["ATTENDANCE_DB_PATH"])
+    try:
+        import app as app_module
+        from passwords import PasswordHasher
+
+        print(f"{'method':<24} {'cache':<7} {'p50 ms':>8} {'p99 ms':>8} {'logins/s':>9}")
+        for method in args.methods:
+            for cached in (False, True):
+                hasher = PasswordHasher(method, args.workers, cache_ttl=300 if cached else 0)
+                with app_module.app.app_context():
+                    conn = app_module.get_db_connection()
+                    conn.execute("UPDATE teachers SET password=? WHERE email=?", (hasher.hash(PASSWORD), EMAIL))
+                    conn.commit()
+                app_module.app.extensions["passwords"] = hasher
+                if cached:
+                    run(app_module, 1, 1)  # prime the cache
+                stats = summarize(*run(app_module, args.logins, args.threads))
+                hasher.shutdown()
+                print(f"{method:<24} {'yes' if cached else 'no':<7} "
+                      f"{stats['p50_ms']:>8.1f} {stats['p99_ms']:>8.1f} {stats['rps']:>9.1f}")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
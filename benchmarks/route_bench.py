@@ -0,0 +1,253 @@
+"""Throughput and latency for every route in backend/app.py and the JSON API.
+
+Requests go through the Flask test client in-process (default), or over
+HTTP to a running server with --url. Each route is hit --requests times from
+--concurrency threads, each logged in as the teacher or student the route
+needs. Results (requests/s, p50/p95/p99 ms) print as a table and can be
+saved as a baseline and compared against later runs:
+
+    python benchmarks/datagen.py -o /tmp/bench.db
+    python benchmarks/route_bench.py --db /tmp/bench.db --save baseline.json
+    python benchmarks/route_bench.py --db /tmp/bench.db --compare baseline.json
+
+    python backend/app.py &        # with ATTENDANCE_DB_PATH=/tmp/bench.db
+    python benchmarks/route_bench.py --db /tmp/bench.db --url http://127.0.0.1:5000
+
+Only read routes run by default; --writes adds the marking and editing
+routes, which modify the database.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import sqlite3
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from benchlib import DEFAULT_DB, summarize
+
+PASSWORD = "password"
+# Sent with every request, as a browser would; bodies are read but not decoded.
+BROWSER_HEADERS = {"Accept-Encoding": "gzip"}
+
+# Endpoints that are deliberately not benchmarked.
+SKIPPED = {"static", "metrics", "metrics_profiles", "teacher_signup", "student_signup", "update_student",
+           "api_v1.create_session", "api_v1.delete_session"}
+
+
+def pick_ids(db):
+    """A teacher, one of their courses, an enrolled student and a recorded date."""
+    conn = sqlite3.connect(db)
+    try:
+        teacher_id, course_id = conn.execute("""
+            SELECT tc.teacher_id, tc.course_id FROM teacher_courses tc
+            JOIN student_courses sc ON sc.course_id = tc.course_id
+            GROUP BY tc.course_id ORDER BY COUNT(*) DESC LIMIT 1
+        """).fetchone()
+        student_id = conn.execute("SELECT MIN(student_id) FROM student_courses WHERE course_id=?",
+                                  (course_id,)).fetchone()[0]
+        date = conn.execute("SELECT MAX(date) FROM attendance WHERE course_id=?", (course_id,)).fetchone()[0]
+        teacher_email = conn.execute("SELECT email FROM teachers WHERE id=?", (teacher_id,)).fetchone()[0]
+        student_email = conn.execute("SELECT email FROM students WHERE id=?", (student_id,)).fetchone()[0]
+        attendance_id = conn.execute("SELECT id FROM attendance WHERE course_id=? AND date=? LIMIT 1",
+                                     (course_id, date)).fetchone()[0]
+    finally:
+        conn.close()
+    return {"teacher": teacher_id, "course": course_id, "student": student_id, "date": date,
+            "attendance_id": attendance_id, "teacher_email": teacher_email, "student_email": student_email}
+
+
+def route_table(ids, writes=False):
+    """(endpoint, role, method, path, body) for each benchmarked request."""
+    t, c, s, d = ids["teacher"], ids["course"], ids["student"], ids["date"]
+    login = {"teacher": {"email": ids["teacher_email"], "password": PASSWORD},
+             "student": {"email": ids["student_email"], "password": PASSWORD}}
+    routes = [
+        ("home", None, "GET", "/", None),
+        ("health", None, "GET", "/health", None),
+        ("logout", None, "GET", "/logout", None),
+        ("teacher_login", None, "POST", "/teacher/login", login["teacher"]),
+        ("student_login", None, "POST", "/student/login", login["student"]),
+        ("teacher_dashboard", "teacher", "GET", f"/teacher/dashboard/{t}", None),
+        ("teacher_course_students", "teacher", "GET", f"/teacher/{t}/courses/{c}/students", None),
+        ("teacher_attendance", "teacher", "GET", f"/teacher/{t}/courses/{c}/attendance", None),
+        ("edit_attendance", "teacher", "GET", f"/teacher/{t}/courses/{c}/attendance/edit?date={d}", None),
+        ("export_attendance", "teacher", "GET", f"/teacher/{t}/courses/{c}/attendance/export?start={d}&end={d}",
+         None),
+        ("teacher_analytics", "teacher", "GET", f"/teacher/{t}/courses/{c}/analytics", None),
+        ("teacher_add_student", "teacher", "GET", f"/teacher/add_student/{t}", None),
+        ("teacher_import_students", "teacher", "GET", f"/teacher/import_students/{t}", None),
+        ("edit_student_form", "teacher", "GET", f"/teacher/edit_student/{s}/{t}", None),
+        ("edit_teacher_profile", "teacher", "GET", f"/teacher/edit_profile/{t}", None),
+        ("student_dashboard", "student", "GET", f"/student/dashboard/{s}", None),
+        ("student_view_attendance", "student", "GET", f"/student/{s}/courses/{c}/attendance", None),
+        ("edit_student_profile", "student", "GET", f"/student/edit_profile/{s}", None),
+        ("api_v1.teacher_course_list", "teacher", "GET", f"/api/v1/teachers/{t}/courses", None),
+        ("api_v1.course_students", "teacher", "GET", f"/api/v1/teachers/{t}/courses/{c}/students", None),
+        ("api_v1.course_summary", "teacher", "GET", f"/api/v1/teachers/{t}/courses/{c}/summary", None),
+        ("api_v1.course_attendance_dates", "teacher", "GET", f"/api/v1/teachers/{t}/courses/{c}/attendance/dates",
+         None),
+        ("api_v1.course_attendance_for_date", "teacher", "GET",
+         f"/api/v1/teachers/{t}/courses/{c}/attendance?date={d}", None),
+        ("api_v1.course_analytics", "teacher", "GET", f"/api/v1/teachers/{t}/courses/{c}/analytics", None),
+        ("api_v1.student_course_list", "student", "GET", f"/api/v1/students/{s}/courses", None),
+        ("api_v1.student_attendance", "student", "GET", f"/api/v1/students/{s}/courses/{c}/attendance", None),
+    ]
+    if writes:
+        routes += [
+            ("teacher_attendance", "teacher", "POST", f"/teacher/{t}/courses/{c}/attendance",
+             {"date": d, f"status_{s}": "Present"}),
+            ("edit_attendance", "teacher", "POST", f"/teacher/{t}/courses/{c}/attendance/edit",
+             {"date": d, f"att_{ids['attendance_id']}": "Present"}),
+            ("api_v1.mark_attendance", "teacher", "POST", f"/api/v1/teachers/{t}/attendance",
+             {"json": {"marks": [{"course_id": c, "date": d, "statuses": {str(s): "Present"}}]}}),
+            ("api_v1.edit_course_attendance", "teacher", "PATCH", f"/api/v1/teachers/{t}/courses/{c}/attendance",
+             {"json": {"statuses": {str(ids["attendance_id"]): "Present"}}}),
+        ]
+    return routes, login
+
+
+# ------------ Clients ------------
+class TestClient:
+    """In-process requests through Flask's test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        kwargs = {"json": body["json"]} if body and "json" in body else {"data": body}
+        response = self.client.open(path, method=method, headers=BROWSER_HEADERS, **kwargs)
+        response.get_data()  # consume streamed bodies
+        return response.status_code
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpClient:
+    """Requests over HTTP with a cookie jar, so each client has its own session."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def request(self, method, path, body=None):
+        data, headers = None, dict(BROWSER_HEADERS)
+        if body and "json" in body:
+            data = json.dumps(body["json"]).encode()
+            headers["Content-Type"] = "application/json"
+        elif body:
+            data = urllib.parse.urlencode(body).encode()
+        req = urllib.request.Request(self.base_url + path, data=data, method=method, headers=headers)
+        try:
+            with self.opener.open(req) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+
+# ------------ Runner ------------
+def bench_route(make_client, login, route, requests, concurrency):
+    endpoint, role, method, path, body = route
+    clients = []
+    for _ in range(concurrency):
+        client = make_client()
+        if role:
+            client.request("POST", f"/{role}/login", login[role])
+        client.request(method, path, body)  # warm-up
+        clients.append(client)
+
+    def worker(i):
+        client, latencies, errors = clients[i], [], 0
+        for _ in range(requests // concurrency + (i < requests % concurrency)):
+            start = time.perf_counter()
+            status = client.request(method, path, body)
+            latencies.append(time.perf_counter() - start)
+            errors += status >= 400
+        return latencies, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(worker, range(concurrency)))
+    wall = time.perf_counter() - start
+    return summarize([x for lat, _ in results for x in lat], wall, sum(e for _, e in results))
+
+
+def compare(results, baseline, threshold):
+    """Print changes against a saved baseline; return the number of regressions."""
+    regressions = 0
+    print(f"\n{'route':<52} {'p50':>9} {'p99':>9} {'rps':>9}")
+    for name, now in results.items():
+        before = baseline["routes"].get(name)
+        if not before:
+            print(f"{name:<52} {'(new)':>9}")
+            continue
+        deltas = [(now[k] - before[k]) / before[k] * 100 if before[k] else 0.0 for k in ("p50_ms", "p99_ms", "rps")]
+        worse = deltas[0] > threshold or deltas[1] > threshold or deltas[2] < -threshold
+        regressions += worse
+        print(f"{name:<52} {deltas[0]:>+8.1f}% {deltas[1]:>+8.1f}% {deltas[2]:>+8.1f}%{'  REGRESSION' if worse else ''}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every app route.")
+    parser.add_argument("--db", default=DEFAULT_DB, help="database the app (or --url server) uses")
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process test client")
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--routes", help="comma-separated endpoint names to run (default: all)")
+    parser.add_argument("--writes", action="store_true", help="include routes that modify the database")
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON from an earlier --save")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    args = parser.parse_args(argv)
+
+    ids = pick_ids(args.db)
+    routes, login = route_table(ids, args.writes)
+    if args.routes:
+        wanted = set(args.routes.split(","))
+        routes = [r for r in routes if r[0] in wanted]
+
+    if args.url:
+        make_client = lambda: HttpClient(args.url)  # noqa: E731
+    else:
+        os.environ["ATTENDANCE_DB_PATH"] = args.db
+        from app import app
+        make_client = lambda: TestClient(app)  # noqa: E731
+        missing = {rule.endpoint for rule in app.url_map.iter_rules()} - SKIPPED - {r[0] for r in route_table(ids, True)[0]}
+        if missing:
+            print(f"Not benchmarked: {', '.join(sorted(missing))}", file=sys.stderr)
+
+    results = {}
+    print(f"{'route':<52} {'req':>5} {'err':>4} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route in routes:
+        name = f"{route[2]} {route[0]}"
+        stats = bench_route(make_client, login, route, args.requests, args.concurrency)
+        results[name] = stats
+        print(f"{name:<52} {stats['requests']:>5} {stats['errors']:>4} {stats['rps']:>8.1f} "
+              f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+
+    if args.save:
+        meta = {"db": os.path.abspath(args.db), "url": args.url, "requests": args.requests,
+                "concurrency": args.concurrency, "ids": ids, "created": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        with open(args.save, "w") as f:
+            json.dump({"meta": meta, "routes": results}, f, indent=2)
+        print(f"\nSaved {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            sys.exit(f"\n{regressions} route(s) regressed by more than {args.threshold}%")
+
+
+if __name__ == "__main__":
+    main()
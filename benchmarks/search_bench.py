@@ -0,0 +1,109 @@
+"""Student search: the students_fts index vs a LIKE scan.
+
+Builds a scratch database with the current schema and --students students
+with generated first/last names, spread over --courses courses, then times
+the first page of search results for random prefixes of one and two words,
+restricted to one course and to a teacher's --teacher-courses courses.
+
+    python benchmarks/search_bench.py --students 200000
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from benchlib import summarize
+from db_setup import migrate
+from search import matching_students, fts_available
+
+FIRST = ("Aarav Aditi Alex Amara Anna Arjun Ben Carlos Chloe Daniel Divya Elena Emma Ethan Fatima Grace Hana "
+         "Ivan Jack Jia Kavya Leo Liam Lucia Maya Mei Mohammed Nadia Noah Olivia Omar Priya Rahul Ravi Rosa "
+         "Sara Sofia Tom Uma Victor Wei Yusuf Zara Zoe").split()
+LAST = ("Ahmed Bauer Brown Chen Costa Das Evans Fischer Garcia Gupta Hansen Ito Iyer Jones Khan Kim Kumar "
+        "Lopez Martin Meyer Murphy Nair Nguyen Novak Okafor Patel Perez Rao Reddy Rossi Sato Schmidt Singh "
+        "Smith Tanaka Taylor Tran Walker Wang Weber Wilson Yadav Young Zhang").split()
+
+
+def populate(conn, students, courses, per_student, rng):
+    cur = conn.cursor()
+    cur.executemany("INSERT INTO courses (id, name) VALUES (?,?)", [(c, f"Course {c}") for c in range(1, courses + 1)])
+    rows = []
+    for s in range(1, students + 1):
+        first, last = rng.choice(FIRST), rng.choice(LAST)
+        rows.append((s, f"{first} {last}", f"{first}.{last}{s}@example.edu".lower(), "x"))
+    cur.executemany("INSERT INTO students (id, name, email, password) VALUES (?,?,?,?)", rows)
+    cur.executemany("INSERT INTO student_courses (student_id, course_id) VALUES (?,?)",
+                    [(s, c) for s in range(1, students + 1)
+                     for c in rng.sample(range(1, courses + 1), min(per_student, courses))])
+    cur.execute("ANALYZE")
+    conn.commit()
+
+
+def timed(fn, calls):
+    latencies = []
+    start = time.perf_counter()
+    for args in calls:
+        t = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare FTS5 student search with a LIKE scan.")
+    parser.add_argument("--students", type=int, default=100000)
+    parser.add_argument("--courses", type=int, default=200)
+    parser.add_argument("--courses-per-student", type=int, default=4)
+    parser.add_argument("--teacher-courses", type=int, default=5, help="courses searched in the teacher-wide case")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--samples", type=int, default=300, help="searches per case")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    scratch = tempfile.mkdtemp()
+    try:
+        conn = sqlite3.connect(os.path.join(scratch, "search.db"))
+        conn.row_factory = sqlite3.Row
+        migrate(conn)
+        if not fts_available(conn):
+            print("This SQLite has no FTS5; nothing to compare.")
+            return
+        started = time.perf_counter()
+        populate(conn, args.students, args.courses, args.courses_per_student, rng)
+        print(f"{args.students:,} students in {args.courses} courses, loaded in {time.perf_counter() - started:.1f}s")
+
+        def queries(words):
+            return [" ".join(rng.choice(FIRST + LAST)[:rng.randint(2, 4)] for _ in range(words))
+                    for _ in range(args.samples)]
+        cases = []
+        for words in (1, 2):
+            texts = queries(words)
+            one = [[rng.randint(1, args.courses)] for _ in texts]
+            many = [rng.sample(range(1, args.courses + 1), args.teacher_courses) for _ in texts]
+            cases.append((f"{words} word(s), one course", texts, one))
+            cases.append((f"{words} word(s), {args.teacher_courses} courses", texts, many))
+
+        limit = args.page_size + 1
+        text, ids = cases[0][1][0], cases[0][2][0]
+        assert ([r["id"] for r in matching_students(conn, text, ids, limit, None, fts=True)]
+                == [r["id"] for r in matching_students(conn, text, ids, limit, None, fts=False)]), "FTS and LIKE disagree"
+
+        print(f"\n{'search (first page)':<36} {'p50 ms':>10} {'p99 ms':>10} {'mean ms':>10}")
+        for label, texts, course_ids in cases:
+            for kind, fts in (("fts", True), ("like", False)):
+                def fn(t, c):
+                    return matching_students(conn, t, c, limit, None, fts=fts)
+                stats = timed(fn, list(zip(texts, course_ids)))
+                print(f"{label + ', ' + kind:<36} {stats['p50_ms']:>10.3f} {stats['p99_ms']:>10.3f} "
+                      f"{stats['mean_ms']:>10.3f}")
+        conn.close()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Compare the Werkzeug dev server with the ASGI serving mode under load.
+
+Starts backend/serve.py once per configuration against a scratch copy of
+the database, drives the selected routes over HTTP with route_bench's
+client, and prints requests/s and p50/p99 per route and server.
+
+    python benchmarks/datagen.py -o /tmp/bench.db
+    python benchmarks/serving_bench.py --db /tmp/bench.db
+    python benchmarks/serving_bench.py --db /tmp/bench.db --concurrency 64 --asgi-workers 1 4
+
+Needs `pip install uvicorn a2wsgi` for the ASGI runs.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchlib import BACKEND, DEFAULT_DB
+from route_bench import HttpClient, bench_route, pick_ids, route_table
+
+DEFAULT_ROUTES = ["teacher_dashboard", "teacher_attendance", "student_view_attendance", "api_v1.course_summary"]
+
+
+def start_server(port, extra, env):
+    proc = subprocess.Popen([sys.executable, os.path.join(BACKEND, "serve.py"), "--port", str(port), *extra],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server {extra} exited: {proc.stderr.read().decode()[-2000:]}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1).read()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"server {extra} did not start")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dev server vs ASGI serving benchmark.")
+    parser.add_argument("--db", default=DEFAULT_DB, help="database to copy for the runs")
+    parser.add_argument("--routes", default=",".join(DEFAULT_ROUTES), help="endpoint names (see route_bench)")
+    parser.add_argument("--writes", action="store_true", help="also run the attendance marking routes")
+    parser.add_argument("--requests", type=int, default=400, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--asgi-workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--threads", type=int, default=16, help="request threads per ASGI worker")
+    parser.add_argument("--port", type=int, default=5077)
+    args = parser.parse_args(argv)
+
+    scratch = tempfile.mkdtemp()
+    db = os.path.join(scratch, "bench.db")
+    shutil.copy(args.db, db)
+    env = {**os.environ, "ATTENDANCE_DB_PATH": db, "ATTENDANCE_SECRET_KEY": "benchmark",
+           "ATTENDANCE_SESSION_STORE": "cookie"}
+    ids = pick_ids(db)
+    routes, login = route_table(ids, args.writes)
+    wanted = set(args.routes.split(","))
+    if args.writes:
+        wanted |= {"api_v1.mark_attendance"}
+    routes = [r for r in routes if r[0] in wanted]
+
+    servers = [("dev", ["--server", "dev"])]
+    servers += [(f"asgi x{w}", ["--server", "asgi", "--workers", str(w), "--threads", str(args.threads)])
+                for w in args.asgi_workers]
+    print(f"{'server':<10} {'route':<40} {'rps':>8} {'p50 ms':>8} {'p99 ms':>8} {'err':>5}")
+    try:
+        for label, extra in servers:
+            proc = start_server(args.port, extra, env)
+            try:
+                url = f"http://127.0.0.1:{args.port}"
+                for route in routes:
+                    stats = bench_route(lambda: HttpClient(url), login, route, args.requests, args.concurrency)
+                    print(f"{label:<10} {route[2] + ' ' + route[0]:<40} {stats['rps']:>8.1f} "
+                          f"{stats['p50_ms']:>8.2f} {stats['p99_ms']:>8.2f} {stats['errors']:>5}")
+            finally:
+                proc.terminate()
+                proc.wait(10)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
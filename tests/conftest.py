@@ -0,0 +1,53 @@
+"""Shared fixtures: a freshly migrated database in a temporary directory."""
+import os
+import sqlite3
+import sys
+import tempfile
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+BACKEND = os.path.join(ROOT, "backend")
+
+if BACKEND not in sys.path:
+    sys.path.insert(0, BACKEND)
+
+# Modules read ATTENDANCE_DB_PATH when imported; keep them off database/attendance.db.
+os.environ["ATTENDANCE_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="attendance-tests-"), "unused.db")
+
+import pytest  # noqa: E402
+
+from db_setup import migrate, seed  # noqa: E402
+
+
+def connect(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """Path of a migrated, seeded database."""
+    path = str(tmp_path / "attendance.db")
+    conn = connect(path)
+    migrate(conn)
+    seed(conn.cursor())
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def db(db_path):
+    conn = connect(db_path)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def roster(db):
+    """Students 1-3 enrolled in course 1 (student 1 comes from the seed); returns their ids."""
+    db.executemany("INSERT INTO students (id, name, email, password) VALUES (?,?,?,'')",
+                   [(2, "Student Two", "student2@example.com"), (3, "Student Three", "student3@example.com")])
+    db.executemany("INSERT INTO student_courses (student_id, course_id) VALUES (?, 1)", [(2,), (3,)])
+    db.commit()
+    return [1, 2, 3]
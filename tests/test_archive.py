@@ -0,0 +1,77 @@
+import sqlite3
+
+import pytest
+
+from archive import _create_archive, archive_file, archive_term, closed_terms, is_archived
+from attendance import attendance_history, check_summary, save_attendance
+from conftest import connect
+
+OLD_TERM = "2024-07-01"
+OLD_DATES = ["2024-09-02", "2024-09-03", "2024-12-16"]
+NEW_DATES = ["2025-01-06", "2025-01-07"]
+
+
+@pytest.fixture
+def marked(db, roster):
+    cur = db.cursor()
+    for i, date in enumerate(OLD_DATES + NEW_DATES):
+        save_attendance(cur, 1, date, {1: "Present" if i % 2 else "Absent", 2: "Present", 3: "Excused"})
+    db.commit()
+
+
+def archive(db_path, tmp_path):
+    return archive_term(db_path, str(tmp_path / "archive"), OLD_TERM, batch=2, pause=0, log=lambda *a, **k: None)
+
+
+def dates(conn, schema="main"):
+    return sorted({r[0] for r in conn.execute(f"SELECT date FROM {schema}.attendance")})
+
+
+def test_closed_terms(db_path, marked):
+    assert closed_terms(db_path, "2025-01-01") == [OLD_TERM]
+    assert closed_terms(db_path, "2025-07-01") == [OLD_TERM, "2025-01-01"]
+
+
+def test_archive_moves_closed_term(db, db_path, tmp_path, marked):
+    summary_before = db.execute("SELECT * FROM attendance_summary ORDER BY student_id").fetchall()
+    assert archive(db_path, tmp_path) == len(OLD_DATES) * 3
+
+    assert dates(db) == NEW_DATES
+    archived = sqlite3.connect(tmp_path / "archive" / archive_file(db_path, OLD_TERM))
+    assert dates(archived) == OLD_DATES
+    assert db.execute("SELECT rows FROM attendance_archives WHERE term=?", (OLD_TERM,)).fetchone()[0] == 9
+    assert is_archived(db.cursor(), "2024-09-02") and not is_archived(db.cursor(), "2025-01-06")
+
+    # The summary still counts the archived rows, and the moves are not in the change feed.
+    assert db.execute("SELECT * FROM attendance_summary ORDER BY student_id").fetchall() == summary_before
+    assert check_summary(db.cursor()) == []
+    assert db.execute("SELECT COUNT(*) FROM change_log WHERE op='delete'").fetchone()[0] == 0
+
+
+def test_history_continues_into_archive(db, db_path, tmp_path, marked):
+    archive(db_path, tmp_path)
+    seen, cursor = [], None
+    while True:
+        page = attendance_history(db.cursor(), 1, 1, 2, after=cursor, archive_dir=str(tmp_path / "archive"))
+        seen += [r["date"] for r in page]  # next_cursor is set once the page is read
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    assert seen == sorted(OLD_DATES + NEW_DATES, reverse=True)
+
+
+def test_interrupted_archive_finishes_without_double_counting(db, db_path, tmp_path, marked):
+    # A crash after a batch was copied but before it was deleted leaves it in both files.
+    path = tmp_path / "archive" / archive_file(db_path, OLD_TERM)
+    path.parent.mkdir()
+    _create_archive(db, str(path))
+    db.execute("ATTACH DATABASE ? AS archive", (str(path),))
+    db.execute("INSERT INTO archive.attendance SELECT * FROM main.attendance WHERE date = ?", (OLD_DATES[0],))
+    db.commit()
+    db.execute("DETACH DATABASE archive")
+
+    assert archive(db_path, tmp_path) == 9
+    assert archive(db_path, tmp_path) == 0
+    db = connect(db_path)
+    assert db.execute("SELECT rows FROM attendance_archives WHERE term=?", (OLD_TERM,)).fetchone()[0] == 9
+    assert check_summary(db.cursor()) == []
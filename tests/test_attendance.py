@@ -0,0 +1,114 @@
+import pytest
+
+import attendance
+from attendance import (EditConflict, attendance_grid, check_summary, save_attendance, save_grid, save_marks,
+                        update_attendance_statuses)
+
+
+def summary(db, student_id, course_id=1):
+    row = db.execute("SELECT present, absent, excused, last_date FROM attendance_summary "
+                     "WHERE student_id=? AND course_id=?", (student_id, course_id)).fetchone()
+    return tuple(row) if row else None
+
+
+# ------------ Summary deltas ------------
+def test_new_marks_add_to_summary(db, roster):
+    cur = db.cursor()
+    assert save_attendance(cur, 1, "2025-01-06", {1: "Present", 2: "Absent", 3: "Excused"}) == (3, 0)
+    assert save_attendance(cur, 1, "2025-01-07", {1: "Present", 2: "Present"}) == (2, 0)
+    assert summary(db, 1) == (2, 0, 0, "2025-01-07")
+    assert summary(db, 2) == (1, 1, 0, "2025-01-07")
+    assert summary(db, 3) == (0, 0, 1, "2025-01-06")
+    assert check_summary(cur) == []
+
+
+def test_changed_marks_move_counts(db, roster):
+    cur = db.cursor()
+    save_attendance(cur, 1, "2025-01-06", {1: "Present", 2: "Absent"})
+    assert save_attendance(cur, 1, "2025-01-06", {1: "Absent", 2: "Absent", 3: "Present"}) == (1, 1)
+    assert summary(db, 1) == (0, 1, 0, "2025-01-06")
+    assert summary(db, 2) == (0, 1, 0, "2025-01-06")
+    assert check_summary(cur) == []
+
+
+def test_resaving_the_same_marks_changes_nothing(db, roster):
+    cur = db.cursor()
+    save_attendance(cur, 1, "2025-01-06", {1: "Present", 2: "Absent"})
+    assert save_attendance(cur, 1, "2025-01-06", {1: "Present", 2: "Absent"}) == (0, 0)
+    assert summary(db, 1) == (1, 0, 0, "2025-01-06")
+
+
+def test_earlier_date_keeps_last_date(db, roster):
+    cur = db.cursor()
+    save_attendance(cur, 1, "2025-01-07", {1: "Present"})
+    save_attendance(cur, 1, "2025-01-06", {1: "Absent"})
+    assert summary(db, 1) == (1, 1, 0, "2025-01-07")
+
+
+def test_edits_of_departed_students_stay_out_of_summary(db, roster):
+    cur = db.cursor()
+    save_attendance(cur, 1, "2025-01-06", {1: "Present", 3: "Present"})
+    db.execute("DELETE FROM student_courses WHERE student_id=3 AND course_id=1")
+    db.execute("DELETE FROM attendance_summary WHERE student_id=3 AND course_id=1")
+    ids = dict(db.execute("SELECT student_id, id FROM attendance WHERE course_id=1").fetchall())
+    assert update_attendance_statuses(cur, 1, {ids[1]: "Absent", ids[3]: "Absent"}) == 2
+    assert summary(db, 1) == (0, 1, 0, "2025-01-06")
+    assert summary(db, 3) is None
+    assert check_summary(cur) == []
+
+
+def test_save_marks_skips_students_not_enrolled(db, roster):
+    results = save_marks(db.cursor(), [{"course_id": 1, "date": "2025-01-06",
+                                        "statuses": {"1": "Present", "9": "Present", "x": "Absent"}}])
+    assert results == [{"course_id": 1, "date": "2025-01-06", "inserted": 1, "updated": 0, "skipped": ["9", "x"]}]
+    assert summary(db, 9) is None
+
+
+# ------------ Grid conflicts ------------
+def grid(db):
+    return {s["id"]: s["statuses"] for s in attendance_grid(db.cursor(), 1, "2025-01-01", "2025-01-31")[1]}
+
+
+def test_grid_saves_changed_cells(db, roster):
+    cur = db.cursor()
+    save_attendance(cur, 1, "2025-01-06", {1: "Present", 2: "Absent"})
+    cells = [(1, "2025-01-06", "Present", "Absent"), (2, "2025-01-06", "Absent", "Absent"),
+             (3, "2025-01-06", None, "Excused"), (9, "2025-01-06", None, "Present")]
+    assert save_grid(cur, 1, cells) == (1, 1)
+    assert grid(db)[1] == {"2025-01-06": "Absent"} and grid(db)[3] == {"2025-01-06": "Excused"}
+    assert check_summary(cur) == []
+
+
+def test_grid_conflict_saves_nothing(db, roster):
+    cur = db.cursor()
+    save_attendance(cur, 1, "2025-01-06", {1: "Present"})
+    # Someone else marks student 1 absent and student 2 present after the editor loaded the grid.
+    save_attendance(cur, 1, "2025-01-06", {1: "Absent", 2: "Present"})
+    before = grid(db)
+    with pytest.raises(EditConflict) as e:
+        save_grid(cur, 1, [(1, "2025-01-06", "Present", "Excused"), (2, "2025-01-06", None, "Absent"),
+                           (3, "2025-01-06", None, "Present")])
+    assert e.value.conflicts == [
+        {"student_id": 1, "date": "2025-01-06", "was": "Present", "now": "Absent", "status": "Excused"},
+        {"student_id": 2, "date": "2025-01-06", "was": None, "now": "Present", "status": "Absent"},
+    ]
+    assert grid(db) == before
+
+
+def test_grid_conflict_found_by_the_upsert(db, roster, monkeypatch):
+    # A caller that read the cells before another write landed: the upsert's own check catches it.
+    cur = db.cursor()
+    save_attendance(cur, 1, "2025-01-06", {1: "Present"})
+    db.commit()
+    stale = {(1, "2025-01-06"): "Present"}
+    current = attendance._current_statuses
+    reads = iter([lambda *a: stale, current])
+    monkeypatch.setattr(attendance, "_current_statuses", lambda *a: next(reads)(*a))
+    save_attendance(cur, 1, "2025-01-06", {1: "Absent"})
+    db.commit()
+    with pytest.raises(EditConflict) as e:
+        save_grid(cur, 1, [(1, "2025-01-06", "Present", "Excused"), (2, "2025-01-06", None, "Present")])
+    db.rollback()
+    assert [(c["student_id"], c["now"]) for c in e.value.conflicts] == [(1, "Absent")]
+    assert grid(db) == {1: {"2025-01-06": "Absent"}, 2: {}, 3: {}}
+    assert check_summary(cur) == []
@@ -0,0 +1,14 @@
+import pytest
+
+from db_setup import MIGRATIONS, QUERY_PLAN_CHECKS, check_query_plans, migrate, schema_version
+
+
+def test_migrations_apply_once(db):
+    assert schema_version(db) == MIGRATIONS[-1][0]
+    assert migrate(db) == []
+
+
+@pytest.mark.parametrize("label,index", [(label, index) for label, _, index in QUERY_PLAN_CHECKS])
+def test_query_uses_its_index(db, label, index):
+    failures = dict(check_query_plans(db))
+    assert label not in failures, f"{label} should use {index}: {failures.get(label)}"
@@ -0,0 +1,63 @@
+import pytest
+
+import roster_import
+from roster_import import import_roster, job_progress
+
+ROWS = [{"name": f"New {i}", "email": f"new{i}@example.com", "password": "pw", "courses": "1;2"} for i in range(5)]
+
+
+def plain(passwords):
+    return list(passwords)
+
+
+def in_course_2(course_id):
+    return course_id == 2
+
+
+def enrollments(db, course_id):
+    """Imported students enrolled in the course in this file."""
+    return db.execute("""
+        SELECT COUNT(*) FROM student_courses sc JOIN students s ON s.id = sc.student_id
+        WHERE sc.course_id=? AND s.email LIKE 'new%'
+    """, (course_id,)).fetchone()[0]
+
+
+def test_import_enrolls_and_clears_progress(db):
+    report = import_roster(db, iter(ROWS), "roster", batch_size=2, hash_passwords=plain)
+    assert (report.students_created, report.enrollments_created, report.batches) == (5, 10, 3)
+    assert enrollments(db, 2) == 5
+    assert job_progress(db, "roster") == 0
+
+
+def test_other_files_are_enrolled_only_after_the_batch_commits(db, monkeypatch):
+    sent = []
+
+    def broken(cur, pairs):
+        raise RuntimeError("batch failed")
+    monkeypatch.setattr(roster_import, "refresh_summary_pairs", broken)
+    with pytest.raises(RuntimeError):
+        import_roster(db, iter(ROWS), "roster", hash_passwords=plain, elsewhere=in_course_2,
+                      enroll_elsewhere=lambda pairs: sent.append(pairs) or len(pairs))
+    db.rollback()
+    assert sent == []
+    assert db.execute("SELECT COUNT(*) FROM students WHERE email LIKE 'new%'").fetchone()[0] == 0
+
+
+def test_failed_enrollment_elsewhere_redoes_the_batch(db):
+    sent = []
+
+    def shard_down(pairs):
+        raise OSError("shard unavailable")
+    with pytest.raises(OSError):
+        import_roster(db, iter(ROWS), "roster", batch_size=2, hash_passwords=plain,
+                      elsewhere=in_course_2, enroll_elsewhere=shard_down)
+    # The first batch's students are committed, but its progress is not.
+    assert job_progress(db, "roster") == 0
+
+    report = import_roster(db, iter(ROWS), "roster", batch_size=2, hash_passwords=plain,
+                           elsewhere=in_course_2, enroll_elsewhere=lambda pairs: sent.append(pairs) or len(pairs))
+    assert report.rows_skipped == 0 and report.students_created == 3
+    assert {sid for batch in sent for sid, _ in batch} == {r[0] for r in db.execute(
+        "SELECT id FROM students WHERE email LIKE 'new%'")}
+    assert all(cid == 2 for batch in sent for _, cid in batch)
+    assert enrollments(db, 1) == 5 and enrollments(db, 2) == 0
@@ -0,0 +1,162 @@
+import fcntl
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import write_queue
+from conftest import connect
+from db_writer import DatabaseWriter
+from write_queue import (WriteQueue, add_dead_letters, apply_submission, read_dead_letters,
+                         replay_dead_letters)
+
+
+def entry(key, date="2025-01-06", status="Present"):
+    return {"key": key, "shard": "main", "received": time.time(), "attempts": 0,
+            "batches": [{"course_id": 1, "date": date, "statuses": {"1": status}}]}
+
+
+def marks(db):
+    return db.execute("SELECT date, status FROM attendance WHERE student_id=1 AND course_id=1 ORDER BY date").fetchall()
+
+
+def present(db):
+    return db.execute("SELECT present FROM attendance_summary WHERE student_id=1 AND course_id=1").fetchone()[0]
+
+
+@pytest.fixture
+def writer(db_path):
+    writer = DatabaseWriter(db_path)
+    yield writer
+    writer.close()
+
+
+def test_apply_submission_is_idempotent(db):
+    first = apply_submission(db.cursor(), entry("k1"))
+    db.commit()
+    again = apply_submission(db.cursor(), entry("k1", status="Absent"))
+    db.commit()
+    assert again == first
+    assert [tuple(r) for r in marks(db)] == [("2025-01-06", "Present")]
+    assert present(db) == 1
+
+
+def test_orphaned_segment_is_replayed_once(db, writer, tmp_path):
+    journal = tmp_path / "queue"
+    journal.mkdir()
+    # A process died mid-append: the same key twice (a resubmit) and a torn last line.
+    line = json.dumps(entry("crash")) + "\n"
+    (journal / "segment-dead.jsonl").write_text(line + line + '{"key": "to')
+    (journal / "new-dead").write_text("")
+    stale = time.time() - write_queue.NEW_SEGMENT_GRACE - 1
+    os.utime(journal / "new-dead", (stale, stale))
+    (journal / "new-starting").write_text("")  # another process about to lock it
+
+    queue = WriteQueue({"main": writer}, str(journal), fsync=False)
+    queue.close()
+    assert [p.name for p in journal.iterdir()] == ["new-starting"]
+    assert [tuple(r) for r in marks(db)] == [("2025-01-06", "Present")]
+    assert present(db) == 1
+
+    # Starting again finds nothing left to replay.
+    queue = WriteQueue({"main": writer}, str(journal), fsync=False)
+    assert queue.stats()["replayed"] == 0
+    queue.close()
+
+
+def test_queues_starting_together_replay_each_segment_once(db, writer, tmp_path):
+    journal = tmp_path / "queue"
+    journal.mkdir()
+    for i in range(20):
+        (journal / f"segment-dead{i:02d}.jsonl").write_text(json.dumps(entry(f"crash{i}", date=f"2025-01-{i + 1:02d}")))
+    queues, errors = [], []
+
+    def start():
+        try:
+            queues.append(WriteQueue({"main": writer}, str(journal), fsync=False))
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=start) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for queue in queues:
+        queue.close()
+    assert errors == []
+    assert list(journal.iterdir()) == []
+    assert len(marks(db)) == 20 and present(db) == 20
+
+
+def test_segment_removed_by_another_process_is_skipped(db, writer, tmp_path, monkeypatch):
+    journal = tmp_path / "queue"
+    journal.mkdir()
+    segment = journal / "segment-dead.jsonl"
+    segment.write_text(json.dumps(entry("crash")) + "\n")
+    inode = segment.stat().st_ino
+    flock = fcntl.flock
+
+    def peer_replays_first(fd, op):
+        # Another worker removes the segment after we opened it and before we get its lock.
+        if os.fstat(fd).st_ino == inode and segment.exists():
+            segment.unlink()
+        return flock(fd, op)
+    monkeypatch.setattr(fcntl, "flock", peer_replays_first)
+    real_listdir = os.listdir
+    monkeypatch.setattr(os, "listdir", lambda path: real_listdir(path) + ["segment-gone.jsonl"])
+
+    queue = WriteQueue({"main": writer}, str(journal), fsync=False)
+    assert queue.stats()["replayed"] == 0
+    queue.close()
+    assert marks(db) == []
+
+
+def test_resubmitted_key_is_not_applied_again(db, writer, tmp_path):
+    queue = WriteQueue({"main": writer}, str(tmp_path / "queue"), fsync=False)
+    assert queue.submit(db, "k1", entry("k1")["batches"]) == ("queued", None)
+    queue.close()
+    state, results = queue.submit(db, "k1", entry("k1", status="Absent")["batches"])
+    assert state == "committed" and results[0]["inserted"] == 1
+    assert [tuple(r) for r in marks(db)] == [("2025-01-06", "Present")]
+
+
+def test_entry_is_kept_when_dead_lettering_fails(db, writer, tmp_path, monkeypatch):
+    journal = tmp_path / "queue"
+
+    def broken(cur, batches):
+        raise ValueError("bad batch")
+
+    def disk_full(journal_dir, failures):
+        raise OSError(28, "No space left on device")
+    monkeypatch.setattr(write_queue, "save_marks", broken)
+    monkeypatch.setattr(write_queue, "add_dead_letters", disk_full)
+    queue = WriteQueue({"main": writer}, str(journal), fsync=False)
+    queue.submit(db, "k1", entry("k1")["batches"])
+    queue.close()
+    stats = queue.stats()
+    assert stats["depth"] == 0 and stats["failed"] == 1
+    assert "not dead-lettered" in stats["last_error"]
+
+    # The journal outlives the process and its entry is replayed at the next start.
+    monkeypatch.undo()
+    queue = WriteQueue({"main": writer}, str(journal), fsync=False)
+    assert queue.stats()["replayed"] == 1
+    queue.close()
+    assert [tuple(r) for r in marks(db)] == [("2025-01-06", "Present")]
+
+
+def test_replaying_dead_letters_skips_committed_keys(db, tmp_path, db_path):
+    apply_submission(db.cursor(), entry("done"))
+    db.commit()
+    add_dead_letters(str(tmp_path), [(entry("done"), OSError("disk full")),
+                                     (entry("late", date="2025-01-07"), OSError("disk full")),
+                                     ({**entry("gone", date="2025-01-08"), "shard": "north"}, OSError("disk full"))])
+    committed, keep = replay_dead_letters(str(tmp_path), {"main": db_path})
+    assert [e["key"] for e in committed] == ["done", "late"]
+    # An entry that still cannot be applied stays, with its new error.
+    assert [(e["key"], e["error"]) for e in read_dead_letters(str(tmp_path))] == [("gone", "unknown database 'north'")]
+    db = connect(db_path)
+    assert [tuple(r) for r in marks(db)] == [("2025-01-06", "Present"), ("2025-01-07", "Present")]
+    assert present(db) == 2